@@ -1,20 +1,44 @@
+import argparse
+import atexit
+import glob
+import json
+import logging
 import os
+import queue
 import re
 import shutil
+import sqlite3
 import subprocess
+import tempfile
+import threading
 import time
 import urllib.parse
-from typing import Dict, List
+import urllib.request
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
 
-from flask import Flask, jsonify, request, send_file, abort
+from flask import Flask, Response, jsonify, redirect, request, send_file, abort
 from flask_cors import CORS
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.support.ui import WebDriverWait
 from webdriver_manager.chrome import ChromeDriverManager
 from yt_dlp import YoutubeDL
 
+try:
+    import fcntl
+except ImportError:  # Windows: artifact locks then only cover threads of one process
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
 
 def find_chrome_binary() -> str:
     paths = [
@@ -28,29 +52,319 @@ def find_chrome_binary() -> str:
     raise FileNotFoundError("Chrome not found. Please check your installation.")
 
 
-def create_webdriver() -> webdriver.Chrome:
-    chrome_path = find_chrome_binary()
+CHROME_CACHE_FILE = os.environ.get(
+    "FOCUS_CHROME_CACHE", os.path.expanduser("~/.cache/youtube-focus/chrome.json")
+)
+
+
+class ChromeInstall(NamedTuple):
+    binary: str
+    version: str
+    driver_path: str
+
+
+_chrome_install: Optional[ChromeInstall] = None
+_chrome_lock = threading.Lock()
+
+
+def _load_chrome_cache() -> Dict:
+    try:
+        with open(CHROME_CACHE_FILE) as fh:
+            cache = json.load(fh)
+    except (OSError, ValueError):
+        return {"binaries": {}, "drivers": {}}
+    cache.setdefault("binaries", {})
+    cache.setdefault("drivers", {})
+    return cache
+
+
+def _save_chrome_cache(cache: Dict) -> None:
+    os.makedirs(os.path.dirname(CHROME_CACHE_FILE), exist_ok=True)
+    tmp_path = f"{CHROME_CACHE_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as fh:
+        json.dump(cache, fh, indent=2)
+    os.replace(tmp_path, CHROME_CACHE_FILE)
+
+
+def chrome_version(chrome_path: str) -> str:
     version_output = subprocess.check_output([chrome_path, "--version"]).decode()
-    major_version = re.search(r"(\d+)", version_output).group(1)
+    return re.search(r"(\d+(?:\.\d+)*)", version_output).group(1)
+
+
+def install_chromedriver(version: str) -> str:
+    major_version = version.split(".")[0]
+    try:
+        return ChromeDriverManager(version=major_version).install()
+    except TypeError:
+        return ChromeDriverManager().install()
+
+
+def resolve_chrome(refresh: bool = False) -> ChromeInstall:
+    """Find Chrome, its version and a matching ChromeDriver once per process.
+
+    The version is remembered per binary (invalidated when the binary's mtime
+    or size changes) and the driver path per Chrome version, both in
+    ``CHROME_CACHE_FILE``, so a warm start neither forks ``chrome --version``
+    nor asks webdriver-manager to look for a driver.
+    """
+    global _chrome_install
+    with _chrome_lock:
+        if _chrome_install is not None and not refresh:
+            return _chrome_install
+
+        chrome_path = find_chrome_binary()
+        stat = os.stat(os.path.realpath(chrome_path))
+        fingerprint = [stat.st_mtime_ns, stat.st_size]
+        cache = _load_chrome_cache()
+        changed = False
+
+        known = cache["binaries"].get(chrome_path)
+        if not refresh and known and known.get("fingerprint") == fingerprint:
+            version = known["version"]
+        else:
+            version = chrome_version(chrome_path)
+            cache["binaries"][chrome_path] = {"version": version, "fingerprint": fingerprint}
+            changed = True
+
+        driver_path = cache["drivers"].get(version)
+        if refresh or not driver_path or not os.path.exists(driver_path):
+            driver_path = install_chromedriver(version)
+            cache["drivers"][version] = driver_path
+            changed = True
+
+        if changed:
+            try:
+                _save_chrome_cache(cache)
+            except OSError:
+                pass
+
+        _chrome_install = ChromeInstall(chrome_path, version, driver_path)
+        return _chrome_install
+
+
+BROWSER_PROFILE = os.environ.get("FOCUS_BROWSER_PROFILE", "lean")
+
+# Requests the results page never needs: thumbnails, fonts, media, the
+# video player, ads and telemetry. Only DOM text and attributes are read.
+BLOCKED_URL_PATTERNS = [
+    "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*.mp4", "*.webm", "*.m4a",
+    "*i.ytimg.com/*", "*yt3.ggpht.com/*", "*googlevideo.com/*",
+    "*/s/player/*",
+    "*doubleclick.net/*", "*googlesyndication.com/*", "*googleadservices.com/*",
+    "*google-analytics.com/*", "*/pagead/*", "*/ptracking*",
+    "*/youtubei/v1/log_event*", "*/api/stats/*", "*/generate_204*",
+]
+
+
+def create_webdriver(profile: str = BROWSER_PROFILE, capture_network: bool = False) -> webdriver.Chrome:
+    """Start headless Chrome.
+
+    The "lean" profile disables images, blocks ``BLOCKED_URL_PATTERNS``
+    over CDP, returns from ``get`` at DOMContentLoaded and uses a smaller
+    window. "default" is the plain headless browser.
+    """
+    chrome = resolve_chrome()
 
     options = webdriver.ChromeOptions()
-    options.binary_location = chrome_path
+    options.binary_location = chrome.binary
     options.add_argument("--headless=new")
     options.add_argument("--no-sandbox")
     options.add_argument("--disable-dev-shm-usage")
     options.add_argument("--disable-gpu")
 
-    try:
-        driver_path = ChromeDriverManager(version=major_version).install()
-    except TypeError:
-        driver_path = ChromeDriverManager().install()
+    if profile == "lean":
+        options.page_load_strategy = "eager"
+        options.add_argument("--window-size=1024,768")
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_argument("--mute-audio")
+        options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.default_content_setting_values.notifications": 2,
+        })
+    if capture_network:
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+    driver = webdriver.Chrome(service=Service(chrome.driver_path), options=options)
+
+    if profile == "lean":
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+        except WebDriverException:
+            pass
+    return driver
+
+
+DRIVER_POOL_SIZE = int(os.environ.get("FOCUS_DRIVER_POOL_SIZE", "2"))
+DRIVER_MAX_USES = int(os.environ.get("FOCUS_DRIVER_MAX_USES", "50"))
+DRIVER_MAX_RSS_MB = int(os.environ.get("FOCUS_DRIVER_MAX_RSS_MB", "1024"))
+DRIVER_CHECKOUT_TIMEOUT = float(os.environ.get("FOCUS_DRIVER_CHECKOUT_TIMEOUT", "30"))
+
+
+class DriverPoolExhausted(RuntimeError):
+    pass
+
+
+def process_tree_rss_mb(pid: int) -> float:
+    total_kb = 0
+    pending = [pid]
+    seen = set()
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        try:
+            with open(f"/proc/{current}/status") as fh:
+                for line in fh:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+                        break
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as fh:
+                    pending.extend(int(child) for child in fh.read().split())
+        except (OSError, ValueError):
+            continue
+    return total_kb / 1024
+
+
+class DriverPool:
+    """Bounded pool of warm headless Chrome sessions.
+
+    At most ``size`` drivers exist at once. Callers that find every driver
+    checked out wait up to ``checkout_timeout`` seconds and then get
+    ``DriverPoolExhausted``. Drivers are recycled after ``max_uses`` searches
+    or once Chrome's resident memory grows past ``max_rss_mb``.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], webdriver.Chrome],
+        size: int,
+        max_uses: int,
+        max_rss_mb: int,
+        checkout_timeout: float,
+    ):
+        self._factory = factory
+        self._size = size
+        self._max_uses = max_uses
+        self._max_rss_mb = max_rss_mb
+        self._checkout_timeout = checkout_timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: "queue.LifoQueue[webdriver.Chrome]" = queue.LifoQueue()
+        self._uses: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def warm(self, count: Optional[int] = None) -> None:
+        count = self._size if count is None else min(count, self._size)
+        with self._lock:
+            missing = count - len(self._uses)
+        for _ in range(missing):
+            if not self._slots.acquire(blocking=False):
+                break
+            try:
+                self._idle.put(self._launch())
+            finally:
+                self._slots.release()
+
+    def checkout(self) -> webdriver.Chrome:
+        if not self._slots.acquire(timeout=self._checkout_timeout):
+            raise DriverPoolExhausted("All browser sessions are busy")
+        try:
+            while True:
+                try:
+                    driver = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._launch()
+                if self._is_healthy(driver):
+                    return driver
+                self._retire(driver)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def checkin(self, driver: webdriver.Chrome, discard: bool = False) -> None:
+        try:
+            with self._lock:
+                uses = self._uses.get(id(driver), 0) + 1
+                self._uses[id(driver)] = uses
+            if discard or uses >= self._max_uses or self._rss_mb(driver) > self._max_rss_mb:
+                self._retire(driver)
+                return
+            try:
+                driver.get("about:blank")
+            except WebDriverException:
+                self._retire(driver)
+                return
+            self._idle.put(driver)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def driver(self) -> Iterator[webdriver.Chrome]:
+        driver = self.checkout()
+        try:
+            yield driver
+        except WebDriverException:
+            self.checkin(driver, discard=True)
+            raise
+        except BaseException:
+            self.checkin(driver)
+            raise
+        else:
+            self.checkin(driver)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._retire(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def _launch(self) -> webdriver.Chrome:
+        driver = self._factory()
+        with self._lock:
+            self._uses[id(driver)] = 0
+        return driver
+
+    def _retire(self, driver: webdriver.Chrome) -> None:
+        with self._lock:
+            self._uses.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
 
-    return webdriver.Chrome(service=Service(driver_path), options=options)
+    @staticmethod
+    def _is_healthy(driver: webdriver.Chrome) -> bool:
+        try:
+            return driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    @staticmethod
+    def _rss_mb(driver: webdriver.Chrome) -> float:
+        try:
+            return process_tree_rss_mb(driver.service.process.pid)
+        except Exception:
+            return 0.0
+
+
+driver_pool = DriverPool(
+    create_webdriver,
+    size=DRIVER_POOL_SIZE,
+    max_uses=DRIVER_MAX_USES,
+    max_rss_mb=DRIVER_MAX_RSS_MB,
+    checkout_timeout=DRIVER_CHECKOUT_TIMEOUT,
+)
+atexit.register(driver_pool.close)
 
 
 def duration_to_seconds(duration: str) -> int:
     parts = list(map(int, duration.strip().split(":")))
-    h, m, s = (parts + [0, 0, 0])[-3:]
+    h, m, s = ([0, 0, 0] + parts)[-3:]
     return h * 3600 + m * 60 + s
 
 
@@ -60,115 +374,881 @@ def format_subscriber_count(subs: str) -> str:
     return subs.replace("subscribers", "").replace("subscriber", "").strip()
 
 
-def search_videos(query: str, filter_type: str) -> List[Dict[str, str]]:
-    driver = create_webdriver()
+def format_duration(seconds: Optional[int]) -> str:
+    if not seconds:
+        return ""
+    h, rest = divmod(int(seconds), 3600)
+    m, s = divmod(rest, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m}:{s:02d}"
+
+
+def format_follower_count(count: Optional[int]) -> str:
+    if not count:
+        return ""
+    for limit, suffix in ((1_000_000_000, "B"), (1_000_000, "M"), (1_000, "K")):
+        if count >= limit:
+            return f"{count / limit:.1f}".rstrip("0").rstrip(".") + suffix
+    return str(count)
+
+
+def matches_duration_filter(seconds: Optional[int], filter_type: str) -> bool:
+    if filter_type == "short":
+        return seconds is not None and seconds < 240
+    if filter_type == "medium":
+        return seconds is not None and 240 <= seconds <= 1200
+    if filter_type == "long":
+        return seconds is not None and seconds > 1200
+    return True
+
+
+SEARCH_DEADLINE = float(os.environ.get("FOCUS_SEARCH_DEADLINE", "8"))
+RESULTS_SETTLE = float(os.environ.get("FOCUS_RESULTS_SETTLE", "0.3"))
+
+VIDEO_SELECTOR = "ytd-video-renderer"
+CHANNEL_SELECTOR = "ytd-channel-renderer"
+ANY_RESULT_SELECTOR = (
+    "ytd-video-renderer, ytd-channel-renderer, ytd-playlist-renderer, "
+    "ytd-background-promo-renderer"
+)
+RESULT_COUNT_SCRIPT = "return arguments[0].map(s => document.querySelectorAll(s).length);"
+
+search_wait_stats = {"waits": 0, "timeouts": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+_search_wait_lock = threading.Lock()
+
+
+def record_search_wait(seconds: float, timed_out: bool) -> None:
+    with _search_wait_lock:
+        search_wait_stats["waits"] += 1
+        search_wait_stats["timeouts"] += int(timed_out)
+        search_wait_stats["total_seconds"] += seconds
+        search_wait_stats["max_seconds"] = max(search_wait_stats["max_seconds"], seconds)
+
+
+class ResultsReady:
+    """WebDriverWait condition for a rendered results page.
+
+    True once every selector in ``targets`` has reached its cap, or once the
+    page shows results and their counts have not changed for ``settle``
+    seconds (fewer results than the cap exist).
+    """
+
+    def __init__(self, targets: Dict[str, int], settle: float = RESULTS_SETTLE):
+        self._selectors = list(targets) + [ANY_RESULT_SELECTOR]
+        self._caps = list(targets.values())
+        self._settle = settle
+        self._last_counts: Optional[List[int]] = None
+        self._stable_since = 0.0
+
+    def __call__(self, driver: webdriver.Chrome) -> bool:
+        *counts, any_results = driver.execute_script(RESULT_COUNT_SCRIPT, self._selectors)
+        if not any_results:
+            return False
+        if all(count >= cap for count, cap in zip(counts, self._caps)):
+            return True
+
+        now = time.monotonic()
+        if counts != self._last_counts:
+            self._last_counts = counts
+            self._stable_since = now
+            return False
+        return now - self._stable_since >= self._settle
+
+
+DURATION_FILTER_PARAMS = {"short": "EgIYAQ==", "medium": "EgIYAw==", "long": "EgIYAg=="}
+CHANNEL_FILTER_PARAM = "EgIQAg=="
+
+
+def results_url(query: str, sp: Optional[str] = None) -> str:
+    """YouTube results page for ``query``, filtered server-side by ``sp``."""
+    params = {"search_query": query}
+    if sp:
+        params["sp"] = sp
+    return "https://www.youtube.com/results?" + urllib.parse.urlencode(params)
+
+
+def load_search_results(
+    driver: webdriver.Chrome,
+    url: str,
+    targets: Dict[str, int],
+    deadline: float = SEARCH_DEADLINE,
+) -> bool:
+    """Open ``url`` and wait for ``targets``; False if the deadline passed first."""
+    started = time.monotonic()
+    driver.implicitly_wait(0)
+    driver.get(url)
+
+    loaded = time.monotonic()
+    remaining = max(0.0, deadline - (loaded - started))
+    timed_out = False
     try:
-        driver.get("https://www.youtube.com")
-        driver.implicitly_wait(5)
+        WebDriverWait(driver, remaining, poll_frequency=0.1).until(ResultsReady(targets))
+    except TimeoutException:
+        timed_out = True
 
-        search_box = driver.find_element(By.NAME, "search_query")
-        search_box.send_keys(query + Keys.RETURN)
-        time.sleep(3)
+    waited = time.monotonic() - loaded
+    record_search_wait(waited, timed_out)
+    logger.info(
+        "Results for %s %s after %.2fs",
+        url, "timed out" if timed_out else "ready", waited,
+    )
+    return not timed_out
 
-        results = []
-        video_elements = driver.find_elements(By.CSS_SELECTOR, "ytd-video-renderer")[:12]
 
-        for video in video_elements:
+def extract_videos(driver: webdriver.Chrome, filter_type: str, limit: int = 8) -> List[Dict[str, str]]:
+    results = []
+    video_elements = driver.find_elements(By.CSS_SELECTOR, VIDEO_SELECTOR)[:max(12, limit)]
+
+    for video in video_elements:
+        try:
+            title_element = video.find_element(By.ID, "video-title")
+            href = title_element.get_attribute("href") or ""
+
+            if "v=" not in href:
+                continue
+
+            video_id = href.split("v=")[1].split("&")[0]
+            title = title_element.text.strip()
+
             try:
-                title_element = video.find_element(By.ID, "video-title")
-                href = title_element.get_attribute("href") or ""
+                duration_element = video.find_element(By.CSS_SELECTOR, "ytd-thumbnail-overlay-time-status-renderer span")
+                duration = duration_element.text.strip()
+                seconds = duration_to_seconds(duration) if duration else None
+            except Exception:
+                duration = ""
+                seconds = None
 
-                if "v=" not in href:
-                    continue
+            if not matches_duration_filter(seconds, filter_type):
+                continue
 
-                video_id = href.split("v=")[1].split("&")[0]
-                title = title_element.text.strip()
+            thumbnail = f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"
 
-                try:
-                    duration_element = video.find_element(By.CSS_SELECTOR, "ytd-thumbnail-overlay-time-status-renderer span")
-                    duration = duration_element.text.strip()
-                    seconds = duration_to_seconds(duration) if duration else None
-                except Exception:
-                    duration = ""
-                    seconds = None
-
-                if filter_type == "short" and (seconds is None or seconds >= 240):
-                    continue
-                elif filter_type == "medium" and (seconds is None or seconds < 240 or seconds > 1200):
-                    continue
-                elif filter_type == "long" and (seconds is None or seconds <= 1200):
-                    continue
+            results.append({
+                "id": video_id,
+                "title": title,
+                "thumb": thumbnail,
+                "dur": duration,
+            })
 
-                thumbnail = f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"
+            if len(results) >= limit:
+                break
+        except Exception:
+            continue
+    return results
 
-                results.append({
-                    "id": video_id,
-                    "title": title,
-                    "thumb": thumbnail,
-                    "dur": duration,
-                })
 
-                if len(results) >= 8:
-                    break
+def extract_channels(driver: webdriver.Chrome) -> List[Dict[str, str]]:
+    channels = []
+    channel_elements = driver.find_elements(By.CSS_SELECTOR, CHANNEL_SELECTOR)[:8]
+
+    for channel in channel_elements:
+        try:
+            title_element = channel.find_element(By.ID, "channel-title")
+            title = title_element.text.strip()
+
+            url_element = channel.find_element(By.ID, "main-link")
+            url = url_element.get_attribute("href")
+
+            try:
+                subs_element = channel.find_element(By.ID, "subscribers")
+                subscribers = format_subscriber_count(subs_element.text)
             except Exception:
+                subscribers = ""
+
+            try:
+                img_element = channel.find_element(By.CSS_SELECTOR, "img")
+                thumbnail = img_element.get_attribute("src") or ""
+                if thumbnail.startswith("data:") or not thumbnail:
+                    thumbnail = img_element.get_attribute("data-thumb") or ""
+            except Exception:
+                thumbnail = ""
+
+            channels.append({
+                "title": title,
+                "url": url,
+                "thumb": thumbnail,
+                "subs": subscribers,
+            })
+        except Exception:
+            continue
+    return channels
+
+
+SEARCH_EXTRACTION = os.environ.get("FOCUS_SEARCH_EXTRACTION", "script")
+
+EXTRACT_RESULTS_SCRIPT = """
+const [videoCap, channelCap] = arguments;
+const text = (root, selector) => {
+    const el = root.querySelector(selector);
+    return el ? (el.innerText || el.textContent || "").trim() : "";
+};
+const videos = [...document.querySelectorAll("ytd-video-renderer")].slice(0, videoCap).map(v => {
+    const title = v.querySelector("#video-title");
+    return {
+        href: title ? title.href || "" : "",
+        title: title ? (title.innerText || title.textContent || "").trim() : "",
+        duration: text(v, "ytd-thumbnail-overlay-time-status-renderer span"),
+    };
+});
+const channels = [...document.querySelectorAll("ytd-channel-renderer")].slice(0, channelCap).map(c => {
+    const link = c.querySelector("#main-link");
+    const img = c.querySelector("img");
+    return {
+        title: text(c, "#channel-title"),
+        url: link ? link.href || "" : "",
+        subs: text(c, "#subscribers"),
+        src: img ? img.src || "" : "",
+        dataThumb: img ? img.getAttribute("data-thumb") || "" : "",
+    };
+});
+return {videos, channels};
+"""
+
+
+def parse_video_items(
+    items: List[Dict[str, str]], filter_type: str, limit: int = 8
+) -> List[Dict[str, str]]:
+    results = []
+    for item in items:
+        href = item.get("href") or ""
+        if "v=" not in href:
+            continue
+        video_id = href.split("v=")[1].split("&")[0]
+
+        duration = item.get("duration") or ""
+        try:
+            seconds = duration_to_seconds(duration) if duration else None
+        except ValueError:
+            duration = ""
+            seconds = None
+
+        if not matches_duration_filter(seconds, filter_type):
+            continue
+
+        results.append({
+            "id": video_id,
+            "title": item.get("title") or "",
+            "thumb": f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+            "dur": duration,
+        })
+
+        if len(results) >= limit:
+            break
+    return results
+
+
+def parse_channel_items(items: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    channels = []
+    for item in items:
+        if not item.get("title") or not item.get("url"):
+            continue
+        thumbnail = item.get("src") or ""
+        if thumbnail.startswith("data:") or not thumbnail:
+            thumbnail = item.get("dataThumb") or ""
+
+        channels.append({
+            "title": item["title"],
+            "url": item["url"],
+            "thumb": thumbnail,
+            "subs": format_subscriber_count(item.get("subs") or ""),
+        })
+    return channels
+
+
+def extract_results(
+    driver: webdriver.Chrome,
+    filter_type: str,
+    video_cap: int = 12,
+    channel_cap: int = 8,
+    limit: int = 8,
+) -> Dict[str, List[Dict[str, str]]]:
+    """Videos and channels on a loaded results page; a cap of 0 skips that kind.
+
+    ``video_cap`` renderers are read and up to ``limit`` videos that pass
+    ``filter_type`` are returned.
+
+    In the default "script" mode one ``execute_script`` call returns every
+    field of every renderer, instead of several WebDriver round-trips per
+    result in "webdriver" mode.
+    """
+    if SEARCH_EXTRACTION == "webdriver":
+        return {
+            "videos": extract_videos(driver, filter_type, limit) if video_cap else [],
+            "channels": extract_channels(driver) if channel_cap else [],
+        }
+
+    raw = driver.execute_script(EXTRACT_RESULTS_SCRIPT, video_cap, channel_cap) or {}
+    return {
+        "videos": parse_video_items(raw.get("videos") or [], filter_type, limit),
+        "channels": parse_channel_items(raw.get("channels") or []),
+    }
+
+
+SEARCH_BACKEND = os.environ.get("FOCUS_SEARCH_BACKEND", "selenium")
+
+
+class SearchFailed(RuntimeError):
+    """The search backend could not produce results for a query."""
+
+
+class SearchIncomplete(SearchFailed):
+    """The results page did not finish loading in time.
+
+    ``results`` holds whatever was read from it; it can be shown, but must
+    not be cached as the answer for the query.
+    """
+
+    def __init__(self, results: Any):
+        super().__init__("Search results did not load in time")
+        self.results = results
+
+
+class SearchEngine(ABC):
+    """A way of turning a query into the result dicts the frontends render.
+
+    Videos are ``{id, title, thumb, dur}`` and channels are
+    ``{title, url, thumb, subs}``. ``search`` returns both; backends that can
+    produce them from one request should override it.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def videos(self, query: str, filter_type: str, limit: int = 8) -> List[Dict[str, str]]:
+        ...
+
+    @abstractmethod
+    def channels(self, query: str) -> List[Dict[str, str]]:
+        ...
+
+    def search(self, query: str, filter_type: str, limit: int = 8) -> Dict[str, List[Dict[str, str]]]:
+        return {
+            "videos": self.videos(query, filter_type, limit),
+            "channels": self.channels(query),
+        }
+
+
+class SeleniumSearchEngine(SearchEngine):
+    """Scrapes the results page in a pooled headless Chrome."""
+
+    name = "selenium"
+
+    def videos(self, query: str, filter_type: str, limit: int = 8) -> List[Dict[str, str]]:
+        url = results_url(query, DURATION_FILTER_PARAMS.get(filter_type))
+        video_cap = max(12, limit)
+        with driver_pool.driver() as driver:
+            ready = load_search_results(driver, url, {VIDEO_SELECTOR: video_cap})
+            videos = extract_results(
+                driver, filter_type, video_cap=video_cap, channel_cap=0, limit=limit
+            )["videos"]
+        if not ready:
+            raise SearchIncomplete(videos)
+        return videos
+
+    def channels(self, query: str) -> List[Dict[str, str]]:
+        url = results_url(query, CHANNEL_FILTER_PARAM)
+        with driver_pool.driver() as driver:
+            ready = load_search_results(driver, url, {CHANNEL_SELECTOR: 8})
+            channels = extract_results(driver, "all", video_cap=0)["channels"]
+        if not ready:
+            raise SearchIncomplete(channels)
+        return channels
+
+    def search(self, query: str, filter_type: str, limit: int = 8) -> Dict[str, List[Dict[str, str]]]:
+        # A duration filter in sp= would hide channel results, so the combined
+        # page is loaded unfiltered and durations are filtered locally.
+        video_cap = max(12, limit)
+        with driver_pool.driver() as driver:
+            ready = load_search_results(
+                driver, results_url(query), {VIDEO_SELECTOR: video_cap, CHANNEL_SELECTOR: 8}
+            )
+            page = extract_results(driver, filter_type, video_cap=video_cap, limit=limit)
+        if not ready:
+            raise SearchIncomplete(page)
+        return page
+
+
+class YtDlpSearchEngine(SearchEngine):
+    """Reads YouTube's search results through yt-dlp, without a browser.
+
+    Unfiltered videos come from the flat ``ytsearchN:`` extractor. Duration
+    filtered videos and channels are read from the results page with the
+    matching ``sp=`` filter, since the search prefix takes no filters and
+    only yields videos.
+    """
+
+    name = "ytdlp"
+
+    def _entries(self, url: str, limit: int) -> List[Dict]:
+        ydl_opts = {
+            "quiet": True,
+            "skip_download": True,
+            "extract_flat": "in_playlist",
+            "playlistend": limit,
+        }
+        try:
+            with YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(url, download=False)
+        except Exception as e:
+            raise SearchFailed(f"yt-dlp search failed: {e}") from e
+        return list(info.get("entries") or [])[:limit]
+
+    def videos(self, query: str, filter_type: str, limit: int = 8) -> List[Dict[str, str]]:
+        scan = max(12, limit)
+        if filter_type in DURATION_FILTER_PARAMS:
+            source = results_url(query, DURATION_FILTER_PARAMS[filter_type])
+        else:
+            source = f"ytsearch{scan}:{query}"
+        results = []
+        for entry in self._entries(source, scan):
+            video_id = entry.get("id")
+            if not video_id:
+                continue
+
+            seconds = int(entry["duration"]) if entry.get("duration") else None
+            if not matches_duration_filter(seconds, filter_type):
                 continue
+
+            results.append({
+                "id": video_id,
+                "title": entry.get("title", ""),
+                "thumb": f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+                "dur": entry.get("duration_string") or format_duration(seconds),
+            })
+
+            if len(results) >= limit:
+                break
         return results
-    finally:
-        driver.quit()
 
+    def channels(self, query: str) -> List[Dict[str, str]]:
+        channels = []
+        for entry in self._entries(results_url(query, CHANNEL_FILTER_PARAM), 8):
+            channel_url = entry.get("channel_url") or entry.get("url")
+            if not channel_url or "/watch" in channel_url:
+                continue
 
-def search_channels(query: str) -> List[Dict[str, str]]:
-    driver = create_webdriver()
+            thumbnails = entry.get("thumbnails") or []
+            thumbnail = thumbnails[-1].get("url", "") if thumbnails else ""
+            if thumbnail.startswith("//"):
+                thumbnail = "https:" + thumbnail
+
+            channels.append({
+                "title": entry.get("title") or entry.get("channel") or "",
+                "url": channel_url,
+                "thumb": thumbnail,
+                "subs": format_follower_count(entry.get("channel_follower_count")),
+            })
+        return channels
+
+
+SEARCH_ENGINES: Dict[str, Callable[[], SearchEngine]] = {
+    SeleniumSearchEngine.name: SeleniumSearchEngine,
+    YtDlpSearchEngine.name: YtDlpSearchEngine,
+}
+
+
+def get_search_engine(name: str) -> SearchEngine:
     try:
-        driver.get("https://www.youtube.com")
-        driver.implicitly_wait(5)
+        return SEARCH_ENGINES[name]()
+    except KeyError:
+        raise ValueError(
+            f"Unknown search backend {name!r}, expected one of: {', '.join(SEARCH_ENGINES)}"
+        ) from None
 
-        search_box = driver.find_element(By.NAME, "search_query")
-        search_box.send_keys(query + Keys.RETURN)
-        time.sleep(2)
 
-        channels = []
-        channel_elements = driver.find_elements(By.CSS_SELECTOR, "ytd-channel-renderer")[:8]
+search_engine = get_search_engine(SEARCH_BACKEND)
 
-        for channel in channel_elements:
-            try:
-                title_element = channel.find_element(By.ID, "channel-title")
-                title = title_element.text.strip()
 
-                url_element = channel.find_element(By.ID, "main-link")
-                url = url_element.get_attribute("href")
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one execution.
 
-                try:
-                    subs_element = channel.find_element(By.ID, "subscribers")
-                    subscribers = format_subscriber_count(subs_element.text)
-                except Exception:
-                    subscribers = ""
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait for it and receive the same result or exception.
+    """
 
-                try:
-                    img_element = channel.find_element(By.CSS_SELECTOR, "img")
-                    thumbnail = img_element.get_attribute("src") or ""
-                    if thumbnail.startswith("data:") or not thumbnail:
-                        thumbnail = img_element.get_attribute("data-thumb") or ""
-                except Exception:
-                    thumbnail = ""
-
-                channels.append({
-                    "title": title,
-                    "url": url,
-                    "thumb": thumbnail,
-                    "subs": subscribers,
-                })
-            except Exception:
-                continue
-        return channels
-    finally:
-        driver.quit()
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result: Any = None
+            self.error: Optional[BaseException] = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, "SingleFlight._Call"] = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlight._Call()
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        return {"executed": self.executed, "shared": self.shared, "in_flight": len(self._calls)}
+
+
+search_flights = SingleFlight()
+
+
+SEARCH_CACHE_BACKEND = os.environ.get("FOCUS_SEARCH_CACHE", "memory")
+SEARCH_CACHE_TTL = float(os.environ.get("FOCUS_SEARCH_CACHE_TTL", "600"))
+# Empty result lists are kept briefly: they are as likely a throttled
+# request as a query with no results.
+SEARCH_CACHE_EMPTY_TTL = float(os.environ.get("FOCUS_SEARCH_CACHE_EMPTY_TTL", "30"))
+SEARCH_CACHE_SIZE = int(os.environ.get("FOCUS_SEARCH_CACHE_SIZE", "512"))
+SEARCH_CACHE_PATH = os.environ.get(
+    "FOCUS_SEARCH_CACHE_PATH", os.path.expanduser("~/.cache/youtube-focus/search-cache.sqlite3")
+)
+SEARCH_CACHE_URL = os.environ.get("FOCUS_SEARCH_CACHE_URL", "redis://localhost:6379/0")
+RAW_VIDEO_LIMIT = 20
+
+
+class ResultCache(ABC):
+    """TTL cache of JSON-serialisable search results with hit/miss counters.
+
+    Subclasses store entries and enforce ``max_entries`` with LRU eviction.
+    A failing backend is treated as a miss rather than failing the search.
+    """
+
+    name = ""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            value = self._get(key)
+        except Exception as e:
+            logger.warning("Search cache lookup failed: %s", e)
+            value = None
+        with self._counter_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        try:
+            self._set(key, value, self.ttl if ttl is None else ttl)
+        except Exception as e:
+            logger.warning("Search cache store failed: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        try:
+            entries = self._size()
+        except Exception:
+            entries = None
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    def _set(self, key: str, value: Any, ttl: float) -> None:
+        ...
+
+    @abstractmethod
+    def _size(self) -> int:
+        ...
+
+
+class MemoryResultCache(ResultCache):
+    """Per-process cache; entries are lost on restart."""
+
+    name = "memory"
+
+    def __init__(self, ttl: float, max_entries: int):
+        super().__init__(ttl, max_entries)
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _size(self) -> int:
+        return len(self._entries)
+
+
+class SqliteResultCache(ResultCache):
+    """Cache in a sqlite file, shared by every worker on the host."""
+
+    name = "sqlite"
+
+    def __init__(self, ttl: float, max_entries: int, path: str):
+        super().__init__(ttl, max_entries)
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS search_cache_accessed ON search_cache (accessed)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _get(self, key: str) -> Optional[Any]:
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value FROM search_cache WHERE key = ? AND expires > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE search_cache SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def _set(self, key: str, value: Any, ttl: float) -> None:
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO search_cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now + ttl, now),
+        )
+        conn.execute("DELETE FROM search_cache WHERE expires <= ?", (now,))
+        conn.execute(
+            "DELETE FROM search_cache WHERE key IN "
+            "(SELECT key FROM search_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def _size(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+
+
+class RedisResultCache(ResultCache):
+    """Cache in Redis or any server speaking its protocol.
+
+    Redis expires entries itself; a sorted set of access times keeps the
+    number of entries within ``max_entries``.
+    """
+
+    name = "redis"
+
+    def __init__(self, ttl: float, max_entries: int, url: str, prefix: str = "focus:search:"):
+        super().__init__(ttl, max_entries)
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("FOCUS_SEARCH_CACHE=redis requires the 'redis' package") from None
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self._lru_key = prefix + "lru"
+
+    def _get(self, key: str) -> Optional[Any]:
+        raw = self._client.get(self._prefix + key)
+        if raw is None:
+            return None
+        self._client.zadd(self._lru_key, {key: time.time()})
+        return json.loads(raw)
+
+    def _set(self, key: str, value: Any, ttl: float) -> None:
+        now = time.time()
+        pipe = self._client.pipeline()
+        pipe.set(self._prefix + key, json.dumps(value), px=int(ttl * 1000))
+        pipe.zadd(self._lru_key, {key: now})
+        pipe.zremrangebyscore(self._lru_key, "-inf", now - self.ttl)
+        pipe.zcard(self._lru_key)
+        overflow = pipe.execute()[-1] - self.max_entries
+        if overflow > 0:
+            evicted = [member for member, _ in self._client.zpopmin(self._lru_key, overflow)]
+            self._client.delete(*(self._prefix + member.decode() for member in evicted))
+
+    def _size(self) -> int:
+        return self._client.zcard(self._lru_key)
+
+
+def create_search_cache(backend: str) -> ResultCache:
+    if backend == "memory":
+        return MemoryResultCache(SEARCH_CACHE_TTL, SEARCH_CACHE_SIZE)
+    if backend == "sqlite":
+        return SqliteResultCache(SEARCH_CACHE_TTL, SEARCH_CACHE_SIZE, SEARCH_CACHE_PATH)
+    if backend == "redis":
+        return RedisResultCache(SEARCH_CACHE_TTL, SEARCH_CACHE_SIZE, SEARCH_CACHE_URL)
+    if backend == "none":
+        return MemoryResultCache(SEARCH_CACHE_TTL, 0)
+    raise ValueError(
+        f"Unknown search cache {backend!r}, expected one of: memory, sqlite, redis, none"
+    )
+
+
+search_cache = create_search_cache(SEARCH_CACHE_BACKEND)
+
+
+def search_cache_key(kind: str, query: str, filter_type: str = "all") -> str:
+    normalized = " ".join(query.casefold().split())
+    return f"{kind}:{filter_type}:{normalized}"
+
+
+def cache_results(key: str, results: Any) -> None:
+    """Store complete results; empty ones only for SEARCH_CACHE_EMPTY_TTL."""
+    search_cache.set(key, results, SEARCH_CACHE_TTL if results else SEARCH_CACHE_EMPTY_TTL)
+
+
+def select_videos(videos: List[Dict[str, str]], filter_type: str, limit: int = 8) -> List[Dict[str, str]]:
+    selected = []
+    for video in videos:
+        try:
+            seconds = duration_to_seconds(video["dur"]) if video.get("dur") else None
+        except ValueError:
+            seconds = None
+        if matches_duration_filter(seconds, filter_type):
+            selected.append(video)
+            if len(selected) >= limit:
+                break
+    return selected
+
+
+def search_videos(query: str, filter_type: str) -> List[Dict[str, str]]:
+    """Videos for ``query``, cached per (normalized query, filter).
+
+    Unfiltered searches fetch and cache a longer raw result list. Filtered
+    searches are served from that raw list when it holds a full page of
+    matching videos, and otherwise ask the engine for server-side filtering.
+    Concurrent misses for the same key share one engine call. Results of a
+    page that did not finish loading are returned but not cached.
+    """
+    key = search_cache_key("videos", query, filter_type)
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+    return search_flights.do(key, lambda: _search_videos(query, filter_type, key))
+
+
+def _search_videos(query: str, filter_type: str, key: str) -> List[Dict[str, str]]:
+    raw_key = search_cache_key("raw", query)
+    raw = search_cache.get(raw_key)
+    complete = True
+    if raw is None and filter_type not in DURATION_FILTER_PARAMS:
+        try:
+            raw = search_engine.videos(query, "all", limit=RAW_VIDEO_LIMIT)
+            cache_results(raw_key, raw)
+        except SearchIncomplete as e:
+            raw, complete = e.results, False
+
+    results = select_videos(raw, filter_type) if raw is not None else []
+    if len(results) < 8 and filter_type in DURATION_FILTER_PARAMS:
+        try:
+            results, complete = search_engine.videos(query, filter_type), True
+        except SearchIncomplete as e:
+            results, complete = e.results, False
+
+    if complete:
+        cache_results(key, results)
+    return results
+
+
+def search_channels(query: str) -> List[Dict[str, str]]:
+    key = search_cache_key("channels", query)
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+
+    def fetch() -> List[Dict[str, str]]:
+        try:
+            results = search_engine.channels(query)
+        except SearchIncomplete as e:
+            return e.results
+        cache_results(key, results)
+        return results
+
+    return search_flights.do(key, fetch)
+
+
+def search_all(query: str, filter_type: str) -> Dict[str, List[Dict[str, str]]]:
+    """Videos and channels for ``query``, in as few backend round-trips as possible.
+
+    The unfiltered page is cached once and every duration filter is applied
+    to it locally.
+    """
+    raw_key = search_cache_key("raw", query)
+    channels_key = search_cache_key("page-channels", query)
+    raw = search_cache.get(raw_key)
+    channels = search_cache.get(channels_key)
+
+    if raw is None or channels is None:
+        def fetch() -> Dict[str, List[Dict[str, str]]]:
+            try:
+                page = search_engine.search(query, "all", limit=RAW_VIDEO_LIMIT)
+            except SearchIncomplete as e:
+                return e.results
+            cache_results(raw_key, page["videos"])
+            cache_results(channels_key, page["channels"])
+            return page
+
+        page = search_flights.do(search_cache_key("page", query), fetch)
+        raw, channels = page["videos"], page["channels"]
+
+    return {"videos": select_videos(raw, filter_type), "channels": channels}
 
 
 def fetch_channel_videos(channel_url: str, max_videos: int = 36) -> List[Dict[str, str]]:
     if not channel_url.rstrip("/").endswith("/videos"):
         channel_url = channel_url.rstrip("/") + "/videos"
+    return search_flights.do(
+        f"channel:{max_videos}:{channel_url}",
+        lambda: _fetch_channel_videos(channel_url, max_videos),
+    )
+
 
+def _fetch_channel_videos(channel_url: str, max_videos: int) -> List[Dict[str, str]]:
     ydl_opts = {
         "quiet": True,
         "skip_download": True,
@@ -196,6 +1276,850 @@ def fetch_channel_videos(channel_url: str, max_videos: int = 36) -> List[Dict[st
         return []
 
 
+def _network_totals(driver: webdriver.Chrome) -> Dict[str, int]:
+    transferred = 0
+    requests_made = 0
+    for entry in driver.get_log("performance"):
+        message = json.loads(entry["message"])["message"]
+        if message["method"] == "Network.loadingFinished":
+            transferred += int(message["params"].get("encodedDataLength", 0))
+            requests_made += 1
+    return {"bytes": transferred, "requests": requests_made}
+
+
+def benchmark_browser_profiles(query: str, runs: int = 3) -> Dict[str, Dict[str, float]]:
+    """Time a cold-cache results page load under each browser profile.
+
+    Reports the mean seconds until results are ready and the mean bytes
+    and requests that went over the network.
+    """
+    report = {}
+    for profile in ("default", "lean"):
+        driver = create_webdriver(profile, capture_network=True)
+        samples = []
+        try:
+            for _ in range(runs):
+                driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+                driver.get("about:blank")
+                driver.get_log("performance")
+
+                started = time.monotonic()
+                load_search_results(driver, results_url(query), {VIDEO_SELECTOR: 12})
+                elapsed = time.monotonic() - started
+                samples.append({"seconds": elapsed, **_network_totals(driver)})
+        finally:
+            driver.quit()
+
+        report[profile] = {
+            key: sum(sample[key] for sample in samples) / len(samples)
+            for key in ("seconds", "bytes", "requests")
+        }
+    return report
+
+
+DOWNLOAD_WORKERS = int(os.environ.get("FOCUS_DOWNLOAD_WORKERS", "2"))
+DOWNLOAD_QUEUE_LIMIT = int(os.environ.get("FOCUS_DOWNLOAD_QUEUE_LIMIT", "32"))
+DOWNLOAD_JOB_TTL = float(os.environ.get("FOCUS_DOWNLOAD_JOB_TTL", "3600"))
+DOWNLOAD_DIR = os.environ.get("FOCUS_DOWNLOAD_DIR", os.path.expanduser("~/.cache/youtube-focus/downloads"))
+DOWNLOAD_QUOTA_MB = float(os.environ.get("FOCUS_DOWNLOAD_QUOTA_MB", "4096"))
+DOWNLOAD_QUALITY = {"mp4": "720", "mp3": "192", "m4a": "copy", "opus": "copy"}
+DOWNLOAD_MIMETYPES = {"mp4": "video/mp4", "mp3": "audio/mpeg", "m4a": "audio/mp4", "opus": "audio/ogg"}
+DOWNLOAD_STREAMING = os.environ.get("FOCUS_DOWNLOAD_STREAMING", "1") != "0"
+DOWNLOAD_STREAM_WAIT = float(os.environ.get("FOCUS_DOWNLOAD_STREAM_WAIT", "20"))
+# "pipe": audio goes straight from YouTube through ffmpeg into the artifact
+# file; "postprocess": yt-dlp downloads the audio, then converts it.
+AUDIO_PIPELINE = os.environ.get("FOCUS_AUDIO_PIPELINE", "pipe")
+TRANSCODE_SLOTS = int(os.environ.get("FOCUS_TRANSCODE_SLOTS", str(os.cpu_count() or 2)))
+# Per-request byte range for piped audio; YouTube throttles whole-file reads.
+AUDIO_RANGE_BYTES = 10 << 20
+# Audio formats: yt-dlp format selector and ffmpeg output options. m4a and
+# opus are remuxed from YouTube's own AAC and Opus streams, never re-encoded.
+AUDIO_FORMATS = {
+    "mp3": ("bestaudio/best", ["-c:a", "libmp3lame", "-f", "mp3"]),
+    "m4a": ("bestaudio[ext=m4a]", ["-c:a", "copy", "-movflags", "frag_keyframe+empty_moov", "-f", "ipod"]),
+    "opus": ("bestaudio[acodec=opus]", ["-c:a", "copy", "-f", "opus"]),
+}
+# Progressive (single file) downloads are fetched as concurrent byte ranges,
+# since googlevideo throttles each connection. Fragmented formats use
+# yt-dlp's own concurrent_fragment_downloads.
+DOWNLOAD_CONNECTIONS = int(os.environ.get("FOCUS_DOWNLOAD_CONNECTIONS", "4"))
+DOWNLOAD_RANGE_BYTES = int(float(os.environ.get("FOCUS_DOWNLOAD_RANGE_MB", "4")) * (1 << 20))
+DOWNLOAD_RANGE_RETRIES = int(os.environ.get("FOCUS_DOWNLOAD_RANGE_RETRIES", "3"))
+DOWNLOAD_FRAGMENTS = int(os.environ.get("FOCUS_DOWNLOAD_FRAGMENTS", "4"))
+# Formats written front to back as one file, with no merge or transcode afterwards.
+STREAMABLE_FORMATS = {"mp4"} | (set(AUDIO_FORMATS) if AUDIO_PIPELINE == "pipe" else set())
+
+
+class DownloadQueueFull(RuntimeError):
+    pass
+
+
+class GrowingFile:
+    """A download that readers can follow while it is still being written.
+
+    The producer reports how many bytes of its temp file are on disk, then
+    the final path once the file is stored. Only range downloads and the
+    audio pipe report progress: yt-dlp's own downloads buffer their writes
+    and are fixed up afterwards, so readers get them once finished. Each
+    reader streams from the start and blocks until more bytes arrive. A
+    reader that opens the file after it was moved into the store reads the
+    stored copy. A reader that had already opened it keeps reading the same
+    inode.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.ready = threading.Event()
+        self.path: Optional[str] = None
+        self.final_path: Optional[str] = None
+        self.size = 0
+        self.total: Optional[int] = None
+        self.done = False
+        self.error: Optional[str] = None
+
+    def advance(self, path: str, size: int, total: Optional[int]) -> None:
+        with self._cond:
+            if size < self.size:
+                self.error = "Download restarted from the beginning"
+            self.path, self.size, self.total = path, size, total
+            self._cond.notify_all()
+        self.ready.set()
+
+    def finish(self, final_path: Optional[str], error: Optional[str] = None) -> None:
+        with self._cond:
+            self.final_path = final_path
+            if final_path is not None:
+                self.size = os.path.getsize(final_path)
+            self.error = self.error or error
+            self.done = True
+            self._cond.notify_all()
+        self.ready.set()
+
+    def _open(self):
+        with self._cond:
+            path = self.path or self.final_path
+        try:
+            if path is not None:
+                return open(path, "rb")
+        except FileNotFoundError:
+            pass
+        with self._cond:
+            while not self.done:
+                self._cond.wait()
+        if self.final_path is None:
+            raise RuntimeError(self.error or "Download failed")
+        return open(self.final_path, "rb")
+
+    def chunks(self, chunk_size: int = 256 * 1024) -> Iterator[bytes]:
+        with self._open() as fh:
+            sent = 0
+            while True:
+                with self._cond:
+                    while sent >= self.size and not self.done and self.error is None:
+                        self._cond.wait()
+                    if self.error is not None:
+                        raise RuntimeError(self.error)
+                    available = self.size - sent
+                    if available <= 0:
+                        return
+                data = fh.read(min(chunk_size, available))
+                if not data:  # reported but not readable yet: look again shortly
+                    with self._cond:
+                        if self.done:
+                            raise RuntimeError(f"Download file ended at {sent} of {self.size} bytes")
+                        self._cond.wait(0.05)
+                    continue
+                sent += len(data)
+                yield data
+
+
+class DownloadJob:
+    """One yt-dlp download, updated from its progress and postprocessor hooks."""
+
+    def __init__(self, video_id: str, fmt: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.video_id = video_id
+        self.fmt = fmt
+        self.status = "queued"  # queued, downloading, processing, done, error
+        self.percent: Optional[float] = None
+        self.speed: Optional[float] = None
+        self.eta: Optional[int] = None
+        self.downloaded_bytes = 0
+        self.total_bytes: Optional[int] = None
+        self.title = video_id
+        self.filename: Optional[str] = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.done = threading.Event()
+        self.stream = GrowingFile() if DOWNLOAD_STREAMING and fmt in STREAMABLE_FORMATS else None
+
+    def progress_hook(self, d: Dict[str, Any]) -> None:
+        self.title = (d.get("info_dict") or {}).get("title") or self.title
+        if d["status"] == "downloading":
+            self.status = "downloading"
+            self.downloaded_bytes = d.get("downloaded_bytes") or 0
+            self.total_bytes = d.get("total_bytes") or d.get("total_bytes_estimate")
+            self.speed = d.get("speed")
+            self.eta = d.get("eta")
+            if self.total_bytes:
+                self.percent = round(100.0 * self.downloaded_bytes / self.total_bytes, 1)
+        elif d["status"] == "finished":
+            self.percent = 100.0
+            self.speed = self.eta = None
+
+    def postprocessor_hook(self, d: Dict[str, Any]) -> None:
+        if d["status"] == "started":
+            self.status = "processing"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "video_id": self.video_id,
+            "fmt": self.fmt,
+            "status": self.status,
+            "percent": self.percent,
+            "speed": self.speed,
+            "eta": self.eta,
+            "downloaded_bytes": self.downloaded_bytes,
+            "total_bytes": self.total_bytes,
+            "title": self.title,
+            "error": self.error,
+            "file": f"/api/jobs/{self.id}/file" if self.status == "done" else None,
+        }
+
+
+class DownloadQueue:
+    """Runs downloads on a bounded worker pool instead of inside the request.
+
+    Requests for a (video, format) that is queued, running or finished join
+    that job; failed jobs are retried by the next request. A download already
+    in the artifact store becomes a finished job without queueing. Finished
+    jobs are forgotten `job_ttl` seconds after they end.
+    """
+
+    def __init__(self, workers: int, queue_limit: int, job_ttl: float):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download")
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, DownloadJob] = {}
+        self._by_target: Dict[Tuple[str, str], DownloadJob] = {}
+        self.queue_limit = queue_limit
+        self.job_ttl = job_ttl
+        self.joined = 0
+
+    def submit(self, video_id: str, fmt: str) -> DownloadJob:
+        with self._lock:
+            self._prune()
+            job = self._joinable(video_id, fmt)
+            if job is not None:
+                return job
+        # The store lookup may wait on other processes; keep it out of the queue lock.
+        stored = artifacts.get(artifact_key(video_id, fmt))
+        with self._lock:
+            job = self._joinable(video_id, fmt)
+            if job is not None:
+                return job
+            if stored is None and sum(j.status == "queued" for j in self._jobs.values()) >= self.queue_limit:
+                raise DownloadQueueFull("Too many downloads queued, try again later")
+            job = DownloadJob(video_id, fmt)
+            self._jobs[job.id] = self._by_target[(video_id, fmt)] = job
+            if stored is not None:
+                job.title, job.filename, job.percent = stored["title"], stored["path"], 100.0
+                job.status, job.finished = "done", time.time()
+                job.done.set()
+                if job.stream is not None:
+                    job.stream.finish(job.filename)
+                return job
+        self._pool.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[DownloadJob]:
+        return self._jobs.get(job_id)
+
+    def _joinable(self, video_id: str, fmt: str) -> Optional[DownloadJob]:
+        job = self._by_target.get((video_id, fmt))
+        if job is None or job.status == "error" or (job.status == "done" and not os.path.exists(job.filename)):
+            return None
+        self.joined += 1
+        return job
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.job_ttl
+        for job in [j for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            del self._jobs[job.id]
+            if self._by_target.get((job.video_id, job.fmt)) is job:
+                del self._by_target[(job.video_id, job.fmt)]
+
+    def _run(self, job: DownloadJob) -> None:
+        try:
+            job.status = "downloading"
+            job.title, job.filename = run_download(job)
+            job.status = "done"
+        except Exception as e:
+            logger.warning("Download %s (%s) failed: %s", job.video_id, job.fmt, e)
+            job.error = str(e)
+            job.status = "error"
+        finally:
+            job.finished = time.time()
+            if job.stream is not None:
+                job.stream.finish(job.filename if job.status == "done" else None, job.error)
+            job.done.set()
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, int]:
+        counts = {"queued": 0, "downloading": 0, "processing": 0, "done": 0, "error": 0}
+        for job in list(self._jobs.values()):
+            counts[job.status] += 1
+        return {**counts, "joined": self.joined}
+
+
+def run_download(job: DownloadJob) -> Tuple[str, str]:
+    """Download `job`'s video into the artifact store, unless another worker
+    already has; returns (title, path of the stored file)."""
+    key = artifact_key(job.video_id, job.fmt)
+    with artifacts.lock(key):
+        stored = artifacts.get(key)
+        if stored is not None:
+            return stored["title"], stored["path"]
+
+        tmp_dir = artifacts.tempdir()
+        try:
+            if job.fmt in AUDIO_FORMATS and AUDIO_PIPELINE == "pipe":
+                title, filename = pipe_audio(job, tmp_dir)
+            elif job.fmt not in AUDIO_FORMATS and DOWNLOAD_CONNECTIONS > 1:
+                title, filename = range_download(job, tmp_dir)
+            else:
+                title, filename = ydl_download(job, tmp_dir)
+            if not os.path.exists(filename):
+                raise RuntimeError("Download failed - file not found")
+            stored = artifacts.put(key, filename, title)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return stored["title"], stored["path"]
+
+
+def ydl_download(job: DownloadJob, tmp_dir: str) -> Tuple[str, str]:
+    """Download with yt-dlp into `tmp_dir`; audio formats are extracted by its
+    FFmpegExtractAudio postprocessor. Returns (title, path)."""
+    quality = DOWNLOAD_QUALITY[job.fmt]
+    outtmpl = os.path.join(tmp_dir, f"{job.video_id}.%(ext)s")
+    if job.fmt in AUDIO_FORMATS:
+        postprocessor = {"key": "FFmpegExtractAudio", "preferredcodec": job.fmt}
+        if quality != "copy":
+            postprocessor["preferredquality"] = quality
+        ydl_opts = {
+            "format": "bestaudio/best",
+            "postprocessors": [postprocessor],
+            "outtmpl": outtmpl,
+        }
+    else:
+        ydl_opts = {
+            "format": f"best[height<={quality}]",
+            "outtmpl": outtmpl,
+        }
+    ydl_opts.update({
+        "quiet": True,
+        "noprogress": True,
+        "concurrent_fragment_downloads": DOWNLOAD_FRAGMENTS,
+        "progress_hooks": [job.progress_hook],
+        "postprocessor_hooks": [job.postprocessor_hook],
+    })
+
+    with YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(f"https://www.youtube.com/watch?v={job.video_id}", download=True)
+
+    ext = job.fmt if job.fmt in AUDIO_FORMATS else info.get("ext", "mp4")
+    return info.get("title", job.video_id), os.path.join(tmp_dir, f"{job.video_id}.{ext}")
+
+
+def feed_upstream(ydl: YoutubeDL, info: Dict[str, Any], sink, job: DownloadJob, errors: List[BaseException]) -> None:
+    """Copy the selected format's bytes into `sink` (ffmpeg's stdin) in ranged
+    requests, reporting download progress on `job`."""
+    headers = info.get("http_headers") or {}
+    total = info.get("filesize")
+    offset = 0
+    started = time.monotonic()
+    try:
+        while total is None or offset < total:
+            request_headers = {**headers, "Range": f"bytes={offset}-{offset + AUDIO_RANGE_BYTES - 1}"}
+            with ydl.urlopen(urllib.request.Request(info["url"], headers=request_headers)) as resp:
+                content_range = resp.headers.get("Content-Range", "")
+                if content_range.rpartition("/")[2].isdigit():
+                    total = int(content_range.rpartition("/")[2])
+                received = 0
+                for data in iter(lambda: resp.read(64 * 1024), b""):
+                    sink.write(data)
+                    received += len(data)
+                    offset += len(data)
+                    elapsed = max(time.monotonic() - started, 1e-6)
+                    job.progress_hook({
+                        "status": "downloading",
+                        "downloaded_bytes": offset,
+                        "total_bytes": total,
+                        "speed": offset / elapsed,
+                        "eta": int((total - offset) * elapsed / offset) if total else None,
+                    })
+            if resp.status != 206 or received < AUDIO_RANGE_BYTES:
+                break
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        try:
+            sink.close()
+        except OSError:
+            pass
+
+
+def pipe_audio(job: DownloadJob, tmp_dir: str) -> Tuple[str, str]:
+    """Feed the best audio stream straight into ffmpeg and write its output to
+    `tmp_dir` as it is produced, so readers can follow it; one pass, no
+    intermediate file. Re-encodes wait for one of TRANSCODE_SLOTS; remuxes
+    (quality "copy") do not. Returns (title, path)."""
+    selector, output_args = AUDIO_FORMATS[job.fmt]
+    quality = DOWNLOAD_QUALITY[job.fmt]
+    if quality != "copy":
+        output_args = ["-b:a", f"{quality}k", *output_args]
+    path = os.path.join(tmp_dir, f"{job.video_id}.{job.fmt}")
+
+    with YoutubeDL({"format": selector, "quiet": True}) as ydl:
+        info = ydl.extract_info(f"https://www.youtube.com/watch?v={job.video_id}", download=False)
+        job.title = info.get("title", job.video_id)
+        slot = transcode_slots if quality != "copy" else nullcontext()
+        with slot, tempfile.TemporaryFile() as stderr:
+            proc = subprocess.Popen(
+                ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", "pipe:0", "-vn", *output_args, "pipe:1"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+            )
+            errors: List[BaseException] = []
+            feeder = threading.Thread(target=feed_upstream, args=(ydl, info, proc.stdin, job, errors), daemon=True)
+            feeder.start()
+            written = 0
+            try:
+                with open(path, "wb") as out:
+                    for data in iter(lambda: proc.stdout.read(64 * 1024), b""):
+                        out.write(data)
+                        out.flush()
+                        written += len(data)
+                        if job.stream is not None:
+                            job.stream.advance(path, written, None)
+            except BaseException:
+                proc.kill()
+                raise
+            finally:
+                proc.wait()
+                feeder.join()
+            if errors and not isinstance(errors[0], BrokenPipeError):
+                raise errors[0]
+            if proc.returncode != 0:
+                stderr.seek(0)
+                raise RuntimeError(f"ffmpeg failed: {stderr.read().decode(errors='replace').strip()}")
+    return job.title, path
+
+
+def fetch_ranges(
+    open_range: Callable[[int, int], Tuple[Optional[int], Iterator[bytes]]],
+    path: str,
+    connections: int = DOWNLOAD_CONNECTIONS,
+    range_bytes: int = DOWNLOAD_RANGE_BYTES,
+    on_progress: Optional[Callable[[int, Optional[int], int], None]] = None,
+) -> int:
+    """Download one URL into `path` over up to `connections` concurrent range requests.
+
+    `open_range(start, end)` requests bytes start..end inclusive and returns
+    (total size from Content-Range, or None if the server ignored the
+    range, and the body chunks). The first range tells the size, the file
+    is preallocated, and the other ranges are fetched by a thread pool and
+    written in place with os.pwrite. A failed range resumes from its last
+    written byte, up to DOWNLOAD_RANGE_RETRIES times. `on_progress` gets
+    (bytes received, total, length of the complete prefix of the file).
+    Returns the size, after checking every byte arrived.
+    """
+    lock = threading.Lock()
+    failed = threading.Event()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    first = None
+    try:
+        total, first = open_range(0, range_bytes - 1)
+        if total is None:
+            # No range support: the first response is the whole body.
+            offset = 0
+            for data in first:
+                os.pwrite(fd, data, offset)
+                offset += len(data)
+                if on_progress:
+                    on_progress(offset, None, offset)
+            return offset
+        if total == 0:
+            return 0
+
+        try:
+            os.posix_fallocate(fd, 0, total)
+        except (AttributeError, OSError):
+            os.ftruncate(fd, total)
+        ranges = [(start, min(start + range_bytes, total) - 1) for start in range(0, total, range_bytes)]
+        written = [0] * len(ranges)
+        progress = {"received": 0, "complete": 0}
+
+        def report(index: int, size: int) -> None:
+            with lock:
+                written[index] += size
+                progress["received"] += size
+                complete = progress["complete"]
+                while complete < len(ranges) and written[complete] == ranges[complete][1] - ranges[complete][0] + 1:
+                    complete += 1
+                progress["complete"] = complete
+                prefix = total if complete == len(ranges) else ranges[complete][0] + written[complete]
+                if on_progress:  # under the lock, so the prefix never goes backwards
+                    on_progress(progress["received"], total, prefix)
+
+        def fetch(index: int, chunks: Optional[Iterator[bytes]] = None) -> None:
+            start, end = ranges[index]
+            for attempt in range(DOWNLOAD_RANGE_RETRIES + 1):
+                position = start + written[index]
+                try:
+                    if chunks is None:
+                        chunks = open_range(position, end)[1]
+                    for data in chunks:
+                        if failed.is_set():
+                            return
+                        data = data[:end + 1 - position]
+                        os.pwrite(fd, data, position)
+                        position += len(data)
+                        report(index, len(data))
+                        if position > end:
+                            break
+                    if position <= end:
+                        raise IOError(f"range {start}-{end} ended at byte {position}")
+                    return
+                except Exception as e:
+                    if attempt == DOWNLOAD_RANGE_RETRIES or failed.is_set():
+                        failed.set()
+                        raise
+                    logger.info("Retrying range %d-%d from byte %d: %s", start, end, position, e)
+                    time.sleep(0.5 * 2 ** attempt)
+                finally:
+                    _close_chunks(chunks)
+                    chunks = None
+
+        with ThreadPoolExecutor(max(connections, 1), thread_name_prefix="range") as pool:
+            futures = [pool.submit(fetch, 0, first)]
+            futures += [pool.submit(fetch, index) for index in range(1, len(ranges))]
+            for future in futures:
+                future.result()
+
+        if sum(written) != total or os.fstat(fd).st_size != total:
+            raise RuntimeError(f"Download incomplete: {sum(written)} of {total} bytes")
+        return total
+    finally:
+        failed.set()
+        _close_chunks(first)  # unless a range thread already did: early returns and errors
+        os.close(fd)
+
+
+class _ResponseChunks:
+    """Body chunks of an HTTP response; unlike a generator, close() releases it even before the first read."""
+
+    def __init__(self, resp) -> None:
+        self.resp = resp
+
+    def __iter__(self) -> "_ResponseChunks":
+        return self
+
+    def __next__(self) -> bytes:
+        data = self.resp.read(256 * 1024)
+        if not data:
+            self.resp.close()
+            raise StopIteration
+        return data
+
+    def close(self) -> None:
+        self.resp.close()
+
+
+def _close_chunks(chunks: Optional[Iterator[bytes]]) -> None:
+    """Close a body iterator from open_range, if it can be closed (releasing its connection)."""
+    close = getattr(chunks, "close", None)
+    if close is not None:
+        close()
+
+
+def ydl_range_opener(ydl: YoutubeDL, url: str, headers: Dict[str, str]):
+    """open_range for fetch_ranges over yt-dlp's HTTP client (its cookies and proxy)."""
+    def open_range(start: int, end: int) -> Tuple[Optional[int], Iterator[bytes]]:
+        resp = ydl.urlopen(urllib.request.Request(url, headers={**headers, "Range": f"bytes={start}-{end}"}))
+        size = resp.headers.get("Content-Range", "").rpartition("/")[2]
+        total = int(size) if resp.status == 206 and size.isdigit() else None
+        return total, _ResponseChunks(resp)
+    return open_range
+
+
+def range_download(job: DownloadJob, tmp_dir: str) -> Tuple[str, str]:
+    """Fetch a progressive download with fetch_ranges, following it with the
+    job's stream. Formats yt-dlp has to assemble (HLS/DASH fragments) go
+    through ydl_download instead. Returns (title, path)."""
+    quality = DOWNLOAD_QUALITY[job.fmt]
+    with YoutubeDL({"format": f"best[height<={quality}]", "quiet": True}) as ydl:
+        info = ydl.extract_info(f"https://www.youtube.com/watch?v={job.video_id}", download=False)
+        if info.get("protocol") not in ("http", "https") or not info.get("url"):
+            return ydl_download(job, tmp_dir)
+        job.title = info.get("title", job.video_id)
+        path = os.path.join(tmp_dir, f"{job.video_id}.{info.get('ext', 'mp4')}")
+        started = time.monotonic()
+
+        def on_progress(received: int, total: Optional[int], prefix: int) -> None:
+            elapsed = max(time.monotonic() - started, 1e-6)
+            job.progress_hook({
+                "status": "downloading",
+                "downloaded_bytes": received,
+                "total_bytes": total,
+                "speed": received / elapsed,
+                "eta": int((total - received) * elapsed / received) if total and received else None,
+            })
+            if job.stream is not None:
+                job.stream.advance(path, prefix, total)
+
+        fetch_ranges(ydl_range_opener(ydl, info["url"], info.get("http_headers") or {}), path, on_progress=on_progress)
+        job.progress_hook({"status": "finished"})
+    return job.title, path
+
+
+def benchmark_range_download(mb: int = 64, connections: int = DOWNLOAD_CONNECTIONS, throttle_mb_s: float = 8) -> Dict[str, Dict[str, float]]:
+    """Download `mb` MiB from a local server that limits each connection to
+    `throttle_mb_s`, like googlevideo does, over one connection (the
+    previous path) and over `connections` range requests."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    size = mb << 20
+    body = os.urandom(1 << 20) * mb
+
+    class ThrottledSource(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+            start, end = (int(match.group(1)), min(int(match.group(2)), size - 1)) if match else (0, size - 1)
+            self.send_response(206 if match else 200)
+            self.send_header("Content-Length", str(end - start + 1))
+            if match:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.end_headers()
+            block = 64 * 1024
+            for offset in range(start, end + 1, block):
+                self.wfile.write(body[offset:min(offset + block, end + 1)])
+                time.sleep(block / (throttle_mb_s * (1 << 20)))
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ThrottledSource)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/video.mp4"
+
+    def open_range(start: int, end: int) -> Tuple[Optional[int], Iterator[bytes]]:
+        resp = urllib.request.urlopen(urllib.request.Request(url, headers={"Range": f"bytes={start}-{end}"}))
+        total = int(resp.headers["Content-Range"].rpartition("/")[2]) if resp.status == 206 else None
+        return total, _ResponseChunks(resp)
+
+    report = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "video.mp4")
+            for name, conns, range_bytes in (
+                ("single", 1, size),
+                (f"ranges x{connections}", connections, DOWNLOAD_RANGE_BYTES),
+            ):
+                started = time.monotonic()
+                fetch_ranges(open_range, path, conns, range_bytes)
+                elapsed = time.monotonic() - started
+                with open(path, "rb") as fh:
+                    if fh.read() != body:
+                        raise RuntimeError(f"{name}: downloaded file differs from the source")
+                report[name] = {"seconds": elapsed, "mb_s": mb / elapsed}
+    finally:
+        server.shutdown()
+    return report
+
+
+class ArtifactStore:
+    """Finished downloads on disk, keyed by (video, format, quality).
+
+    Files are downloaded into a private temp directory inside the store and
+    renamed into place, so a reader never sees a partial file. A JSON
+    manifest records each artifact's size, title and last use. Beyond the
+    quota, the least recently used artifacts are deleted. `lock(key)` is held
+    by the producer of an artifact. It works across threads and, through
+    flock, across worker processes.
+
+    Lookups read the manifest without locking (it is only ever replaced
+    whole) and rewrite it only to drop a missing file or to refresh a last
+    use older than `USE_RESOLUTION` seconds.
+    """
+
+    USE_RESOLUTION = 60.0
+
+    def __init__(self, root: str, quota_bytes: int):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.manifest_path = os.path.join(root, "manifest.json")
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._loaded: Tuple[Any, Dict[str, Dict[str, Any]]] = (None, {})
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        for sub in (".tmp", ".locks"):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+        stale = time.time() - 86400
+        for tmp_dir in glob.glob(os.path.join(root, ".tmp", "*")):
+            if os.path.getmtime(tmp_dir) < stale:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @staticmethod
+    def key(video_id: str, fmt: str, quality: str) -> str:
+        safe_id = re.sub(r"[^\w-]", "_", video_id)
+        return f"{safe_id}-{quality}.{fmt}"
+
+    def _lock_path(self, name: str) -> str:
+        return os.path.join(self.root, ".locks", f"{name}.lock")
+
+    @contextmanager
+    def _flock(self, name: str) -> Iterator[None]:
+        path = self._lock_path(name)
+        while True:
+            with open(path, "a") as fh:
+                if fcntl is None:
+                    yield
+                    return
+                fcntl.flock(fh, fcntl.LOCK_EX)
+                try:
+                    current = os.stat(path).st_ino == os.fstat(fh.fileno()).st_ino
+                except FileNotFoundError:
+                    current = False
+                if current:  # else the lock file was removed while we waited
+                    yield
+                    return
+
+    def _drop_lock(self, name: str) -> None:
+        """Delete an evicted artifact's lock file, unless someone holds it."""
+        key_lock = self._key_locks.get(name)
+        if key_lock is not None and key_lock.locked():
+            return
+        self._key_locks.pop(name, None)
+        try:
+            with open(self._lock_path(name), "a") as fh:
+                if fcntl is not None:
+                    fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.remove(self._lock_path(name))
+        except OSError:
+            pass
+
+    @contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock, self._flock(key):
+            yield
+
+    def _read_manifest(self) -> Dict[str, Dict[str, Any]]:
+        """The manifest as last saved, parsed again only when the file changes.
+        Callers must not modify it."""
+        try:
+            st = os.stat(self.manifest_path)
+            version = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if version == self._loaded[0]:
+                return self._loaded[1]
+            with open(self.manifest_path) as fh:
+                entries = json.load(fh)
+        except (OSError, ValueError):
+            return {}
+        self._loaded = (version, entries)
+        return entries
+
+    @contextmanager
+    def _update_manifest(self) -> Iterator[Dict[str, Dict[str, Any]]]:
+        """A copy of the manifest, under the store-wide lock, saved on exit."""
+        with self._lock, self._flock("manifest"):
+            entries = {key: dict(entry) for key, entry in self._read_manifest().items()}
+            yield entries
+            tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as fh:
+                json.dump(entries, fh)
+            os.replace(tmp_path, self.manifest_path)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """The artifact's manifest entry plus its `path`, marked as used; None if absent."""
+        path = os.path.join(self.root, key)
+        entry = self._read_manifest().get(key)
+        exists = entry is not None and os.path.exists(path)
+        now = time.time()
+        if entry is not None and (not exists or now - entry["used"] > self.USE_RESOLUTION):
+            with self._update_manifest() as entries:
+                if not exists:
+                    entries.pop(key, None)
+                elif key in entries:
+                    entries[key]["used"] = now
+                    entry = entries[key]
+        if not exists:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(entry, path=path)
+
+    def tempdir(self) -> str:
+        return tempfile.mkdtemp(dir=os.path.join(self.root, ".tmp"))
+
+    def put(self, key: str, src_path: str, title: str) -> Dict[str, Any]:
+        """Rename a finished file into the store and evict down to the quota."""
+        path = os.path.join(self.root, key)
+        os.replace(src_path, path)
+        now = time.time()
+        with self._update_manifest() as entries:
+            entries[key] = {"size": os.path.getsize(path), "title": title, "created": now, "used": now}
+            total = sum(entry["size"] for entry in entries.values())
+            for old in sorted(entries, key=lambda k: entries[k]["used"]):
+                if total <= self.quota_bytes:
+                    break
+                if old == key:
+                    continue
+                total -= entries.pop(old)["size"]
+                self.evictions += 1
+                try:
+                    os.remove(os.path.join(self.root, old))
+                except OSError:
+                    pass
+                self._drop_lock(old)
+            return dict(entries[key], path=path)
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._read_manifest()
+        size = sum(entry["size"] for entry in entries.values())
+        count = len(entries)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": count,
+            "bytes": size,
+            "quota_bytes": self.quota_bytes,
+        }
+
+
+def artifact_key(video_id: str, fmt: str) -> str:
+    return ArtifactStore.key(video_id, fmt, DOWNLOAD_QUALITY[fmt])
+
+
+artifacts = ArtifactStore(DOWNLOAD_DIR, int(DOWNLOAD_QUOTA_MB * (1 << 20)))
+transcode_slots = threading.BoundedSemaphore(max(TRANSCODE_SLOTS, 1))
+
+
+download_queue = DownloadQueue(DOWNLOAD_WORKERS, DOWNLOAD_QUEUE_LIMIT, DOWNLOAD_JOB_TTL)
+atexit.register(download_queue.close)
+
+
 app = Flask(__name__)
 CORS(app)
 
@@ -206,7 +2130,12 @@ def api_search_videos():
     filter_type = request.args.get("filter", "all")
     if not query:
         return jsonify([])
-    results = search_videos(query, filter_type)
+    try:
+        results = search_videos(query, filter_type)
+    except DriverPoolExhausted as e:
+        abort(503, str(e))
+    except SearchFailed as e:
+        abort(502, str(e))
     return jsonify(results)
 
 
@@ -215,10 +2144,41 @@ def api_search_channels():
     query = request.args.get("q", "")
     if not query:
         return jsonify([])
-    results = search_channels(query)
+    try:
+        results = search_channels(query)
+    except DriverPoolExhausted as e:
+        abort(503, str(e))
+    except SearchFailed as e:
+        abort(502, str(e))
     return jsonify(results)
 
 
+@app.get("/api/search")
+def api_search():
+    query = request.args.get("q", "")
+    filter_type = request.args.get("filter", "all")
+    if not query:
+        return jsonify({"videos": [], "channels": []})
+    try:
+        results = search_all(query, filter_type)
+    except DriverPoolExhausted as e:
+        abort(503, str(e))
+    except SearchFailed as e:
+        abort(502, str(e))
+    return jsonify(results)
+
+
+@app.get("/api/stats")
+def api_stats():
+    return jsonify({
+        "search_cache": search_cache.stats(),
+        "search_waits": search_wait_stats,
+        "coalesced": search_flights.stats(),
+        "downloads": download_queue.stats(),
+        "artifacts": artifacts.stats(),
+    })
+
+
 @app.get("/api/channel")
 def api_channel_videos():
     channel_url = request.args.get("url")
@@ -229,54 +2189,131 @@ def api_channel_videos():
     return jsonify(videos)
 
 
-@app.get("/api/download/<video_id>")
+def attachment_name(job: DownloadJob, title: str) -> str:
+    safe_title = re.sub(r"[^\w\s-]", "", title).strip() or job.video_id
+    return f"{safe_title}.{job.fmt}"
+
+
+def send_job_file(job: DownloadJob):
+    stored = artifacts.get(artifact_key(job.video_id, job.fmt))
+    if stored is None:
+        abort(410, "Download expired, request it again")
+    return send_file(
+        stored["path"],
+        as_attachment=True,
+        download_name=attachment_name(job, stored["title"]),
+        mimetype=DOWNLOAD_MIMETYPES[job.fmt],
+    )
+
+
+def stream_job_file(job: DownloadJob) -> Response:
+    """The download's bytes as they are written, for a job still in progress."""
+    name = urllib.parse.quote(attachment_name(job, job.title))
+    headers = {"Content-Disposition": f"attachment; filename*=UTF-8''{name}"}
+    if job.stream.total:
+        headers["Content-Length"] = str(job.stream.total)
+    return Response(job.stream.chunks(), mimetype=DOWNLOAD_MIMETYPES[job.fmt], headers=headers)
+
+
+def job_stream_ready(job: DownloadJob, wait: float = 0) -> bool:
+    if job.stream is None:
+        return False
+    job.stream.ready.wait(wait)
+    return job.stream.ready.is_set() and job.status != "error"
+
+
+@app.route("/api/download/<video_id>", methods=["GET", "POST"])
 def api_download(video_id):
+    """Enqueue (or join) a download and answer 202 with the job; poll it at
+    /api/jobs/<id>. A GET, as sent by plain download links, first waits up to
+    DOWNLOAD_STREAM_WAIT seconds for the file (or, if the format allows, for
+    bytes to stream) and redirects to /api/jobs/<id>/file if they arrive."""
     fmt = request.args.get("fmt", "mp4")
-    video_url = f"https://www.youtube.com/watch?v={video_id}"
-
+    if fmt not in DOWNLOAD_QUALITY:
+        abort(400, f"fmt must be one of {', '.join(DOWNLOAD_QUALITY)}")
     try:
-        if fmt == "mp3":
-            ydl_opts = {
-                "format": "bestaudio/best",
-                "postprocessors": [
-                    {
-                        "key": "FFmpegExtractAudio",
-                        "preferredcodec": "mp3",
-                        "preferredquality": "192",
-                    }
-                ],
-                "outtmpl": f"/tmp/{video_id}.%(ext)s",
-            }
+        job = download_queue.submit(video_id, fmt)
+    except DownloadQueueFull as e:
+        abort(503, str(e))
+    if request.method == "GET":
+        if job.stream is not None:
+            ready = job_stream_ready(job, DOWNLOAD_STREAM_WAIT)
         else:
-            ydl_opts = {
-                "format": "best[height<=720]",
-                "outtmpl": f"/tmp/{video_id}.%(ext)s",
-            }
+            ready = job.done.wait(DOWNLOAD_STREAM_WAIT)
+        if job.status == "error":
+            abort(500, f"Download error: {job.error}")
+        if ready:
+            return redirect(f"/api/jobs/{job.id}/file")
+    return jsonify(job.to_dict()), 202, {"Location": f"/api/jobs/{job.id}"}
 
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=True)
-            title = info.get("title", video_id)
 
-        if fmt == "mp3":
-            filename = f"/tmp/{video_id}.mp3"
-        else:
-            ext = info.get("ext", "mp4")
-            filename = f"/tmp/{video_id}.{ext}"
-
-        if os.path.exists(filename):
-            safe_title = re.sub(r"[^\w\s-]", "", title).strip()
-            download_name = f"{safe_title}.{fmt}"
-            return send_file(
-                filename,
-                as_attachment=True,
-                download_name=download_name,
-                mimetype="audio/mpeg" if fmt == "mp3" else "video/mp4",
+@app.get("/api/jobs/<job_id>")
+def api_job(job_id):
+    job = download_queue.get(job_id)
+    if job is None:
+        abort(404, "Unknown job")
+    return jsonify(job.to_dict())
+
+
+@app.get("/api/jobs/<job_id>/file")
+def api_job_file(job_id):
+    job = download_queue.get(job_id)
+    if job is None:
+        abort(404, "Unknown job")
+    if job.status == "error":
+        abort(500, f"Download error: {job.error}")
+    if job.status == "done":
+        return send_job_file(job)
+    if job_stream_ready(job):
+        return stream_job_file(job)
+    abort(409, "Download not finished")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="YouTube Focus backend")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("serve", help="run the development server (default)")
+    commands.add_parser("prewarm", help="resolve Chrome and ChromeDriver and cache them on disk")
+    bench = commands.add_parser("bench-profile", help="compare page load of the default and lean browser profiles")
+    bench.add_argument("query", nargs="?", default="lofi hip hop")
+    bench.add_argument("--runs", type=int, default=3)
+    bench_download = commands.add_parser("bench-download", help="compare one connection with concurrent range requests")
+    bench_download.add_argument("--mb", type=int, default=64, help="file size in MiB")
+    bench_download.add_argument("--connections", type=int, default=max(DOWNLOAD_CONNECTIONS, 2))
+    bench_download.add_argument("--throttle", type=float, default=8, help="per-connection limit in MiB/s")
+    args = parser.parse_args(argv)
+
+    if args.command == "prewarm":
+        chrome = resolve_chrome(refresh=True)
+        print(f"Chrome {chrome.version} at {chrome.binary}")
+        print(f"ChromeDriver at {chrome.driver_path}")
+        print(f"Cached in {CHROME_CACHE_FILE}")
+        return
+
+    if args.command == "bench-profile":
+        report = benchmark_browser_profiles(args.query, args.runs)
+        print(f"{'profile':<10}{'seconds':>10}{'KiB':>12}{'requests':>10}")
+        for profile, result in report.items():
+            print(
+                f"{profile:<10}{result['seconds']:>10.2f}"
+                f"{result['bytes'] / 1024:>12.0f}{result['requests']:>10.0f}"
             )
-        else:
-            abort(500, "Download failed - file not found")
-    except Exception as e:
-        abort(500, f"Download error: {str(e)}")
+        return
 
+    if args.command == "bench-download":
+        report = benchmark_range_download(args.mb, args.connections, args.throttle)
+        print(f"{'path':<14}{'seconds':>10}{'MiB/s':>10}")
+        for name, result in report.items():
+            print(f"{name:<14}{result['seconds']:>10.2f}{result['mb_s']:>10.1f}")
+        return
 
-if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        resolve_chrome()
+    except (FileNotFoundError, subprocess.CalledProcessError) as e:
+        logger.warning("Chrome not available, search will fail: %s", e)
     app.run(debug=True, host="0.0.0.0", port=5000)
+
+
+if __name__ == "__main__":
+    main()
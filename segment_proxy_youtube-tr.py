@@ -1,111 +1,2190 @@
-import io, os, re, shutil, urllib.parse, requests, textwrap, logging
-from typing import List, Dict, Optional
+import argparse, asyncio, atexit, copy, glob, hashlib, io, json, os, queue, re, shutil, sqlite3, subprocess, tempfile, threading, time, urllib.parse, uuid, requests, textwrap, logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Any, List, Dict, NamedTuple, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+from urllib3.util.retry import Retry
 from flask import (Flask, request, Response, stream_with_context,
-                   render_template_string, send_file, abort, redirect)
+                   render_template_string, send_file, abort, redirect, jsonify)
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.support.ui import WebDriverWait
 from webdriver_manager.chrome import ChromeDriverManager
 from yt_dlp import YoutubeDL
+try:
+    import fcntl
+except ImportError:  # Windows: artifact locks then only cover threads of one process
+    fcntl = None
 
 logging.basicConfig(level=logging.INFO)
 
 # ───────────── Chrome helper ─────────────
-def chrome_driver() -> webdriver.Chrome:
-    chrome_bin = next(p for p in (
-        shutil.which("google-chrome"),
-        "/opt/google/chrome/google-chrome",
-        os.path.expanduser("~/.var/app/com.google.Chrome/current/active/files/bin/google-chrome"))
-        if p and os.path.exists(p))
+CHROME_CACHE = os.environ.get("FOCUS_CHROME_CACHE", os.path.expanduser("~/.cache/youtube-focus/chrome.json"))
+_chrome: Optional[Dict] = None
+_chrome_lock = threading.Lock()
+
+def resolve_chrome(refresh: bool = False) -> Dict:
+    """Binary, version and driver path, resolved once per process.
+    Version is cached on disk per binary (mtime+size), driver path per version."""
+    global _chrome
+    with _chrome_lock:
+        if _chrome and not refresh:
+            return _chrome
+        chrome_bin = next(p for p in (
+            shutil.which("google-chrome"),
+            "/opt/google/chrome/google-chrome",
+            os.path.expanduser("~/.var/app/com.google.Chrome/current/active/files/bin/google-chrome"))
+            if p and os.path.exists(p))
+        st = os.stat(os.path.realpath(chrome_bin))
+        fp = [st.st_mtime_ns, st.st_size]
+        try:
+            with open(CHROME_CACHE) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        bins, drivers = cache.setdefault("binaries", {}), cache.setdefault("drivers", {})
+        changed = False
+        known = bins.get(chrome_bin)
+        if refresh or not known or known.get("fingerprint") != fp:
+            out = subprocess.check_output([chrome_bin, "--version"]).decode()
+            known = bins[chrome_bin] = {"version": re.search(r"(\d+(?:\.\d+)*)", out).group(1), "fingerprint": fp}
+            changed = True
+        ver = known["version"]
+        drv = drivers.get(ver)
+        if refresh or not drv or not os.path.exists(drv):
+            try:
+                drv = ChromeDriverManager(version=ver.split(".")[0]).install()
+            except TypeError:
+                drv = ChromeDriverManager().install()
+            drivers[ver] = drv
+            changed = True
+        if changed:
+            try:
+                os.makedirs(os.path.dirname(CHROME_CACHE), exist_ok=True)
+                with open(f"{CHROME_CACHE}.{os.getpid()}.tmp", "w") as f:
+                    json.dump(cache, f, indent=2)
+                os.replace(f"{CHROME_CACHE}.{os.getpid()}.tmp", CHROME_CACHE)
+            except OSError as e:
+                logging.warning("Chrome cache not saved: %s", e)
+        _chrome = {"binary": chrome_bin, "version": ver, "driver": drv}
+        return _chrome
+
+# "lean" only reads DOM text: no images, fonts, media, player, ads or telemetry
+PROFILE = os.environ.get("FOCUS_BROWSER_PROFILE", "lean")
+BLOCKED = ["*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.svg", "*.ico",
+           "*.woff", "*.woff2", "*.ttf", "*.otf", "*.mp4", "*.webm", "*.m4a",
+           "*i.ytimg.com/*", "*yt3.ggpht.com/*", "*googlevideo.com/*", "*/s/player/*",
+           "*doubleclick.net/*", "*googlesyndication.com/*", "*googleadservices.com/*",
+           "*google-analytics.com/*", "*/pagead/*", "*/ptracking*",
+           "*/youtubei/v1/log_event*", "*/api/stats/*", "*/generate_204*"]
+
+def chrome_driver(profile: str = PROFILE) -> webdriver.Chrome:
+    chrome = resolve_chrome()
     opts = webdriver.ChromeOptions()
-    opts.binary_location = chrome_bin
+    opts.binary_location = chrome["binary"]
     opts.add_argument("--headless=new")
     opts.add_argument("--no-sandbox")
     opts.add_argument("--disable-dev-shm-usage")
-    return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=opts)
+    if profile == "lean":
+        opts.page_load_strategy = "eager"
+        for a in ("--window-size=1024,768", "--blink-settings=imagesEnabled=false", "--mute-audio"):
+            opts.add_argument(a)
+        opts.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+    drv = webdriver.Chrome(service=Service(chrome["driver"]), options=opts)
+    if profile == "lean":
+        try:
+            drv.execute_cdp_cmd("Network.enable", {})
+            drv.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED})
+        except WebDriverException:
+            pass
+    return drv
+
+# ───────────── Warm browser pool ─────────────
+POOL_SIZE = int(os.environ.get("FOCUS_DRIVER_POOL_SIZE", "2"))
+POOL_MAX_USES = int(os.environ.get("FOCUS_DRIVER_MAX_USES", "50"))
+POOL_MAX_RSS_MB = int(os.environ.get("FOCUS_DRIVER_MAX_RSS_MB", "1024"))
+POOL_WAIT = float(os.environ.get("FOCUS_DRIVER_CHECKOUT_TIMEOUT", "30"))
+
+def tree_rss_mb(pid: int) -> float:
+    kb, todo, seen = 0, [pid], set()
+    while todo:
+        p = todo.pop()
+        if p in seen:
+            continue
+        seen.add(p)
+        try:
+            with open(f"/proc/{p}/status") as f:
+                kb += next((int(l.split()[1]) for l in f if l.startswith("VmRSS:")), 0)
+            for t in os.listdir(f"/proc/{p}/task"):
+                with open(f"/proc/{p}/task/{t}/children") as f:
+                    todo += map(int, f.read().split())
+        except (OSError, ValueError):
+            pass
+    return kb / 1024
+
+class PoolBusy(RuntimeError):
+    pass
+
+class DriverPool:
+    """At most `size` live Chrome sessions; checkout waits `wait` s, then raises PoolBusy."""
+    def __init__(self, size: int, max_uses: int, max_rss_mb: int, wait: float):
+        self.size, self.max_uses, self.max_rss_mb, self.wait = size, max_uses, max_rss_mb, wait
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle: "queue.LifoQueue[webdriver.Chrome]" = queue.LifoQueue()
+        self.uses: Dict[int, int] = {}
+        self.lock = threading.Lock()
+
+    def _launch(self) -> webdriver.Chrome:
+        d = chrome_driver()
+        with self.lock:
+            self.uses[id(d)] = 0
+        return d
+
+    def _retire(self, d: webdriver.Chrome):
+        with self.lock:
+            self.uses.pop(id(d), None)
+        try:
+            d.quit()
+        except Exception:
+            pass
+
+    def checkout(self) -> webdriver.Chrome:
+        if not self.slots.acquire(timeout=self.wait):
+            raise PoolBusy("Tüm tarayıcı oturumları meşgul")
+        try:
+            while True:
+                try:
+                    d = self.idle.get_nowait()
+                except queue.Empty:
+                    return self._launch()
+                try:
+                    if d.execute_script("return 1") == 1:
+                        return d
+                except Exception:
+                    pass
+                self._retire(d)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def checkin(self, d: webdriver.Chrome, discard: bool = False):
+        try:
+            with self.lock:
+                n = self.uses[id(d)] = self.uses.get(id(d), 0) + 1
+            try:
+                rss = tree_rss_mb(d.service.process.pid)
+            except Exception:
+                rss = 0
+            if discard or n >= self.max_uses or rss > self.max_rss_mb:
+                return self._retire(d)
+            try:
+                d.get("about:blank")
+            except WebDriverException:
+                return self._retire(d)
+            self.idle.put(d)
+        finally:
+            self.slots.release()
+
+    @contextmanager
+    def driver(self):
+        d = self.checkout()
+        try:
+            yield d
+        except WebDriverException:
+            self.checkin(d, discard=True)
+            raise
+        except BaseException:
+            self.checkin(d)
+            raise
+        else:
+            self.checkin(d)
+
+    def close(self):
+        while True:
+            try:
+                self._retire(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+POOL = DriverPool(POOL_SIZE, POOL_MAX_USES, POOL_MAX_RSS_MB, POOL_WAIT)
+atexit.register(POOL.close)
 
 # ───────────── YouTube helpers ─────────────
 def dur2sec(t: str) -> int:
     p = list(map(int, t.split(":")))
-    h, m, s = (p + [0, 0, 0])[-3:]
+    h, m, s = ([0, 0, 0] + p)[-3:]
     return h * 3600 + m * 60 + s
 
-def yt_search(q: str, flt: str) -> List[Dict]:
-    drv = chrome_driver()
-    out = []
+SEARCH_DEADLINE = float(os.environ.get("FOCUS_SEARCH_DEADLINE", "8"))
+RESULTS_SETTLE = float(os.environ.get("FOCUS_RESULTS_SETTLE", "0.3"))
+ANY_RESULT = "ytd-video-renderer, ytd-channel-renderer, ytd-playlist-renderer, ytd-background-promo-renderer"
+WAITS = {"waits": 0, "timeouts": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+_waits_lock = threading.Lock()
+
+def results_ready(targets: Dict[str, int], settle: float = RESULTS_SETTLE):
+    """Wait condition: all caps reached, or results present and counts stable for `settle` s."""
+    sels, caps, last = list(targets) + [ANY_RESULT], list(targets.values()), {"counts": None, "t": 0.0}
+    def ready(drv) -> bool:
+        *counts, any_ = drv.execute_script("return arguments[0].map(s => document.querySelectorAll(s).length);", sels)
+        if not any_:
+            return False
+        if all(c >= cap for c, cap in zip(counts, caps)):
+            return True
+        now = time.monotonic()
+        if counts != last["counts"]:
+            last.update(counts=counts, t=now)
+            return False
+        return now - last["t"] >= settle
+    return ready
+
+DUR_SP = {"short": "EgIYAQ==", "medium": "EgIYAw==", "long": "EgIYAg=="}
+CHAN_SP = "EgIQAg=="
+
+def results_url(q: str, sp: Optional[str] = None) -> str:
+    """Results page URL; `sp` applies YouTube's server-side filter."""
+    return "https://www.youtube.com/results?" + urllib.parse.urlencode({"search_query": q, **({"sp": sp} if sp else {})})
+
+def yt_open(drv: webdriver.Chrome, url: str, targets: Dict[str, int]) -> bool:
+    """Load `url` and wait for `targets`; False if SEARCH_DEADLINE passed first."""
+    t0 = time.monotonic()
+    drv.implicitly_wait(0)
+    drv.get(url)
+    t1 = time.monotonic()
+    timed_out = False
     try:
-        drv.get("https://www.youtube.com")
-        drv.implicitly_wait(5)
-        drv.find_element(By.NAME, "search_query").send_keys(q + Keys.RETURN)
-        drv.implicitly_wait(5)
-        for v in drv.find_elements(By.CSS_SELECTOR, "ytd-video-renderer")[:12]:
-            try:
-                tt = v.find_element(By.ID, "video-title")
-                vid = tt.get_attribute("href").split("v=")[1].split("&")[0]
-                dur = v.find_element(By.CSS_SELECTOR, "ytd-thumbnail-overlay-time-status-renderer span").text.strip()
-                s = dur2sec(dur) if dur else None
-                if (flt == "short" and (s is None or s >= 240)) or \
-                   (flt == "medium" and (s is None or s < 240 or s > 1200)) or \
-                   (flt == "long" and (s is None or s <= 1200)):
-                    continue
-                out.append({"id": vid, "title": tt.text,
-                            "thumb": f"https://i.ytimg.com/vi/{vid}/hqdefault.jpg", "dur": dur})
-                if len(out) == 8:
-                    break
-            except:
-                pass
-    finally:
-        drv.quit()
+        WebDriverWait(drv, max(0.0, SEARCH_DEADLINE - (t1 - t0)), poll_frequency=0.1).until(results_ready(targets))
+    except TimeoutException:
+        timed_out = True
+    waited = time.monotonic() - t1
+    with _waits_lock:
+        WAITS["waits"] += 1
+        WAITS["timeouts"] += timed_out
+        WAITS["total_seconds"] += waited
+        WAITS["max_seconds"] = max(WAITS["max_seconds"], waited)
+    logging.info("Results for %s %s after %.2fs", url, "timed out" if timed_out else "ready", waited)
+    return not timed_out
+
+def fmt_dur(sec: Optional[int]) -> str:
+    if not sec:
+        return ""
+    h, r = divmod(int(sec), 3600)
+    return f"{h}:{r // 60:02d}:{r % 60:02d}" if h else f"{r // 60}:{r % 60:02d}"
+
+def fmt_count(n: Optional[int]) -> str:
+    for lim, suf in ((10**9, "B"), (10**6, "M"), (10**3, "K")):
+        if n and n >= lim:
+            return f"{n / lim:.1f}".rstrip("0").rstrip(".") + suf
+    return str(n) if n else ""
+
+def dur_ok(s: Optional[int], flt: str) -> bool:
+    return not ((flt == "short" and (s is None or s >= 240)) or
+                (flt == "medium" and (s is None or s < 240 or s > 1200)) or
+                (flt == "long" and (s is None or s <= 1200)))
+
+def yt_videos(drv: webdriver.Chrome, flt: str, n: int = 8) -> List[Dict]:
+    out = []
+    for v in drv.find_elements(By.CSS_SELECTOR, "ytd-video-renderer")[:max(12, n)]:
+        try:
+            tt = v.find_element(By.ID, "video-title")
+            vid = tt.get_attribute("href").split("v=")[1].split("&")[0]
+            dur = v.find_element(By.CSS_SELECTOR, "ytd-thumbnail-overlay-time-status-renderer span").text.strip()
+            if not dur_ok(dur2sec(dur) if dur else None, flt):
+                continue
+            out.append({"id": vid, "title": tt.text,
+                        "thumb": f"https://i.ytimg.com/vi/{vid}/hqdefault.jpg", "dur": dur})
+            if len(out) == n:
+                break
+        except:
+            pass
     return out
 
-def yt_channels(q: str) -> List[Dict]:
-    drv = chrome_driver()
+def yt_chans(drv: webdriver.Chrome) -> List[Dict]:
     res = []
-    try:
-        drv.get("https://www.youtube.com")
-        drv.implicitly_wait(5)
-        drv.find_element(By.NAME, "search_query").send_keys(q + Keys.RETURN)
-        drv.implicitly_wait(5)
-        for c in drv.find_elements(By.CSS_SELECTOR, "ytd-channel-renderer")[:8]:
-            try:
-                img = c.find_element(By.CSS_SELECTOR, "img")
-                res.append({"title": c.find_element(By.ID, "channel-title").text,
-                            "url": c.find_element(By.ID, "main-link").get_attribute("href"),
-                            "thumb": img.get_attribute("src") or img.get_attribute("data-thumb") or "",
-                            "subs": c.find_element(By.ID, "subscribers").text})
-            except:
-                pass
-    finally:
-        drv.quit()
+    for c in drv.find_elements(By.CSS_SELECTOR, "ytd-channel-renderer")[:8]:
+        try:
+            img = c.find_element(By.CSS_SELECTOR, "img")
+            res.append({"title": c.find_element(By.ID, "channel-title").text,
+                        "url": c.find_element(By.ID, "main-link").get_attribute("href"),
+                        "thumb": img.get_attribute("src") or img.get_attribute("data-thumb") or "",
+                        "subs": c.find_element(By.ID, "subscribers").text})
+        except:
+            pass
     return res
 
+EXTRACT = os.environ.get("FOCUS_SEARCH_EXTRACTION", "script")
+EXTRACT_JS = """
+const [videoCap, channelCap] = arguments;
+const text = (root, selector) => {
+    const el = root.querySelector(selector);
+    return el ? (el.innerText || el.textContent || "").trim() : "";
+};
+const videos = [...document.querySelectorAll("ytd-video-renderer")].slice(0, videoCap).map(v => {
+    const title = v.querySelector("#video-title");
+    return {
+        href: title ? title.href || "" : "",
+        title: title ? (title.innerText || title.textContent || "").trim() : "",
+        duration: text(v, "ytd-thumbnail-overlay-time-status-renderer span"),
+    };
+});
+const channels = [...document.querySelectorAll("ytd-channel-renderer")].slice(0, channelCap).map(c => {
+    const link = c.querySelector("#main-link");
+    const img = c.querySelector("img");
+    return {
+        title: text(c, "#channel-title"),
+        url: link ? link.href || "" : "",
+        subs: text(c, "#subscribers"),
+        src: img ? img.src || "" : "",
+        dataThumb: img ? img.getAttribute("data-thumb") || "" : "",
+    };
+});
+return {videos, channels};
+"""
+
+def yt_extract(drv: webdriver.Chrome, flt: str, vcap: int = 12, ccap: int = 8, n: int = 8) -> Dict[str, List[Dict]]:
+    """All renderer fields in one execute_script round-trip ("script"),
+    or per-element WebDriver calls ("webdriver"). Up to `n` videos passing `flt`."""
+    if EXTRACT == "webdriver":
+        return {"videos": yt_videos(drv, flt, n) if vcap else [], "channels": yt_chans(drv) if ccap else []}
+    raw = drv.execute_script(EXTRACT_JS, vcap, ccap) or {}
+    vids, chans = [], []
+    for v in raw.get("videos") or []:
+        if "v=" not in v.get("href", ""):
+            continue
+        vid, dur = v["href"].split("v=")[1].split("&")[0], v.get("duration") or ""
+        try:
+            sec = dur2sec(dur) if dur else None
+        except ValueError:
+            dur, sec = "", None
+        if not dur_ok(sec, flt):
+            continue
+        vids.append({"id": vid, "title": v.get("title", ""),
+                     "thumb": f"https://i.ytimg.com/vi/{vid}/hqdefault.jpg", "dur": dur})
+        if len(vids) == n:
+            break
+    for c in raw.get("channels") or []:
+        if c.get("title") and c.get("url"):
+            chans.append({"title": c["title"], "url": c["url"], "subs": c.get("subs", ""),
+                          "thumb": c.get("src") or c.get("dataThumb") or ""})
+    return {"videos": vids, "channels": chans}
+
+# ───────────── Search backends ─────────────
+# Backends raise instead of answering []: SearchFailed when nothing could be
+# fetched, SearchIncomplete (with what was read) when the page timed out.
+# Neither result is cached.
+class SearchFailed(RuntimeError):
+    pass
+
+class SearchIncomplete(SearchFailed):
+    def __init__(self, results: Any):
+        super().__init__("Arama sonuçları zamanında yüklenmedi")
+        self.results = results
+
+class Search(ABC):
+    """A search backend: videos {id, title, thumb, dur}, channels {title, url, thumb, subs}."""
+    @abstractmethod
+    def videos(self, q: str, flt: str, n: int = 8) -> List[Dict]: ...
+
+    @abstractmethod
+    def channels(self, q: str) -> List[Dict]: ...
+
+    @abstractmethod
+    def both(self, q: str, flt: str, n: int = 8) -> Dict[str, List[Dict]]: ...
+
+class SeleniumSearch(Search):
+    """Scrape the results page in a pooled Chrome."""
+    def videos(self, q: str, flt: str, n: int = 8) -> List[Dict]:
+        with POOL.driver() as drv:
+            ok = yt_open(drv, results_url(q, DUR_SP.get(flt)), {"ytd-video-renderer": max(12, n)})
+            res = yt_extract(drv, flt, vcap=max(12, n), ccap=0, n=n)["videos"]
+        if not ok:
+            raise SearchIncomplete(res)
+        return res
+
+    def channels(self, q: str) -> List[Dict]:
+        with POOL.driver() as drv:
+            ok = yt_open(drv, results_url(q, CHAN_SP), {"ytd-channel-renderer": 8})
+            res = yt_extract(drv, "all", vcap=0)["channels"]
+        if not ok:
+            raise SearchIncomplete(res)
+        return res
+
+    def both(self, q: str, flt: str, n: int = 8) -> Dict[str, List[Dict]]:
+        # unfiltered page: a duration `sp` would drop the channel results
+        with POOL.driver() as drv:
+            ok = yt_open(drv, results_url(q), {"ytd-video-renderer": max(12, n), "ytd-channel-renderer": 8})
+            res = yt_extract(drv, flt, vcap=max(12, n), n=n)
+        if not ok:
+            raise SearchIncomplete(res)
+        return res
+
+class YtDlpSearch(Search):
+    """No browser: flat `ytsearchN:` for unfiltered videos; the results page
+    with an `sp` filter for duration-filtered videos and for channels."""
+
+    def _flat(self, url: str, n: int) -> List[Dict]:
+        try:
+            with YoutubeDL({"quiet": True, "skip_download": True, "extract_flat": "in_playlist", "playlistend": n}) as ydl:
+                return list(ydl.extract_info(url, download=False).get("entries") or [])[:n]
+        except Exception as e:
+            raise SearchFailed(f"yt-dlp search failed: {e}") from e
+
+    def videos(self, q: str, flt: str, n: int = 8) -> List[Dict]:
+        out, scan = [], max(12, n)
+        src = results_url(q, DUR_SP[flt]) if flt in DUR_SP else f"ytsearch{scan}:{q}"
+        for e in self._flat(src, scan):
+            s = int(e["duration"]) if e.get("duration") else None
+            if not e.get("id") or not dur_ok(s, flt):
+                continue
+            out.append({"id": e["id"], "title": e.get("title", ""),
+                        "thumb": f"https://i.ytimg.com/vi/{e['id']}/hqdefault.jpg",
+                        "dur": e.get("duration_string") or fmt_dur(s)})
+            if len(out) == n:
+                break
+        return out
+
+    def channels(self, q: str) -> List[Dict]:
+        res = []
+        for e in self._flat(results_url(q, CHAN_SP), 8):
+            u = e.get("channel_url") or e.get("url")
+            if not u or "/watch" in u:
+                continue
+            th = ((e.get("thumbnails") or [{}])[-1].get("url") or "")
+            res.append({"title": e.get("title") or e.get("channel") or "", "url": u,
+                        "thumb": "https:" + th if th.startswith("//") else th,
+                        "subs": fmt_count(e.get("channel_follower_count"))})
+        return res
+
+    def both(self, q: str, flt: str, n: int = 8) -> Dict[str, List[Dict]]:
+        return {"videos": self.videos(q, flt, n), "channels": self.channels(q)}
+
+SEARCH_BACKENDS = {"selenium": SeleniumSearch, "ytdlp": YtDlpSearch}
+SEARCH = SEARCH_BACKENDS[os.environ.get("FOCUS_SEARCH_BACKEND", "selenium")]()
+
+# ───────────── Search cache ─────────────
+CACHE_KIND = os.environ.get("FOCUS_SEARCH_CACHE", "memory")
+CACHE_TTL = float(os.environ.get("FOCUS_SEARCH_CACHE_TTL", "600"))
+CACHE_EMPTY_TTL = float(os.environ.get("FOCUS_SEARCH_CACHE_EMPTY_TTL", "30"))  # [] may be a throttled request
+CACHE_SIZE = int(os.environ.get("FOCUS_SEARCH_CACHE_SIZE", "512"))
+CACHE_PATH = os.environ.get("FOCUS_SEARCH_CACHE_PATH", os.path.expanduser("~/.cache/youtube-focus/search-cache.sqlite3"))
+CACHE_URL = os.environ.get("FOCUS_SEARCH_CACHE_URL", "redis://localhost:6379/0")
+RAW_N = 20
+
+class TTLCache(ABC):
+    """TTL + LRU store for JSON values, counting hits/misses. Backend errors count as misses."""
+    kind = ""
+
+    def __init__(self, ns: str, ttl: float, size: int):
+        self.ns, self.ttl, self.size = ns, ttl, size
+        self.hits = self.misses = 0
+
+    def get(self, k: str) -> Any:
+        try:
+            v = self._get(k)
+        except Exception as e:
+            logging.warning("%s cache get failed: %s", self.ns, e)
+            v = None
+        if v is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return v
+
+    def set(self, k: str, v: Any, ttl: Optional[float] = None):
+        """Store `v`; `ttl` overrides the cache-wide TTL for this entry."""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        try:
+            self._set(k, v, ttl)
+        except Exception as e:
+            logging.warning("%s cache set failed: %s", self.ns, e)
+
+    def delete(self, k: str):
+        try:
+            self._del(k)
+        except Exception as e:
+            logging.warning("%s cache delete failed: %s", self.ns, e)
+
+    def stats(self) -> Dict:
+        n = self.hits + self.misses
+        try:
+            entries = self._len()
+        except Exception:
+            entries = None
+        return {"backend": self.kind, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / n if n else 0.0, "entries": entries}
+
+    @abstractmethod
+    def _get(self, k: str) -> Any: ...
+
+    @abstractmethod
+    def _set(self, k: str, v: Any, ttl: float): ...
+
+    @abstractmethod
+    def _del(self, k: str): ...
+
+    @abstractmethod
+    def _len(self) -> int: ...
+
+class MemCache(TTLCache):
+    kind = "memory"
+
+    def __init__(self, ns: str, ttl: float, size: int):
+        super().__init__(ns, ttl, size)
+        self._d: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, k):
+        with self._lock:
+            exp, v = self._d.get(k, (0, None))
+            if exp <= time.monotonic():
+                self._d.pop(k, None)
+                return None
+            self._d.move_to_end(k)
+            return v
+
+    def _set(self, k, v, ttl):
+        with self._lock:
+            self._d[k] = (time.monotonic() + ttl, v)
+            self._d.move_to_end(k)
+            while len(self._d) > self.size:
+                self._d.popitem(last=False)
+
+    def _del(self, k):
+        with self._lock:
+            self._d.pop(k, None)
+
+    def _len(self):
+        return len(self._d)
+
+class SqliteCache(TTLCache):
+    """One table per namespace in a file shared by all workers on the host."""
+    kind = "sqlite"
+
+    def __init__(self, ns: str, ttl: float, size: int, path: str = CACHE_PATH):
+        super().__init__(ns, ttl, size)
+        self.path, self._tl, self._t = path, threading.local(), re.sub(r"\W", "_", ns)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db = self._db()
+        db.execute(f"CREATE TABLE IF NOT EXISTS {self._t} (k TEXT PRIMARY KEY, v TEXT, exp REAL, at REAL)")
+        db.execute(f"CREATE INDEX IF NOT EXISTS {self._t}_at ON {self._t} (at)")
+
+    def _db(self) -> sqlite3.Connection:
+        if not hasattr(self._tl, "db"):
+            self._tl.db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._tl.db.execute("PRAGMA journal_mode=WAL")
+        return self._tl.db
+
+    def _get(self, k):
+        db, now = self._db(), time.time()
+        row = db.execute(f"SELECT v FROM {self._t} WHERE k = ? AND exp > ?", (k, now)).fetchone()
+        if row is None:
+            return None
+        db.execute(f"UPDATE {self._t} SET at = ? WHERE k = ?", (now, k))
+        return json.loads(row[0])
+
+    def _set(self, k, v, ttl):
+        db, now = self._db(), time.time()
+        db.execute(f"INSERT OR REPLACE INTO {self._t} VALUES (?, ?, ?, ?)", (k, json.dumps(v), now + ttl, now))
+        db.execute(f"DELETE FROM {self._t} WHERE exp <= ?", (now,))
+        db.execute(f"DELETE FROM {self._t} WHERE k IN (SELECT k FROM {self._t} ORDER BY at DESC LIMIT -1 OFFSET ?)", (self.size,))
+
+    def _del(self, k):
+        self._db().execute(f"DELETE FROM {self._t} WHERE k = ?", (k,))
+
+    def _len(self):
+        return self._db().execute(f"SELECT COUNT(*) FROM {self._t}").fetchone()[0]
+
+class RedisCache(TTLCache):
+    """Redis (or compatible) keys with native expiry; a sorted set of access times bounds the size."""
+    kind = "redis"
+
+    def __init__(self, ns: str, ttl: float, size: int, url: str = CACHE_URL):
+        super().__init__(ns, ttl, size)
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("FOCUS_SEARCH_CACHE=redis needs the 'redis' package") from None
+        self._r, self._p = redis.Redis.from_url(url), f"focus:{ns}:"
+        self._lru = self._p + "lru"
+
+    def _get(self, k):
+        raw = self._r.get(self._p + k)
+        if raw is None:
+            return None
+        self._r.zadd(self._lru, {k: time.time()})
+        return json.loads(raw)
+
+    def _set(self, k, v, ttl):
+        now, pipe = time.time(), self._r.pipeline()
+        pipe.set(self._p + k, json.dumps(v), px=int(ttl * 1000))
+        pipe.zadd(self._lru, {k: now})
+        pipe.zremrangebyscore(self._lru, "-inf", now - self.ttl)
+        pipe.zcard(self._lru)
+        over = pipe.execute()[-1] - self.size
+        if over > 0:
+            self._r.delete(*(self._p + m.decode() for m, _ in self._r.zpopmin(self._lru, over)))
+
+    def _del(self, k):
+        self._r.pipeline().delete(self._p + k).zrem(self._lru, k).execute()
+
+    def _len(self):
+        return self._r.zcard(self._lru)
+
+CACHES = {"memory": MemCache, "sqlite": SqliteCache, "redis": RedisCache}
+
+def make_cache(ns: str, ttl: float = CACHE_TTL, size: int = CACHE_SIZE, kind: str = CACHE_KIND) -> TTLCache:
+    return CACHES[kind](ns, ttl, size) if kind != "none" else MemCache(ns, ttl, 0)
+
+SEARCH_CACHE = make_cache("search")
+
+class Flight:
+    """Single-flight: concurrent calls with one key share a single execution
+    (result or exception)."""
+
+    def __init__(self):
+        self._lock, self._calls = threading.Lock(), {}
+        self.executed = self.shared = 0
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            lead = call is None
+            if lead:
+                call = self._calls[key] = {"done": threading.Event(), "res": None, "err": None}
+                self.executed += 1
+            else:
+                self.shared += 1
+        if not lead:
+            call["done"].wait()
+            if call["err"] is not None:
+                raise call["err"]
+            return call["res"]
+        try:
+            call["res"] = fn()
+            return call["res"]
+        except BaseException as e:
+            call["err"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+    def stats(self) -> Dict:
+        return {"executed": self.executed, "shared": self.shared, "in_flight": len(self._calls)}
+
+FLIGHT = Flight()
+
+def ckey(kind: str, q: str, flt: str = "all") -> str:
+    return f"{kind}:{flt}:{' '.join(q.casefold().split())}"
+
+def pick(vids: List[Dict], flt: str, n: int = 8) -> List[Dict]:
+    """Local duration filter over an already fetched (raw) list."""
+    out = []
+    for v in vids:
+        try:
+            s = dur2sec(v["dur"]) if v.get("dur") else None
+        except ValueError:
+            s = None
+        if dur_ok(s, flt):
+            out.append(v)
+            if len(out) == n:
+                break
+    return out
+
+def yt_search(q: str, flt: str) -> List[Dict]:
+    """Cached per (query, filter). Filtered pages are cut from the cached raw
+    list when it holds a full page of matches, else fetched with `sp`.
+    Concurrent misses share one fetch."""
+    k = ckey("videos", q, flt)
+    hit = SEARCH_CACHE.get(k)
+    return hit if hit is not None else FLIGHT.do(k, lambda: _yt_search(q, flt, k))
+
+def _yt_search(q: str, flt: str, k: str) -> List[Dict]:
+    raw, done = SEARCH_CACHE.get(ckey("raw", q)), True
+    if raw is None and flt not in DUR_SP:
+        try:
+            raw = _fill(ckey("raw", q), SEARCH.videos(q, "all", RAW_N))
+        except SearchIncomplete as e:
+            raw, done = e.results, False
+    out = pick(raw, flt) if raw is not None else []
+    if len(out) < 8 and flt in DUR_SP:
+        try:
+            out, done = SEARCH.videos(q, flt), True
+        except SearchIncomplete as e:
+            out, done = e.results, False
+    return _fill(k, out) if done else out
+
+def yt_channels(q: str) -> List[Dict]:
+    k = ckey("channels", q)
+    hit = SEARCH_CACHE.get(k)
+    if hit is None:
+        def fetch():
+            try:
+                return _fill(k, SEARCH.channels(q))
+            except SearchIncomplete as e:
+                return e.results
+        hit = FLIGHT.do(k, fetch)
+    return hit
+
+def _fill(k: str, v: Any) -> Any:
+    """Cache complete results; empty ones only for CACHE_EMPTY_TTL."""
+    SEARCH_CACHE.set(k, v, None if v else CACHE_EMPTY_TTL)
+    return v
+
+def yt_search_all(q: str, flt: str) -> Dict[str, List[Dict]]:
+    """Videos + channels, from one page load where the backend allows.
+    The unfiltered page is cached once; every filter is applied locally."""
+    raw, chans = SEARCH_CACHE.get(ckey("raw", q)), SEARCH_CACHE.get(ckey("page-channels", q))
+    if raw is None or chans is None:
+        def fetch():
+            try:
+                res = SEARCH.both(q, "all", RAW_N)
+            except SearchIncomplete as e:
+                return e.results
+            _fill(ckey("raw", q), res["videos"])
+            _fill(ckey("page-channels", q), res["channels"])
+            return res
+        res = FLIGHT.do(ckey("page", q), fetch)
+        raw, chans = res["videos"], res["channels"]
+    return {"videos": pick(raw, flt), "channels": chans}
+
 def channel_videos(url: str, limit: int = 36) -> List[Dict]:
     if not url.rstrip("/").endswith("/videos"):
         url = url.rstrip("/") + "/videos"
+    return FLIGHT.do(f"channel:{limit}:{url}", lambda: _channel_videos(url, limit))
+
+def _channel_videos(url: str, limit: int) -> List[Dict]:
     with YoutubeDL({"quiet": True, "skip_download": True, "extract_flat": "in_playlist", "playlistend": limit}) as ydl:
         info = ydl.extract_info(url, download=False)
     return [{"id": e["id"], "title": e["title"],
              "thumb": f"https://i.ytimg.com/vi/{e['id']}/hqdefault.jpg",
              "dur": e.get("duration_string") or ""} for e in info.get("entries", [])[:limit]]
 
-def hls_master_url(vid: str) -> Optional[str]:
-    try:
+# ───────────── yt-dlp info cache ─────────────
+# Signed googlevideo URLs carry their expiry as `expire=<ts>` (progressive) or
+# `/expire/<ts>/` (HLS manifests); an info dict is reused until the earliest one.
+INFO_CACHE = make_cache("info", ttl=float(os.environ.get("FOCUS_INFO_CACHE_TTL", "3600")),
+                        size=int(os.environ.get("FOCUS_INFO_CACHE_SIZE", "128")), kind="memory")
+INFO_MARGIN = float(os.environ.get("FOCUS_INFO_CACHE_MARGIN", "60"))
+EXPIRE_RE = re.compile(r"[?&/]expire[=/](\d+)")
+
+def url_ttl(u: str) -> Optional[float]:
+    """Seconds until signed URL `u` expires, minus a safety margin; None if unsigned."""
+    m = EXPIRE_RE.search(u)
+    return int(m.group(1)) - time.time() - INFO_MARGIN if m else None
+
+def info_ttl(info: Dict) -> Optional[float]:
+    """TTL of the first signed URL in `info` to expire; None (cache-wide TTL) when none is signed."""
+    ttls = [t for f in info.get("formats") or []
+            if (t := url_ttl(f.get("url") or f.get("manifest_url") or "")) is not None]
+    return min(ttls) if ttls else None
+
+def yt_info(vid: str, refresh: bool = False) -> Dict:
+    """Full yt-dlp info dict, cached per video until its URLs expire; concurrent
+    extractions for one video are coalesced. Treat the result as read-only.
+    `refresh` drops the cached entry first (e.g. after upstream rejected its URLs)."""
+    if refresh:
+        INFO_CACHE.delete(vid)
+    hit = INFO_CACHE.get(vid)
+    if hit is not None:
+        return hit
+    def extract():
         with YoutubeDL({"quiet": True}) as ydl:
             info = ydl.extract_info(f"https://www.youtube.com/watch?v={vid}", download=False)
+        INFO_CACHE.set(vid, info, info_ttl(info))
+        return info
+    return FLIGHT.do(f"info:{vid}", extract)
+
+def hls_master_url(vid: str) -> Optional[str]:
+    try:
+        info = yt_info(vid)
         hls = [f for f in info["formats"] if f.get("ext") == "m3u8"]
         return max(hls, key=lambda f: f.get("height") or 0)["url"] if hls else None
     except Exception as e:
         logging.warning("yt-dlp HLS fetch failed: %s", e)
         return None
 
-def progressive_url(vid: str) -> str:
-    with YoutubeDL({"quiet": True}) as ydl:
-        info = ydl.extract_info(f"https://www.youtube.com/watch?v={vid}", download=False)
-    prog = [f for f in info["formats"] if f["vcodec"] != "none" and f["acodec"] != "none" and f.get("ext") == "mp4"]
+STREAM_URLS = make_cache("stream-url", size=int(os.environ.get("FOCUS_STREAM_URL_CACHE_SIZE", "512")), kind="memory")
+
+def progressive_url(vid: str, fmt: str = "best", stale: Optional[str] = None) -> str:
+    """Signed googlevideo URL for (vid, format id), cached until shortly before it
+    expires. "best" is the tallest muxed MP4. `stale` is a URL upstream rejected:
+    it is re-resolved unless another request already replaced it."""
+    k = f"{vid}:{fmt}"
+    if (u := STREAM_URLS.get(k)) is not None and u != stale:
+        return u
+    info = yt_info(vid)
+    if stale and any(f.get("url") == stale for f in info["formats"]):
+        info = yt_info(vid, refresh=True)
+    if fmt == "best":
+        prog = [f for f in info["formats"] if f["vcodec"] != "none" and f["acodec"] != "none" and f.get("ext") == "mp4"]
+    else:
+        prog = [f for f in info["formats"] if f.get("format_id") == fmt]
     if not prog:
         abort(404, "MP4 bulunamadı")
-    return max(prog, key=lambda f: f.get("height") or 0)["url"]
+    u = max(prog, key=lambda f: f.get("height") or 0)["url"]
+    STREAM_URLS.set(k, u, url_ttl(u))
+    return u
+
+# ───────────── Upstream HTTP ─────────────
+# One keep-alive pool per upstream host, shared by every request thread, so
+# segment and MP4 fetches skip DNS + TCP + TLS after the first one.
+UP_HOSTS = int(os.environ.get("FOCUS_UPSTREAM_HOSTS", "16"))
+UP_CONNS = int(os.environ.get("FOCUS_UPSTREAM_CONNS_PER_HOST", "16"))
+UP_RETRIES = int(os.environ.get("FOCUS_UPSTREAM_RETRIES", "2"))
+UP_BACKOFF = float(os.environ.get("FOCUS_UPSTREAM_BACKOFF", "0.25"))
+UP_POOL_WAIT = float(os.environ.get("FOCUS_UPSTREAM_POOL_WAIT", "10"))
+
+class _WaitingPool(HTTPConnectionPool):
+    def _get_conn(self, timeout=None):
+        return super()._get_conn(UP_POOL_WAIT if timeout is None else timeout)
+
+class _WaitingHTTPSPool(HTTPSConnectionPool):
+    def _get_conn(self, timeout=None):
+        return super()._get_conn(UP_POOL_WAIT if timeout is None else timeout)
+
+class PoolAdapter(HTTPAdapter):
+    """requests never passes urllib3 a pool timeout, so a full blocking pool would wait
+    forever; these pools wait UP_POOL_WAIT s, then raise EmptyPoolError (a 503)."""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _WaitingPool, "https": _WaitingHTTPSPool}
+
+# pool_block: at most UP_CONNS connections per host; extra requests wait up to UP_POOL_WAIT s for one.
+# Retries (GET/HEAD only) cover connect/read errors and 5xx/429, before any body is streamed.
+UPSTREAM = PoolAdapter(
+    pool_connections=UP_HOSTS, pool_maxsize=UP_CONNS, pool_block=True,
+    max_retries=Retry(total=UP_RETRIES, backoff_factor=UP_BACKOFF, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset({"GET", "HEAD"}), raise_on_status=False))
+_up_local = threading.local()
+RELAY_HEADERS = ("Content-Type", "Content-Length", "Content-Range", "Accept-Ranges", "Content-Encoding")
+
+def upstream() -> requests.Session:
+    """This thread's session; all sessions share the UPSTREAM pools (Session itself isn't thread-safe)."""
+    if not hasattr(_up_local, "s"):
+        _up_local.s = requests.Session()
+        _up_local.s.mount("https://", UPSTREAM)
+        _up_local.s.mount("http://", UPSTREAM)
+    return _up_local.s
+
+# Relay chunking. "fixed": every read is RELAY_CHUNK bytes. "adaptive": reads
+# grow from RELAY_FIRST to RELAY_CHUNK, so the first bytes go out quickly and
+# long bodies cost few iterations. "readinto": adaptive reads straight from the
+# http.client response into one reused buffer, skipping urllib3's per-read
+# allocations (WSGI/ASGI still need one bytes object per yielded chunk).
+# Bodies are relayed undecoded, so Content-Length/-Encoding stay truthful.
+RELAY_MODE = os.environ.get("FOCUS_RELAY_MODE", "adaptive")
+RELAY_CHUNK = int(os.environ.get("FOCUS_RELAY_CHUNK", str(512 * 1024)))
+RELAY_FIRST = int(os.environ.get("FOCUS_RELAY_FIRST_CHUNK", str(16 * 1024)))
+
+def chunk_sizes(first: int = RELAY_FIRST, cap: int = RELAY_CHUNK):
+    n = min(first, cap)
+    while True:
+        yield n
+        n = min(n * 2, cap)
+
+def relay(r: requests.Response, mode: str = RELAY_MODE, chunk: int = RELAY_CHUNK):
+    """Stream an upstream body; always returns the connection to the pool, even if the client left."""
+    fp = getattr(r.raw, "_fp", None)
+    try:
+        if mode == "fixed":
+            yield from r.raw.stream(chunk, decode_content=False)
+        elif mode == "readinto" and hasattr(fp, "readinto"):
+            view = memoryview(bytearray(chunk))
+            for want in chunk_sizes(cap=chunk):
+                n = fp.readinto(view[:want])
+                if not n:
+                    break
+                yield bytes(view[:n])
+            r.raw.release_conn()  # read past urllib3, so hand the finished connection back ourselves
+        else:
+            for want in chunk_sizes(cap=chunk):
+                data = r.raw.read(want, decode_content=False)
+                if not data:
+                    break
+                yield data
+    finally:
+        r.close()
+
+def bench_relay(mb: int = 64, runs: int = 3) -> Dict[str, Dict]:
+    """Relay `mb` MiB from a local HTTP server through each mode; best of `runs`.
+    CPU seconds include the in-process server, which costs the same in every mode."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    block = os.urandom(1 << 20)
+
+    class Source(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(mb << 20))
+            self.end_headers()
+            for _ in range(mb):
+                self.wfile.write(block)
+        def log_message(self, *a):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Source)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    url, out = f"http://127.0.0.1:{srv.server_port}/", {}
+    try:
+        for mode, chunk in (("fixed", 8192), ("fixed", RELAY_CHUNK), ("adaptive", RELAY_CHUNK), ("readinto", RELAY_CHUNK)):
+            best = None
+            for _ in range(runs):
+                t0, c0, n, chunks = time.perf_counter(), time.process_time(), 0, 0
+                for data in relay(upstream().get(url, stream=True, headers={"Accept-Encoding": "identity"}), mode, chunk):
+                    n, chunks = n + len(data), chunks + 1
+                wall, cpu = time.perf_counter() - t0, time.process_time() - c0
+                if best is None or wall < best["seconds"]:
+                    best = {"seconds": wall, "mb_s": n / wall / (1 << 20), "cpu_s": cpu, "chunks": chunks}
+            out[f"{mode} {chunk // 1024} KiB"] = best
+    finally:
+        srv.shutdown()
+    return out
+
+def upstream_stats() -> Dict:
+    """Per-host pool usage: requests sent, connections opened, idle and in use."""
+    pm, out = UPSTREAM.poolmanager, {}
+    for key in list(pm.pools.keys()):
+        try:
+            p = pm.pools[key]
+        except KeyError:
+            continue
+        q = list(p.pool.queue) if p.pool else []
+        out[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+            "requests": p.num_requests, "opened": p.num_connections,
+            "idle": sum(c is not None for c in q), "in_use": (p.pool.maxsize - len(q)) if p.pool else 0}
+    return {"hosts": out, "max_hosts": UP_HOSTS, "max_per_host": UP_CONNS}
+
+# ───────────── Segment cache ─────────────
+# HLS segments on disk, keyed by their URL minus everything that changes between
+# extractions (signature, expiry, client IP, edge host, ...), so rewatches and
+# concurrent viewers of one video share them. A miss is fetched once, on a
+# thread that writes a tmp file (renamed into place when complete); the viewers
+# that asked for it read the tmp file as it grows, so nobody waits for the whole
+# segment. The byte budget is per worker process: each worker indexes and evicts
+# only the segments it fetched or found at startup, so W workers sharing the
+# directory may use up to W × FOCUS_SEGMENT_CACHE_MB of disk.
+SEG_DIR = os.environ.get("FOCUS_SEGMENT_CACHE_DIR", os.path.expanduser("~/.cache/youtube-focus/segments"))
+SEG_BUDGET = int(float(os.environ.get("FOCUS_SEGMENT_CACHE_MB", "1024")) * (1 << 20))
+SEG_MAX_ITEM = int(float(os.environ.get("FOCUS_SEGMENT_CACHE_ITEM_MB", "32")) * (1 << 20))
+VOLATILE = {"expire", "ei", "ip", "ipbits", "sig", "lsig", "signature", "sparams", "lsparams", "n", "mh", "mm",
+            "mn", "ms", "mv", "mvi", "mt", "pl", "initcwndbps", "vprv", "pcm2cms", "hls_chunk_host", "txp", "ctier",
+            "rqh", "spc", "susc", "fexp", "c", "cver", "rm", "cpn", "rn", "rbuf", "bui", "met", "nh", "pfa",
+            "pacing", "keepalive", "requiressl", "gir", "xpc", "ns", "svpuc", "ratebypass", "dover", "playlist_type"}
+
+class Seg(NamedTuple):
+    path: str
+    size: int
+    ctype: str
+
+class SegFill:
+    """A segment being written into the cache (or, done=True, already in it)."""
+    def __init__(self, seg: Seg, tmp: str, done: bool = False):
+        self.seg, self.tmp, self.done, self.error = seg, tmp, done, None
+        self.written = seg.size if done else 0
+        self.cond = threading.Condition()
+
+    def open(self) -> "SegReader":
+        with self.cond:
+            if self.error:
+                raise self.error
+            return SegReader(self, open(self.seg.path if self.done else self.tmp, "rb"))
+
+    def wait(self) -> Seg:
+        with self.cond:
+            self.cond.wait_for(lambda: self.done or self.error)
+            if self.error:
+                raise self.error
+            return self.seg
+
+class SegReader:
+    """File-like view of a SegFill: read() blocks until the bytes at its position are written."""
+    def __init__(self, fill: SegFill, f):
+        self.fill, self.f, self.pos = fill, f, 0
+
+    def seek(self, pos: int):
+        self.pos = self.f.seek(pos)
+
+    def read(self, n: int) -> bytes:
+        fl = self.fill
+        with fl.cond:
+            fl.cond.wait_for(lambda: fl.written > self.pos or fl.done or fl.error)
+            avail = fl.written - self.pos
+            if avail <= 0 and fl.error:
+                raise fl.error
+        data = self.f.read(min(n, avail)) if avail > 0 else b""
+        self.pos += len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+def seg_key(u: str) -> str:
+    """Stable cache key: googlevideo `/videoplayback/k/v/...` path params and query
+    params, minus VOLATILE ones; the edge host is dropped for googlevideo URLs."""
+    p = urllib.parse.urlsplit(u)
+    parts = p.path.strip("/").split("/")
+    params = urllib.parse.parse_qsl(p.query, keep_blank_values=True)
+    if parts[0] == "videoplayback" and len(parts) % 2 == 1:
+        base = "videoplayback"
+        params += list(zip(parts[1::2], parts[2::2]))
+    else:
+        base = p.netloc + p.path
+    stable = sorted((k, v) for k, v in params if k not in VOLATILE)
+    return hashlib.sha256(f"{base}?{urllib.parse.urlencode(stable)}".encode()).hexdigest()
+
+class SegmentCache:
+    def __init__(self, root: str, budget: int, max_item: int):
+        self.root, self.budget, self.max_item = root, budget, max_item
+        self._lock, self._idx, self.bytes = threading.Lock(), OrderedDict(), 0
+        self._filling: Dict[str, SegFill] = {}
+        self.hits = self.misses = self.evictions = 0
+        if budget > 0:
+            os.makedirs(root, exist_ok=True)
+            self._load()
+
+    def _load(self):
+        """Rebuild the index from completed entries (those with a .json sidecar), oldest first."""
+        found = []
+        for meta in glob.glob(os.path.join(self.root, "*", "*.json")):
+            try:
+                with open(meta) as f:
+                    seg = Seg(**json.load(f))
+                st = os.stat(seg.path)
+            except (OSError, ValueError, TypeError):
+                continue
+            if st.st_size == seg.size:
+                found.append((st.st_mtime, os.path.basename(seg.path), seg))
+        for _, key, seg in sorted(found):
+            self._idx[key] = seg
+            self.bytes += seg.size
+        with self._lock:
+            self._evict()
+
+    def get(self, key: str, count: bool = True) -> Optional[Seg]:
+        with self._lock:
+            seg = self._idx.get(key)
+            if seg:
+                self._idx.move_to_end(key)
+            if count:
+                self.hits, self.misses = self.hits + bool(seg), self.misses + (not seg)
+            return seg
+
+    def forget(self, key: str):
+        with self._lock:
+            if (seg := self._idx.pop(key, None)):
+                self.bytes -= seg.size
+
+    def start(self, key: str, u: str) -> Optional[SegFill]:
+        """Start fetching `u` into the cache, or join the fetch in progress; None if
+        upstream's answer isn't a cacheable segment. Call it through FLIGHT."""
+        with self._lock:
+            if (fl := self._filling.get(key)):
+                return fl
+            if (seg := self._idx.get(key)):
+                return SegFill(seg, seg.path, done=True)
+        r = upstream().get(u, headers={"Accept-Encoding": "identity"}, stream=True, timeout=15)
+        try:
+            size = int(r.headers.get("Content-Length") or -1)
+            if r.status_code != 200 or not 0 <= size <= self.max_item or \
+                    r.headers.get("Content-Encoding", "identity") != "identity":
+                r.close()
+                return None
+            path = os.path.join(self.root, key[:2], key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fl = SegFill(Seg(path, size, r.headers.get("Content-Type", "video/mp2t")),
+                         f"{path}.{os.getpid()}.{threading.get_ident()}.tmp")
+            f = open(fl.tmp, "wb", buffering=0)  # unbuffered: readers follow the file
+        except BaseException:
+            r.close()
+            raise
+        with self._lock:
+            self._filling[key] = fl
+        threading.Thread(target=self._pump, args=(key, fl, r, f), name="segment-fill", daemon=True).start()
+        return fl
+
+    def _pump(self, key: str, fl: SegFill, r, f):
+        try:
+            with f:
+                for data in relay(r):
+                    f.write(data)
+                    with fl.cond:
+                        fl.written += len(data)
+                        fl.cond.notify_all()
+            if fl.written != fl.seg.size:
+                raise IOError(f"segment truncated at {fl.written}/{fl.seg.size} bytes")
+            with open(fl.tmp + ".json", "w") as meta:
+                json.dump(fl.seg._asdict(), meta)
+            os.replace(fl.tmp + ".json", fl.seg.path + ".json")
+            with fl.cond:
+                os.replace(fl.tmp, fl.seg.path)
+                fl.done = True
+                fl.cond.notify_all()
+            with self._lock:
+                if key not in self._idx:
+                    self.bytes += fl.seg.size
+                self._idx[key] = fl.seg
+                self._evict()
+        except Exception as e:
+            logging.warning("Segment cache fill failed: %s", e)
+            with fl.cond:
+                fl.error = e
+                fl.cond.notify_all()
+            for tmp in (fl.tmp, fl.tmp + ".json"):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        finally:
+            r.close()
+            with self._lock:
+                self._filling.pop(key, None)
+
+    def fill(self, key: str, u: str) -> Optional[Seg]:
+        """Fetch `u` into the cache and wait until it is complete; None if it isn't cacheable."""
+        fl = FLIGHT.do(f"seg:{key}", lambda: self.start(key, u))
+        return fl.wait() if fl else None
+
+    def _evict(self):
+        while self.bytes > self.budget and len(self._idx) > 1:
+            _, old = self._idx.popitem(last=False)
+            self.bytes -= old.size
+            self.evictions += 1
+            for f in (old.path + ".json", old.path):
+                try:
+                    os.remove(f)
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._idx), "bytes": self.bytes, "budget": self.budget,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+SEGMENTS = SegmentCache(SEG_DIR, SEG_BUDGET, SEG_MAX_ITEM)
+
+def is_playlist(u: str) -> bool:
+    return urllib.parse.urlsplit(u).path.endswith(".m3u8")
+
+def cached_segment(u: str, cache: Optional["SegmentCache"] = None, pf: Optional["Prefetcher"] = None):
+    """(Seg, file) from the cache (default SEGMENTS); on a miss the fill starts and
+    the file follows it as it is written. None to fall back to pass-through.
+    The wait for the response headers is recorded in `pf` (default PREFETCH)."""
+    cache, pf = cache or SEGMENTS, pf or PREFETCH
+    if cache.budget <= 0 or is_playlist(u):
+        return None
+    key, t0 = seg_key(u), time.perf_counter()
+    try:
+        seg = cache.get(key)
+        fl = None if seg else FLIGHT.do(f"seg:{key}", lambda: cache.start(key, u))
+    except Exception as e:
+        logging.warning("Segment cache fill failed, passing through: %s", e)
+        return None
+    pf.record((time.perf_counter() - t0) * 1000, seg is not None)
+    try:
+        if seg:
+            return seg, open(seg.path, "rb")
+        return (fl.seg, fl.open()) if fl else None
+    except FileNotFoundError:  # evicted by another worker sharing the directory
+        cache.forget(key)
+        return None
+    except OSError as e:  # the fill failed before we opened it
+        logging.warning("Segment cache fill failed, passing through: %s", e)
+        return None
+
+def range_of(rng: Optional[str], size: int):
+    """(status, start, end) for a single `bytes=` range; anything else gets the whole body."""
+    m = re.fullmatch(r"bytes=(\d*)-(\d*)", (rng or "").strip())
+    if not m or not any(m.groups()):
+        return 200, 0, size - 1
+    a, b = m.groups()
+    start, end = (max(size - int(b), 0), size - 1) if not a else (int(a), min(int(b) if b else size - 1, size - 1))
+    return (416, 0, -1) if start >= size or start > end else (206, start, end)
+
+def seg_response(seg: Seg, f, rng: Optional[str]):
+    """Status, headers and body generator serving (part of) a cached segment."""
+    status, start, end = range_of(rng, seg.size)
+    hdr = {"Content-Type": seg.ctype, "Accept-Ranges": "bytes", "Cache-Control": "no-store",
+           "Content-Length": str(end - start + 1)}
+    if status == 206:
+        hdr["Content-Range"] = f"bytes {start}-{end}/{seg.size}"
+    elif status == 416:
+        hdr["Content-Range"] = f"bytes */{seg.size}"
+
+    def body():
+        try:
+            f.seek(start)
+            left = end - start + 1
+            for want in chunk_sizes():
+                if left <= 0 or not (data := f.read(min(want, left))):
+                    break
+                left -= len(data)
+                yield data
+        finally:
+            f.close()
+    return status, hdr, body()
+
+# ───────────── Segment prefetch ─────────────
+# Optional (FOCUS_PREFETCH_SEGMENTS=k > 0, needs the segment cache). Media
+# playlists served by the proxy number their segment tokens (<playlist>.<seq>);
+# each request for segment i moves that viewer's position (viewer + playlist) to
+# i and warms i+1..i+k into the segment cache in the background. A viewer is the
+# VIEWER_COOKIE handed out with the master playlist, so clients behind one NAT
+# address keep separate positions; without the cookie it is address + user agent.
+# Work is capped globally (queued + running) and per viewer; queued jobs that
+# fall behind a seek, or whose viewer went idle, are dropped before fetching.
+# Idle viewers are expired by a timer.
+PREFETCH_AHEAD = int(os.environ.get("FOCUS_PREFETCH_SEGMENTS", "0"))
+PREFETCH_WORKERS = int(os.environ.get("FOCUS_PREFETCH_WORKERS", "4"))
+PREFETCH_PER_SESSION = int(os.environ.get("FOCUS_PREFETCH_PER_SESSION", "2"))
+PREFETCH_IDLE = float(os.environ.get("FOCUS_PREFETCH_IDLE", "30"))
+VIEWER_COOKIE = "focus_viewer"
+
+def viewer_key(cookie: Optional[str], addr: Optional[str], agent: Optional[str]) -> str:
+    return cookie or f"{addr}|{agent}"
+
+class Prefetcher:
+    def __init__(self, cache: SegmentCache, ahead: int, workers: int, per_session: int, idle: float):
+        self.cache = cache
+        self.ahead = ahead if cache.budget > 0 else 0
+        self.per_session, self.idle = per_session, idle
+        self._pool = ThreadPoolExecutor(max(workers, 1), thread_name_prefix="prefetch") if self.ahead else None
+        self._stop = threading.Event()
+        if self._pool:
+            threading.Thread(target=self._reap, name="prefetch-reaper", daemon=True).start()
+        self._slots = threading.BoundedSemaphore(max(workers, 1))
+        self._lock = threading.Lock()
+        self._lists: "OrderedDict[str, Dict[int, str]]" = OrderedDict()
+        self._sessions: Dict[str, Dict] = {}
+        self.counts = {"scheduled": 0, "fetched": 0, "cancelled": 0, "failed": 0, "busy": 0}
+        self.waits = {"requests": 0, "ready": 0, "total_ms": 0.0, "max_ms": 0.0, "over_100ms": 0}
+
+    def register(self, p: str, seq0: int, urls: List[str]):
+        """Remember playlist `p`'s segment URLs by media sequence number (live windows merge)."""
+        with self._lock:
+            segs = self._lists.setdefault(p, {})
+            self._lists.move_to_end(p)
+            segs.update(enumerate(urls, seq0))
+            for old in sorted(segs)[:max(len(segs) - 4096, 0)]:
+                del segs[old]
+            while len(self._lists) > 64:
+                self._lists.popitem(last=False)
+
+    def on_request(self, sid: str, p: str, i: int):
+        if not self._pool:
+            return
+        with self._lock:
+            ses = self._sessions.setdefault(sid, {"busy": set()})
+            ses["pos"], ses["seen"] = i, time.monotonic()
+            segs = self._lists.get(p) or {}
+            todo = [(j, segs[j]) for j in range(i + 1, i + 1 + self.ahead) if j in segs and j not in ses["busy"]]
+        for j, u in todo:
+            if len(ses["busy"]) >= self.per_session:
+                break
+            if self.cache.get(seg_key(u), count=False):
+                continue
+            if not self._slots.acquire(blocking=False):
+                with self._lock:
+                    self.counts["busy"] += 1
+                break
+            with self._lock:
+                ses["busy"].add(j)
+                self.counts["scheduled"] += 1
+            self._pool.submit(self._run, sid, ses, j, u)
+
+    def _reap(self):
+        """Drop viewers idle for longer than `idle`, checking every `idle` / 2 seconds."""
+        while not self._stop.wait(max(self.idle / 2, 1.0)):
+            cutoff = time.monotonic() - self.idle
+            with self._lock:
+                for k in [k for k, v in self._sessions.items() if v["seen"] < cutoff]:
+                    del self._sessions[k]
+
+    def _run(self, sid: str, ses: Dict, j: int, u: str):
+        outcome = "cancelled"
+        try:
+            with self._lock:
+                live = self._sessions.get(sid) is ses and ses["pos"] < j <= ses["pos"] + self.ahead
+            if live:
+                self.cache.fill(seg_key(u), u)
+                outcome = "fetched"
+        except Exception as e:
+            logging.info("Prefetch of segment %s failed: %s", j, e)
+            outcome = "failed"
+        finally:
+            with self._lock:
+                ses["busy"].discard(j)
+                self.counts[outcome] += 1
+            self._slots.release()
+
+    def record(self, ms: float, ready: bool):
+        """A segment request waited `ms` for its bytes; `ready` if they were already cached."""
+        with self._lock:
+            w = self.waits
+            w["requests"], w["ready"], w["total_ms"] = w["requests"] + 1, w["ready"] + ready, w["total_ms"] + ms
+            w["max_ms"], w["over_100ms"] = max(w["max_ms"], ms), w["over_100ms"] + (ms > 100)
+
+    def close(self):
+        self._stop.set()
+        if self._pool:
+            self._pool.shutdown(wait=True)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"ahead": self.ahead, "sessions": len(self._sessions), **self.counts, "waits": dict(self.waits)}
+
+PREFETCH = Prefetcher(SEGMENTS, PREFETCH_AHEAD, PREFETCH_WORKERS, PREFETCH_PER_SESSION, PREFETCH_IDLE)
+atexit.register(PREFETCH.close)
+
+def bench_prefetch(segments: int = 20, seg_s: float = 0.25, latency: float = 0.3, ahead: int = 3) -> Dict[str, Dict]:
+    """Simulated viewer without a forward buffer: it asks for segment i+1 once
+    segment i has played for `seg_s`, so every wait after the first is a stall.
+    The local upstream answers after `latency`. Compares prefetch off and on
+    with a private cache and prefetcher; SEGMENTS and PREFETCH are untouched."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Source(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Length", str(1 << 16))
+            self.end_headers()
+            self.wfile.write(bytes(1 << 16))
+        def log_message(self, *a):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Source)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    out = {}
+    try:
+        for k in (0, ahead):
+            with tempfile.TemporaryDirectory() as d:
+                cache = SegmentCache(d, 1 << 30, SEG_MAX_ITEM)
+                pf = Prefetcher(cache, k, PREFETCH_WORKERS, PREFETCH_PER_SESSION, PREFETCH_IDLE)
+                try:
+                    urls = [f"http://127.0.0.1:{srv.server_port}/videoplayback/id/b{k}/sq/{i}/file/seg.ts" for i in range(segments)]
+                    pf.register("bench", 0, urls)
+                    waits = []
+                    for i, u in enumerate(urls):
+                        t0 = time.perf_counter()
+                        pf.on_request("bench", "bench", i)
+                        seg, f = cached_segment(u, cache, pf)
+                        f.close()
+                        waits.append(time.perf_counter() - t0)
+                        time.sleep(seg_s)
+                finally:
+                    pf.close()
+            out[f"ahead={k}"] = {"startup_ms": waits[0] * 1000, "stall_ms": sum(waits[1:]) * 1000,
+                                 "stalls": sum(w > 0.05 for w in waits[1:])}
+    finally:
+        srv.shutdown()
+    return out
+
+# ───────────── HLS playlists ─────────────
+# A playlist is parsed once into head tags and entries (tags, URI) with every URI
+# (variant, rendition, segment, EXT-X-KEY, EXT-X-MAP) resolved against its own URL,
+# then rendered in one pass with proxy URIs. A video's master maps its variant and
+# rendition playlists to /hls/<vid>/media/<n>.m3u8; both are cached until the
+# signed manifest URLs expire. Live media playlists are re-fetched at most every
+# half target duration, and only segments past the last one seen are rendered.
+#
+# Proxied URIs are short tokens, /hlsseg/<vid>/<name>.<id>: <name> is the issuing
+# playlist (media index n, "m" for the master), <id> a segment's media sequence
+# number or "k" + a hash of the URL's cache key. The URL table maps them back to
+# upstream URLs; with a shared table (sqlite/redis) any worker can serve tokens
+# another one issued, and a miss is answered from the issuing playlist, rebuilt
+# if this worker has not seen it. A playlist nested in media playlist <name>
+# (a variant of a nested master) is named <name>-<id> after its token
+# <name>.<id>, so it too is rebuilt by resolving that token first; tokens nested
+# deeper than TOKEN allows are refused before any lookup.
+# Only URLs taken from a playlist are fetched.
+PLAYLISTS = make_cache("playlist", ttl=INFO_CACHE.ttl, size=int(os.environ.get("FOCUS_PLAYLIST_CACHE_SIZE", "256")), kind="memory")
+PLAYLIST_COUNTS = {"parsed": 0, "live_refreshes": 0, "segments_rendered": 0}
+URL_TABLE = make_cache("url", ttl=INFO_CACHE.ttl, size=int(os.environ.get("FOCUS_URL_TABLE_SIZE", "65536")),
+                       kind=os.environ.get("FOCUS_URL_TABLE", "memory"))
+M3U8 = "application/vnd.apple.mpegurl"
+URI_ATTR = re.compile(r'URI="([^"]*)"')
+SEGMENT_TAGS = {"#EXTINF", "#EXT-X-BYTERANGE", "#EXT-X-DISCONTINUITY", "#EXT-X-PROGRAM-DATE-TIME",
+                "#EXT-X-GAP", "#EXT-X-BITRATE", "#EXT-X-STREAM-INF"}
+PLAYLIST_TAGS = {"#EXT-X-STREAM-INF", "#EXT-X-MEDIA", "#EXT-X-I-FRAME-STREAM-INF"}  # their URIs are playlists
+TOKEN = re.compile(r"(m|\d+)(-(\d+|k[0-9a-f]+)){0,4}\.(\d+|k[0-9a-f]+)")  # <name>.<id>, at most 4 playlists deep
+
+class Playlist(NamedTuple):
+    master: bool
+    head: List[str]                     # tags before the first entry (incl. a leading KEY/MAP)
+    entries: List[tuple]                # (media sequence, tags, absolute URI)
+    tail: List[str]                     # tags after the last entry, minus EXT-X-ENDLIST
+    ended: bool
+    target: float                       # EXT-X-TARGETDURATION
+
+def parse_playlist(txt: str, base: str) -> Playlist:
+    head, entries, tags = [], [], []
+    master = ended = False
+    seq, target = 0, 6.0
+    absu = lambda m: f'URI="{urllib.parse.urljoin(base, m.group(1))}"'
+    for line in txt.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith("#"):
+            entries.append((seq, tags, urllib.parse.urljoin(base, line)))
+            seq, tags = seq + 1, []
+            continue
+        tag, _, val = line.partition(":")
+        if tag == "#EXT-X-ENDLIST":
+            ended = True
+            continue
+        if tag == "#EXT-X-MEDIA-SEQUENCE":
+            seq = int(val)
+        elif tag == "#EXT-X-TARGETDURATION":
+            target = float(val)
+        master = master or tag == "#EXT-X-STREAM-INF"
+        if 'URI="' in line:
+            line = URI_ATTR.sub(absu, line)
+        (tags if entries or tag in SEGMENT_TAGS else head).append(line)
+    PLAYLIST_COUNTS["parsed"] += 1
+    return Playlist(master, head, entries, tags, ended, target)
+
+def render_tag(line: str, fn) -> str:
+    """`line` with its URI attribute replaced by fn(tag, uri)."""
+    if 'URI="' not in line:
+        return line
+    tag = line.partition(":")[0]
+    return URI_ATTR.sub(lambda m: f'URI="{fn(tag, m.group(1))}"', line)
+
+def url_path(vid: str, name: str, u: str, urls: Dict[str, str], seq: Optional[int] = None) -> str:
+    """Register `u` (in the URL table and the issuing playlist's `urls`) and return its /hlsseg path."""
+    tok = f"{name}.{seq}" if seq is not None else f"{name}.k{seg_key(u)[:10]}"
+    urls[tok] = u
+    URL_TABLE.set(f"{vid}/{tok}", u, url_ttl(u))
+    return f"/hlsseg/{vid}/{tok}"
+
+def token_url(vid: str, tok: str) -> Optional[str]:
+    """Upstream URL behind /hlsseg/<vid>/<tok>, or None if no playlist issued it."""
+    if not TOKEN.fullmatch(tok):
+        return None
+    k = f"{vid}/{tok}"
+    if (u := URL_TABLE.get(k)) is not None:
+        return u
+    name = tok.partition(".")[0]
+    if name == "m":
+        owner = master_playlist(vid)
+        urls = owner["urls"] if owner else {}
+    else:
+        owner = PLAYLISTS.get(f"{vid}:{name}")
+        parent, _, pid = name.rpartition("-")
+        if owner is None and name.isdigit():
+            video_media(vid, int(name))
+        elif owner is None and parent and (src := token_url(vid, f"{parent}.{pid}")) and is_playlist(src):
+            media_text(vid, name, src)
+        owner = owner or PLAYLISTS.get(f"{vid}:{name}")
+        urls = owner.urls if owner else {}
+    if (u := urls.get(tok)) is not None:
+        URL_TABLE.set(k, u, url_ttl(u))
+    return u
+
+def render_master(pl: Playlist, fn) -> str:
+    out = [render_tag(l, fn) for l in pl.head]
+    for _, tags, u in pl.entries:
+        out += [render_tag(l, fn) for l in tags]
+        out.append(fn("#EXT-X-STREAM-INF", u))
+    out += [render_tag(l, fn) for l in pl.tail]
+    return "\n".join(out) + "\n"
+
+class MediaPlaylist:
+    """A media playlist rewritten for the proxy, segment tokens numbered by media
+    sequence for the prefetcher. Each update renders only segments newer than the last one."""
+
+    def __init__(self, vid: str, name: str, src: str):
+        self.vid, self.name, self.src = vid, name, src
+        self.p = f"{vid}.{name}"
+        self.urls: Dict[str, str] = {}
+        self.head: List[str] = []
+        self.tail: List[str] = []
+        self.segs: "OrderedDict[int, str]" = OrderedDict()
+        self.ended, self.target, self.fetched = False, 6.0, 0.0
+        self._text: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def stale(self) -> bool:
+        return not self.ended and time.monotonic() - self.fetched >= self.target / 2
+
+    def refresh(self) -> bool:
+        """Fetch upstream and merge; False if upstream refused."""
+        r = upstream().get(self.src, timeout=15)
+        if r.status_code >= 400:
+            logging.info("Playlist %s returns %s", self.src, r.status_code)
+            return False
+        self.update(parse_playlist(r.text, self.src))
+        return True
+
+    def update(self, pl: Playlist):
+        plain = lambda tag, u: url_path(self.vid, self.name, u, self.urls)
+        with self._lock:
+            first = pl.entries[0][0] if pl.entries else 0
+            if self.segs and first < next(iter(self.segs)):
+                self.segs.clear()  # sequence went backwards: the stream restarted
+                self.urls.clear()
+            while self.segs and next(iter(self.segs)) < first:
+                self.urls.pop(f"{self.name}.{self.segs.popitem(last=False)[0]}", None)
+            last = next(reversed(self.segs)) if self.segs else -1
+            new = [e for e in pl.entries if e[0] > last]
+            for seq, tags, u in new:
+                # variants of a nested master are playlists, not segments to prefetch
+                uri = url_path(self.vid, self.name, u, self.urls, None if pl.master else seq)
+                self.segs[seq] = "\n".join([render_tag(l, plain) for l in tags] + [uri])
+            self.head = [render_tag(l, plain) for l in pl.head]
+            self.tail = [render_tag(l, plain) for l in pl.tail]
+            PLAYLIST_COUNTS["live_refreshes"] += bool(self.fetched)
+            PLAYLIST_COUNTS["segments_rendered"] += len(new)
+            self.ended, self.target, self.fetched = pl.ended, pl.target, time.monotonic()
+            self._text = None
+        if new and not pl.master:
+            PREFETCH.register(self.p, new[0][0], [u for _, _, u in new])
+
+    def text(self) -> str:
+        with self._lock:
+            if self._text is None:
+                end = ["#EXT-X-ENDLIST"] if self.ended else []
+                self._text = "\n".join(self.head + list(self.segs.values()) + self.tail + end) + "\n"
+            return self._text
+
+def media_text(vid: str, name: str, src: str) -> Optional[str]:
+    """Rewritten text of media playlist `src`, cached as <vid>:<name> until its URL
+    expires (live ones refreshed when stale); None if upstream refused it."""
+    key = f"{vid}:{name}"
+    pl = PLAYLISTS.get(key)
+    if pl is None or pl.src != src:
+        def build():
+            pl = MediaPlaylist(vid, name, src)
+            if not pl.refresh():
+                return None
+            PLAYLISTS.set(key, pl, url_ttl(src))
+            return pl
+        pl = FLIGHT.do(f"playlist:{key}", build)
+    elif pl.stale():
+        try:
+            FLIGHT.do(f"playlist:{key}", pl.refresh)
+        except Exception as e:
+            logging.info("Live playlist refresh failed, serving the previous window: %s", e)
+    return pl.text() if pl else None
+
+def master_playlist(vid: str) -> Optional[Dict]:
+    """{"src", "text", "media", "urls"} of a video's rewritten master playlist, cached until
+    the manifest URL expires; None if the video has no usable HLS stream."""
+    k = f"{vid}:master"
+    if (hit := PLAYLISTS.get(k)) is not None:
+        return hit
+    def build():
+        src = hls_master_url(vid)
+        if not src:
+            logging.info("No HLS manifest, redirecting to MP4")
+            return None
+        r = upstream().get(src, timeout=15)
+        if r.status_code >= 400:
+            logging.info("HLS manifest %s returns %s, redirecting to MP4", src, r.status_code)
+            return None
+        pl = parse_playlist(r.text, src)
+        media: Dict[str, int] = {}
+        urls: Dict[str, str] = {}
+        if pl.master:
+            def fn(tag, u):
+                if tag not in PLAYLIST_TAGS:
+                    return url_path(vid, "m", u, urls)
+                return f"/hls/{vid}/media/{media.setdefault(u, len(media))}.m3u8"
+            txt = render_master(pl, fn)
+        else:  # yt-dlp's m3u8 formats are usually a single variant: wrap it
+            media[src] = 0
+            txt = f"#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1\n/hls/{vid}/media/0.m3u8\n"
+        entry = {"src": src, "text": txt, "media": list(media), "urls": urls}
+        PLAYLISTS.set(k, entry, url_ttl(src))
+        return entry
+    return FLIGHT.do(f"master:{vid}", build)
+
+def video_media(vid: str, n: int) -> Optional[str]:
+    """Media playlist `n` of a video's master; None if unavailable."""
+    try:
+        entry = master_playlist(vid)
+        if entry is None or n >= len(entry["media"]):
+            return None
+        txt = media_text(vid, str(n), entry["media"][n])
+    except Exception as e:
+        logging.warning("Media playlist %s/%s failed: %s", vid, n, e)
+        txt = None
+    if txt is None:
+        PLAYLISTS.delete(f"{vid}:master")  # likely expired early: rebuild on the next request
+    return txt
+
+# ───────────── Download store ─────────────
+# Finished downloads, keyed by (vid, fmt, quality). Each is written in a private
+# temp dir and renamed into place, indexed by manifest.json (size, title, last
+# use), and evicted least recently used beyond FOCUS_DOWNLOAD_QUOTA_MB. lock(key)
+# (thread lock + flock) admits one producer per artifact across worker processes.
+DL_DIR = os.environ.get("FOCUS_DOWNLOAD_DIR", os.path.expanduser("~/.cache/youtube-focus/downloads"))
+DL_QUOTA = int(float(os.environ.get("FOCUS_DOWNLOAD_QUOTA_MB", "4096")) * (1 << 20))
+DL_QUALITY = {"mp4": "best", "mp3": "192", "m4a": "copy", "opus": "copy"}
+DL_MIME = {"mp4": "video/mp4", "mp3": "audio/mpeg", "m4a": "audio/mp4", "opus": "audio/ogg"}
+
+class Store:
+    TOUCH = 60.0  # get() rewrites the manifest only if the last use is older than this
+
+    def __init__(self, root: str, quota: int):
+        self.root, self.quota = root, quota
+        self.manifest = os.path.join(root, "manifest.json")
+        self._lock, self._keys = threading.Lock(), {}
+        self._loaded = (None, {})
+        self.hits = self.misses = self.evictions = 0
+        for sub in (".tmp", ".locks"):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+        for d in glob.glob(os.path.join(root, ".tmp", "*")):
+            if os.path.getmtime(d) < time.time() - 86400:
+                shutil.rmtree(d, ignore_errors=True)
+
+    @staticmethod
+    def key(vid: str, fmt: str) -> str:
+        return f"{re.sub(r'[^A-Za-z0-9_-]', '_', vid)}-{DL_QUALITY[fmt]}.{fmt}"
+
+    def _lockfile(self, name: str) -> str:
+        return os.path.join(self.root, ".locks", f"{name}.lock")
+
+    @contextmanager
+    def _flock(self, name: str):
+        path = self._lockfile(name)
+        while True:
+            with open(path, "a") as fh:
+                if not fcntl:
+                    yield
+                    return
+                fcntl.flock(fh, fcntl.LOCK_EX)
+                try:
+                    ok = os.stat(path).st_ino == os.fstat(fh.fileno()).st_ino
+                except FileNotFoundError:
+                    ok = False
+                if ok:  # else it was unlinked by _unlock while we waited
+                    yield
+                    return
+
+    def _unlock(self, name: str):
+        """Remove an evicted key's lock file unless it is held."""
+        if (kl := self._keys.get(name)) and kl.locked():
+            return
+        self._keys.pop(name, None)
+        try:
+            with open(self._lockfile(name), "a") as fh:
+                if fcntl:
+                    fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.remove(self._lockfile(name))
+        except OSError:
+            pass
+
+    @contextmanager
+    def lock(self, key: str):
+        with self._lock:
+            kl = self._keys.setdefault(key, threading.Lock())
+        with kl, self._flock(key):
+            yield
+
+    def _read(self) -> Dict:
+        """manifest.json as last saved (read-only; it is only ever replaced whole)."""
+        try:
+            st = os.stat(self.manifest)
+            ver = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if ver == self._loaded[0]:
+                return self._loaded[1]
+            with open(self.manifest) as fh:
+                idx = json.load(fh)
+        except (OSError, ValueError):
+            return {}
+        self._loaded = (ver, idx)
+        return idx
+
+    @contextmanager
+    def _index(self):
+        """A copy of manifest.json under the store-wide lock, saved on exit."""
+        with self._lock, self._flock("manifest"):
+            idx = {k: dict(e) for k, e in self._read().items()}
+            yield idx
+            tmp = f"{self.manifest}.{os.getpid()}.tmp"
+            with open(tmp, "w") as fh:
+                json.dump(idx, fh)
+            os.replace(tmp, self.manifest)
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Entry + path, marked used; None if not stored."""
+        path = os.path.join(self.root, key)
+        e, now = self._read().get(key), time.time()
+        there = e is not None and os.path.exists(path)
+        if e and (not there or now - e["used"] > self.TOUCH):
+            with self._index() as idx:
+                if not there:
+                    idx.pop(key, None)
+                elif key in idx:
+                    idx[key]["used"] = now
+                    e = idx[key]
+        if not there:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(e, path=path)
+
+    def tempdir(self) -> str:
+        return tempfile.mkdtemp(dir=os.path.join(self.root, ".tmp"))
+
+    def put(self, key: str, src: str, title: str) -> Dict:
+        path = os.path.join(self.root, key)
+        os.replace(src, path)
+        now = time.time()
+        with self._index() as idx:
+            idx[key] = {"size": os.path.getsize(path), "title": title, "created": now, "used": now}
+            total = sum(e["size"] for e in idx.values())
+            for old in sorted(idx, key=lambda k: idx[k]["used"]):
+                if total <= self.quota:
+                    break
+                if old != key:
+                    total -= idx.pop(old)["size"]
+                    self.evictions += 1
+                    try:
+                        os.remove(os.path.join(self.root, old))
+                    except OSError:
+                        pass
+                    self._unlock(old)
+            return dict(idx[key], path=path)
+
+    def stats(self) -> Dict:
+        idx = self._read()
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(idx),
+                "bytes": sum(e["size"] for e in idx.values()), "quota_bytes": self.quota}
+
+STORE = Store(DL_DIR, DL_QUOTA)
+
+# ───────────── Range downloads ─────────────
+# googlevideo throttles each connection, so a progressive/DASH file is fetched as
+# DL_RANGE-sized byte ranges over up to FOCUS_DOWNLOAD_CONNECTIONS connections.
+# The first range tells the size; the file is preallocated and every range is
+# written in place with os.pwrite. A failed range resumes from its last byte
+# (DL_RANGE_RETRIES times); the result must add up to the advertised size.
+# Fragmented formats (HLS/DASH manifests) stay with yt-dlp and its
+# concurrent_fragment_downloads (FOCUS_DOWNLOAD_FRAGMENTS).
+DL_CONNS = int(os.environ.get("FOCUS_DOWNLOAD_CONNECTIONS", "4"))
+DL_RANGE = int(float(os.environ.get("FOCUS_DOWNLOAD_RANGE_MB", "4")) * (1 << 20))
+DL_RANGE_RETRIES = int(os.environ.get("FOCUS_DOWNLOAD_RANGE_RETRIES", "3"))
+DL_FRAGMENTS = int(os.environ.get("FOCUS_DOWNLOAD_FRAGMENTS", "4"))
+
+def fetch_ranges(open_range, path: str, conns: int = DL_CONNS, size: int = DL_RANGE, progress=None) -> int:
+    """`open_range(a, b)` -> (total or None if the range was ignored, chunks) for bytes a..b.
+    `progress(received, total)` is called as bytes arrive. Returns the file size."""
+    lock, failed = threading.Lock(), threading.Event()
+    fd, first = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644), None
+    try:
+        total, first = open_range(0, size - 1)
+        if total is None:  # no range support: one connection, whole body
+            off = 0
+            for data in first:
+                off += os.pwrite(fd, data, off)
+                if progress:
+                    progress(off, None)
+            return off
+        if total == 0:
+            return 0
+        try:
+            os.posix_fallocate(fd, 0, total)
+        except (AttributeError, OSError):
+            os.ftruncate(fd, total)
+        ranges = [(a, min(a + size, total) - 1) for a in range(0, total, size)]
+        done, got = [0] * len(ranges), [0]
+
+        def fetch(i: int, chunks=None):
+            a, b = ranges[i]
+            for attempt in range(DL_RANGE_RETRIES + 1):
+                pos = a + done[i]
+                try:
+                    chunks = chunks or open_range(pos, b)[1]
+                    for data in chunks:
+                        if failed.is_set():
+                            return
+                        n = os.pwrite(fd, data[:b + 1 - pos], pos)
+                        pos, done[i] = pos + n, done[i] + n
+                        with lock:
+                            got[0] += n
+                            if progress:
+                                progress(got[0], total)
+                        if pos > b:
+                            break
+                    if pos <= b:
+                        raise IOError(f"range {a}-{b} ended at {pos}")
+                    return
+                except Exception as e:
+                    if attempt == DL_RANGE_RETRIES or failed.is_set():
+                        failed.set()
+                        raise
+                    logging.info("Retrying range %d-%d from %d: %s", a, b, pos, e)
+                    time.sleep(0.5 * 2 ** attempt)
+                finally:
+                    close_chunks(chunks)
+                    chunks = None
+
+        with ThreadPoolExecutor(max(conns, 1), thread_name_prefix="range") as pool:
+            futs = [pool.submit(fetch, 0, first)] + [pool.submit(fetch, i) for i in range(1, len(ranges))]
+            for f in futs:
+                f.result()
+        if sum(done) != total or os.fstat(fd).st_size != total:
+            raise RuntimeError(f"Download incomplete: {sum(done)} of {total} bytes")
+        return total
+    finally:
+        failed.set()
+        close_chunks(first)  # if no range thread got it: early returns, errors
+        os.close(fd)
+
+class _Chunks:
+    """Body of a streamed response; close() releases the connection even before the first read."""
+    def __init__(self, r: requests.Response):
+        self.r, self._it = r, r.iter_content(RELAY_CHUNK)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        try:
+            return next(self._it)
+        except StopIteration:
+            self.r.close()
+            raise
+
+    def close(self):
+        self.r.close()
+
+def close_chunks(chunks):
+    """close() an open_range body that has one, returning its connection to the pool."""
+    if (close := getattr(chunks, "close", None)):
+        close()
+
+def up_range(u: str, hdr: Optional[Dict] = None):
+    """open_range for fetch_ranges over the shared upstream pools."""
+    def open_range(a: int, b: int):
+        r = upstream().get(u, headers={**(hdr or {}), "Range": f"bytes={a}-{b}"}, stream=True, timeout=15)
+        if r.status_code >= 400:
+            r.close()
+            r.raise_for_status()
+        n = r.headers.get("Content-Range", "").rpartition("/")[2]
+        return (int(n) if r.status_code == 206 and n.isdigit() else None), _Chunks(r)
+    return open_range
+
+def bench_download(mb: int = 64, conns: int = DL_CONNS, throttle: float = 8) -> Dict[str, Dict]:
+    """`mb` MiB from a local server capped at `throttle` MiB/s per connection (like
+    googlevideo): one connection (the yt-dlp path) vs `conns` range requests."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    total, body = mb << 20, os.urandom(1 << 20) * mb
+
+    class Source(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def do_GET(self):
+            m = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+            a, b = (int(m[1]), min(int(m[2]), total - 1)) if m else (0, total - 1)
+            self.send_response(206 if m else 200)
+            self.send_header("Content-Length", str(b - a + 1))
+            if m:
+                self.send_header("Content-Range", f"bytes {a}-{b}/{total}")
+            self.end_headers()
+            for off in range(a, b + 1, 1 << 16):
+                self.wfile.write(body[off:min(off + (1 << 16), b + 1)])
+                time.sleep((1 << 16) / (throttle * (1 << 20)))
+        def log_message(self, *a):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Source)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    url, out = f"http://127.0.0.1:{srv.server_port}/video.mp4", {}
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "video.mp4")
+            for name, n, size in (("single", 1, total), (f"ranges x{conns}", conns, DL_RANGE)):
+                t0 = time.perf_counter()
+                fetch_ranges(up_range(url), path, n, size)
+                wall = time.perf_counter() - t0
+                with open(path, "rb") as fh:
+                    if fh.read() != body:
+                        raise RuntimeError(f"{name}: file differs from the source")
+                out[name] = {"seconds": wall, "mb_s": mb / wall}
+    finally:
+        srv.shutdown()
+    return out
+
+# ───────────── Download jobs ─────────────
+# Downloads run on a bounded worker pool instead of inside the request. A request
+# for a (vid, fmt) that is queued, running or finished joins that job; a failed
+# one is retried, and one already in STORE is done without queueing. yt-dlp's
+# progress hooks feed /api/jobs/<id>; finished jobs are forgotten
+# FOCUS_DOWNLOAD_JOB_TTL seconds after they end.
+DL_WORKERS = int(os.environ.get("FOCUS_DOWNLOAD_WORKERS", "2"))
+DL_QUEUE = int(os.environ.get("FOCUS_DOWNLOAD_QUEUE_LIMIT", "32"))
+DL_JOB_TTL = float(os.environ.get("FOCUS_DOWNLOAD_JOB_TTL", "3600"))
+
+class Job:
+    def __init__(self, vid: str, fmt: str):
+        self.id, self.vid, self.fmt = uuid.uuid4().hex[:16], vid, fmt
+        self.key, self.path, self.ended = Store.key(vid, fmt), None, None
+        self.cond, self.tmp, self.size = threading.Condition(), None, 0  # piped output written so far
+        self.state = {"status": "queued", "percent": None, "speed": None, "eta": None,
+                      "downloaded_bytes": 0, "total_bytes": None, "error": None}
+
+    def progress(self, d: Dict):
+        st = self.state
+        if d["status"] == "downloading":
+            st["status"], st["speed"], st["eta"] = "downloading", d.get("speed"), d.get("eta")
+            st["downloaded_bytes"] = d.get("downloaded_bytes") or 0
+            st["total_bytes"] = d.get("total_bytes") or d.get("total_bytes_estimate")
+            if st["total_bytes"]:
+                st["percent"] = round(100.0 * st["downloaded_bytes"] / st["total_bytes"], 1)
+        elif d["status"] == "finished":
+            st["percent"], st["speed"], st["eta"] = 100.0, None, None
+
+    def postprocess(self, d: Dict):
+        if d["status"] == "started":
+            self.state["status"] = "processing"
+
+    def wrote(self, path: str, size: int):
+        with self.cond:
+            self.tmp, self.size = path, size
+            self.cond.notify_all()
+
+    def end(self):
+        with self.cond:
+            self.ended = time.time()
+            self.cond.notify_all()
+
+    def tail(self, fh):
+        """Bytes of the piped output as they are written, up to the end of the job.
+        `fh` stays valid when the file is renamed into STORE."""
+        sent = 0
+        with fh:
+            while True:
+                with self.cond:
+                    while sent >= self.size and not self.ended:
+                        self.cond.wait()
+                    size, ended = self.size, self.ended
+                if self.state["status"] == "error":
+                    raise RuntimeError(self.state["error"])
+                while sent < size and (data := fh.read(min(RELAY_CHUNK, size - sent))):
+                    sent += len(data)
+                    yield data
+                if ended and sent >= self.size:
+                    return
+
+    def view(self) -> Dict:
+        return {"id": self.id, "vid": self.vid, "fmt": self.fmt, **self.state,
+                "file": f"/api/jobs/{self.id}/file" if self.state["status"] == "done" else None}
+
+class QueueFull(RuntimeError):
+    pass
+
+class Jobs:
+    def __init__(self, workers: int, limit: int, ttl: float):
+        self._pool = ThreadPoolExecutor(max(workers, 1), thread_name_prefix="download")
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+        self._by_target: Dict[tuple, Job] = {}
+        self.limit, self.ttl, self.joined = limit, ttl, 0
+
+    def submit(self, vid: str, fmt: str) -> Job:
+        with self._lock:
+            now = time.time()
+            for j in [j for j in self._jobs.values() if j.ended and now - j.ended > self.ttl]:
+                del self._jobs[j.id]
+                if self._by_target.get((j.vid, j.fmt)) is j:
+                    del self._by_target[(j.vid, j.fmt)]
+            if (job := self._joinable(vid, fmt)):
+                return job
+        hit = STORE.get(Store.key(vid, fmt))  # may wait on other workers' flock: outside self._lock
+        with self._lock:
+            if (job := self._joinable(vid, fmt)):
+                return job
+            if not hit and sum(j.state["status"] == "queued" for j in self._jobs.values()) >= self.limit:
+                raise QueueFull("Too many downloads queued, try again later")
+            job = Job(vid, fmt)
+            self._jobs[job.id] = self._by_target[(vid, fmt)] = job
+            if hit:
+                job.path, job.ended = hit["path"], time.time()
+                job.state.update(status="done", percent=100.0)
+                return job
+        self._pool.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def _joinable(self, vid: str, fmt: str) -> Optional[Job]:
+        job = self._by_target.get((vid, fmt))
+        if job and job.state["status"] != "error" and (job.state["status"] != "done" or os.path.exists(job.path)):
+            self.joined += 1
+            return job
+        return None
+
+    def _run(self, job: Job):
+        try:
+            job.state["status"] = "downloading"
+            with STORE.lock(job.key):
+                if (hit := STORE.get(job.key)):  # another worker process stored it meanwhile
+                    job.path = hit["path"]
+                else:
+                    job.path = self._download(job)
+            job.state["status"] = "done"
+        except Exception as e:
+            logging.warning("Download %s (%s) failed: %s", job.vid, job.fmt, e)
+            job.state["status"], job.state["error"] = "error", str(e)
+        finally:
+            job.end()
+
+    def _download(self, job: Job) -> str:
+        tmp = STORE.tempdir()
+        try:
+            fname, mp4 = os.path.join(tmp, f"{job.vid}.{job.fmt}"), job.fmt == "mp4"
+            if not mp4 and AUDIO_PIPE:
+                title = pipe_audio(job, fname)
+            elif mp4 and DL_CONNS > 1 and (title := self._ranged(job, tmp, fname)) is not None:
+                pass
+            else:
+                pp = {"key": "FFmpegExtractAudio", "preferredcodec": job.fmt}
+                if DL_QUALITY[job.fmt] != "copy":
+                    pp["preferredquality"] = DL_QUALITY[job.fmt]
+                opts = {"quiet": True, "noprogress": True, "outtmpl": fname,
+                        "format": "bestvideo+bestaudio/best" if mp4 else "bestaudio",
+                        "merge_output_format": "mp4" if mp4 else None,
+                        "postprocessors": [] if mp4 else [pp], "concurrent_fragment_downloads": DL_FRAGMENTS,
+                        "progress_hooks": [job.progress], "postprocessor_hooks": [job.postprocess]}
+                with YoutubeDL(opts) as ydl:
+                    # reuse the cached extraction; format selection and download run on a private copy
+                    title = ydl.process_ie_result(copy.deepcopy(yt_info(job.vid)), download=True).get("title")
+            if not os.path.exists(fname):
+                raise RuntimeError("Download failed - file not found")
+            return STORE.put(job.key, fname, title or job.vid)["path"]
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def _ranged(self, job: Job, tmp: str, fname: str) -> Optional[str]:
+        """Video and audio via fetch_ranges, then muxed; None (yt-dlp path) if a
+        selected format is fragmented. Returns the title."""
+        with YoutubeDL({"quiet": True, "format": "bestvideo+bestaudio/best"}) as ydl:
+            info = ydl.process_ie_result(copy.deepcopy(yt_info(job.vid)), download=False)
+        fmts = info.get("requested_formats") or [info]
+        if any(f.get("protocol") not in ("http", "https") or not f.get("url") for f in fmts):
+            return None
+        got, tot = [0] * len(fmts), [f.get("filesize") for f in fmts]
+        def progress(i, n, total):
+            got[i], tot[i] = n, total
+            job.progress({"status": "downloading", "downloaded_bytes": sum(got),
+                          "total_bytes": sum(tot) if None not in tot else None})
+        parts = [os.path.join(tmp, f"part{i}.{f.get('ext', 'mp4')}") for i, f in enumerate(fmts)]
+        for i, (f, part) in enumerate(zip(fmts, parts)):
+            fetch_ranges(up_range(f["url"], f.get("http_headers")), part, progress=lambda n, t, i=i: progress(i, n, t))
+        if len(parts) == 1:
+            os.replace(parts[0], fname)
+        else:
+            job.postprocess({"status": "started"})
+            maps = [a for i in range(len(parts)) for a in ("-map", str(i))]
+            r = subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+                                *[a for p in parts for a in ("-i", p)], *maps, "-c", "copy", fname],
+                               capture_output=True)
+            if r.returncode:
+                raise RuntimeError(f"ffmpeg merge failed: {r.stderr.decode(errors='replace').strip()}")
+        return info.get("title") or job.vid
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+    def stats(self) -> Dict:
+        counts = dict.fromkeys(("queued", "downloading", "processing", "done", "error"), 0)
+        for j in list(self._jobs.values()):
+            counts[j.state["status"]] += 1
+        return {**counts, "joined": self.joined}
+
+DOWNLOADS = Jobs(DL_WORKERS, DL_QUEUE, DL_JOB_TTL)
+atexit.register(DOWNLOADS.close)
+
+# ───────────── Audio pipeline ─────────────
+# FOCUS_AUDIO_PIPELINE=pipe (default): the audio format's bytes go from upstream,
+# in AUDIO_RANGE-sized ranged GETs, into ffmpeg's stdin; its stdout is written to
+# the job's file as produced, so /api/jobs/<id>/file can follow it. One pass, no
+# intermediate download. mp3 re-encodes and waits for one of FOCUS_TRANSCODE_SLOTS
+# (default: CPU count); m4a/opus remux YouTube's own AAC/Opus stream with -c copy
+# and skip the semaphore. "postprocess" keeps yt-dlp's download-then-convert path.
+AUDIO_PIPE = os.environ.get("FOCUS_AUDIO_PIPELINE", "pipe") == "pipe"
+TRANSCODE = threading.BoundedSemaphore(max(int(os.environ.get("FOCUS_TRANSCODE_SLOTS", str(os.cpu_count() or 2))), 1))
+AUDIO_RANGE = 10 << 20
+AUDIO_FMT = {  # source filter, ffmpeg output args
+    "mp3": (lambda f: True, ["-c:a", "libmp3lame", "-b:a", f"{DL_QUALITY['mp3']}k", "-f", "mp3"]),
+    "m4a": (lambda f: f.get("ext") == "m4a", ["-c:a", "copy", "-movflags", "frag_keyframe+empty_moov", "-f", "ipod"]),
+    "opus": (lambda f: f.get("acodec") == "opus", ["-c:a", "copy", "-f", "opus"]),
+}
+
+def _feed(f: Dict, sink, job: Job, errors: List):
+    """Copy format `f` into `sink` (ffmpeg stdin) range by range, reporting progress on `job`."""
+    off, total, t0 = 0, f.get("filesize"), time.monotonic()
+    try:
+        while total is None or off < total:
+            hdr = {**(f.get("http_headers") or {}), "Range": f"bytes={off}-{off + AUDIO_RANGE - 1}"}
+            r = upstream().get(f["url"], headers=hdr, stream=True, timeout=15)
+            with r:
+                r.raise_for_status()
+                if (n := r.headers.get("Content-Range", "").rpartition("/")[2]).isdigit():
+                    total = int(n)
+                got = 0
+                for data in r.iter_content(RELAY_CHUNK):
+                    sink.write(data)
+                    got += len(data)
+                    off += len(data)
+                    dt = max(time.monotonic() - t0, 1e-6)
+                    job.progress({"status": "downloading", "downloaded_bytes": off, "total_bytes": total,
+                                  "speed": off / dt, "eta": int((total - off) * dt / off) if total else None})
+            if r.status_code != 206 or got < AUDIO_RANGE:
+                break
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        try:
+            sink.close()
+        except OSError:
+            pass
+
+def pipe_audio(job: Job, fname: str) -> str:
+    """Stream the best matching audio format through ffmpeg into `fname`; returns the title."""
+    info = yt_info(job.vid)
+    want, args = AUDIO_FMT[job.fmt]
+    src = [f for f in info["formats"] if f.get("vcodec") == "none" and f.get("acodec") != "none" and f.get("url") and want(f)]
+    if not src:
+        raise RuntimeError(f"No {job.fmt} audio stream")
+    f = max(src, key=lambda f: f.get("abr") or 0)
+    with (TRANSCODE if DL_QUALITY[job.fmt] != "copy" else nullcontext()), tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", "pipe:0", "-vn", *args, "pipe:1"],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=err)
+        errors: List = []
+        feeder = threading.Thread(target=_feed, args=(f, proc.stdin, job, errors), daemon=True)
+        feeder.start()
+        n = 0
+        try:
+            with open(fname, "wb") as out:
+                for data in iter(lambda: proc.stdout.read(64 * 1024), b""):
+                    out.write(data)
+                    out.flush()
+                    n += len(data)
+                    job.wrote(fname, n)
+        except BaseException:
+            proc.kill()
+            raise
+        finally:
+            proc.wait()
+            feeder.join()
+        if errors and not isinstance(errors[0], BrokenPipeError):
+            raise errors[0]
+        if proc.returncode:
+            err.seek(0)
+            raise RuntimeError(f"ffmpeg failed: {err.read().decode(errors='replace').strip()}")
+    return info.get("title")
 
 # ───────────── Flask & HTML ─────────────
 app = Flask(__name__)
@@ -146,14 +2225,25 @@ def page(body: str):
     return HEAD + body + FOOT
 
 # ───────────── Routes ─────────────
+@app.errorhandler(SearchFailed)
+def search_failed(e):
+    return Response(f"Arama başarısız: {e}", status=502, mimetype="text/plain")
+
+@app.errorhandler(PoolBusy)
+@app.errorhandler(QueueFull)
+@app.errorhandler(EmptyPoolError)
+def busy(e):
+    return Response(str(e), status=503, mimetype="text/plain")
+
 @app.route("/", methods=["GET", "POST"])
 def home():
     vids = chans = []
     if request.method == "POST":
         q = request.form["query"].strip()
         flt = request.form.get("filter", "all")
-        vids = yt_search(q, flt)
-        chans = yt_channels(q) if q else []
+        if q:
+            found = yt_search_all(q, flt)
+            vids, chans = found["videos"], found["channels"]
     else:
         q = ""
         flt = "all"
@@ -176,6 +2266,23 @@ def home():
 </main>"""
     return page(body)
 
+@app.route("/api/search")
+def api_search():
+    q = request.args.get("q", "").strip()
+    if not q:
+        return jsonify({"videos": [], "channels": []})
+    return jsonify(yt_search_all(q, request.args.get("filter", "all")))
+
+@app.route("/api/stats")
+def api_stats():
+    return jsonify({"search_cache": SEARCH_CACHE.stats(), "search_waits": WAITS, "coalesced": FLIGHT.stats(),
+                    "info_cache": INFO_CACHE.stats(), "stream_urls": STREAM_URLS.stats(),
+                    "upstream": upstream_stats(),
+                    "playlists": {**PLAYLISTS.stats(), **PLAYLIST_COUNTS}, "url_table": URL_TABLE.stats(),
+                    "segments": SEGMENTS.stats(),
+                    "prefetch": PREFETCH.stats(),
+                    "downloads": DOWNLOADS.stats(), "artifacts": STORE.stats()})
+
 @app.route("/channel")
 def channel():
     url = urllib.parse.unquote(request.args.get("url", ""))
@@ -245,40 +2352,50 @@ document.addEventListener('DOMContentLoaded', function() {{
 # ───────────── Manifest proxy (never 404) ─────────────
 @app.route("/hls/<vid>/master.m3u8")
 def hls_master(vid):
-    src = hls_master_url(vid)
-    if not src:
-        logging.info("No HLS manifest, redirecting to MP4")
-        return redirect(f"/proxy/{vid}", 302)
     try:
-        r = requests.get(src, timeout=15)
-        if r.status_code >= 400:
-            logging.info("HLS manifest %s returns %s, redirecting to MP4", src, r.status_code)
-            return redirect(f"/proxy/{vid}", 302)
-        txt = r.text
+        entry = master_playlist(vid)
     except Exception as e:
         logging.warning("Manifest fetch error %s, redirect MP4", e)
+        entry = None
+    if entry is None:
         return redirect(f"/proxy/{vid}", 302)
+    resp = Response(entry["text"], mimetype=M3U8)
+    if PREFETCH.ahead and not request.cookies.get(VIEWER_COOKIE):
+        resp.set_cookie(VIEWER_COOKIE, uuid.uuid4().hex, httponly=True, samesite="Lax")
+    return resp
 
-    def sub(m):
-        absu = urllib.parse.urljoin(src, m.group(0))
-        return f"/hlsseg?u={urllib.parse.quote(absu, safe='')}"
-    txt = re.sub(r"(https?://[^\s,#]+|[^,\n#]+\.m3u8)", sub, txt)
-    return Response(txt, mimetype="application/vnd.apple.mpegurl")
+@app.route("/hls/<vid>/media/<int:n>.m3u8")
+def hls_media(vid, n):
+    txt = video_media(vid, n)
+    if txt is None:
+        abort(502)
+    return Response(txt, mimetype=M3U8, headers={"Cache-Control": "no-store"})
 
 # ───────────── Segment proxy ─────────────
-@app.route("/hlsseg")
-def hlsseg():
-    u = urllib.parse.unquote(request.args.get("u", ""))
-    if not u.startswith("http"):
-        abort(400)
+def prefetch_from(vid: str, tok: str, viewer: str):
+    """Tell the prefetcher where this viewer is, from a segment token (<name>.<seq>)."""
+    name, _, i = tok.partition(".")
+    if i.isdigit():
+        PREFETCH.on_request(f"{viewer}|{vid}.{name}", f"{vid}.{name}", int(i))
+
+@app.route("/hlsseg/<vid>/<tok>")
+def hlsseg(vid, tok):
+    if (u := token_url(vid, tok)) is None:
+        abort(404)
+    rng = request.headers.get("Range")
+    if is_playlist(u) and (txt := media_text(vid, tok.replace(".", "-"), u)) is not None:
+        return Response(txt, mimetype=M3U8, headers={"Cache-Control": "no-store"})
+    prefetch_from(vid, tok, viewer_key(request.cookies.get(VIEWER_COOKIE), request.remote_addr,
+                                       request.headers.get("User-Agent")))
+    if (hit := cached_segment(u)):
+        status, hdr, body = seg_response(*hit, rng)
+        return Response(stream_with_context(body), status=status, headers=hdr)
     hdr = {"Accept-Encoding": "identity"}
-    if (rng := request.headers.get("Range")):
+    if rng:
         hdr["Range"] = rng
-    r = requests.get(u, headers=hdr, stream=True, timeout=15)
-    def gen():
-        yield from r.iter_content(8192)
-    resp = Response(stream_with_context(gen()), status=r.status_code)
-    for h in ("Content-Type", "Content-Length", "Content-Range", "Accept-Ranges"):
+    r = upstream().get(u, headers=hdr, stream=True, timeout=15)
+    resp = Response(stream_with_context(relay(r)), status=r.status_code)
+    for h in RELAY_HEADERS:
         if h in r.headers:
             resp.headers[h] = r.headers[h]
     resp.headers["Cache-Control"] = "no-store"
@@ -287,15 +2404,17 @@ def hlsseg():
 # ───────────── Progressive MP4 proxy ─────────────
 @app.route("/proxy/<vid>")
 def proxy_mp4(vid):
-    src = progressive_url(vid)
+    fmt = request.args.get("f", "best")
     hdr = {"Accept-Encoding": "identity"}
     if (rng := request.headers.get("Range")):
         hdr["Range"] = rng
-    r = requests.get(src, headers=hdr, stream=True, timeout=15)
-    def gen():
-        yield from r.iter_content(8192)
-    resp = Response(stream_with_context(gen()), status=r.status_code)
-    for h in ("Content-Type", "Content-Length", "Content-Range", "Accept-Ranges"):
+    src = progressive_url(vid, fmt)
+    r = upstream().get(src, headers=hdr, stream=True, timeout=15)
+    if r.status_code in (403, 410):  # signature expired or revoked early: re-resolve once
+        r.close()
+        r = upstream().get(progressive_url(vid, fmt, stale=src), headers=hdr, stream=True, timeout=15)
+    resp = Response(stream_with_context(relay(r)), status=r.status_code)
+    for h in RELAY_HEADERS:
         if h in r.headers:
             resp.headers[h] = r.headers[h]
     resp.headers["Cache-Control"] = "no-store"
@@ -303,21 +2422,287 @@ def proxy_mp4(vid):
     return resp
 
 # ───────────── Download ─────────────
+def job_or_404(job_id: str) -> Job:
+    if (job := DOWNLOADS.get(job_id)) is None:
+        abort(404, "Unknown job")
+    return job
+
 @app.route("/download/<vid>")
 def download(vid):
+    """Start or join the download; a progress page reloads itself until the file is
+    ready, or until piped audio output starts (then it is streamed)."""
+    fmt = request.args.get("fmt", "mp4")
+    if fmt not in DL_QUALITY:
+        abort(400)
+    job = DOWNLOADS.submit(vid, fmt)
+    st = job.state
+    if st["status"] == "done" or (job.size and st["status"] != "error"):
+        return redirect(f"/api/jobs/{job.id}/file", 302)
+    if st["status"] == "error":
+        abort(500, f"İndirme hatası: {st['error']}")
+    msg = {"queued": "Sırada bekliyor…", "processing": "Dönüştürülüyor…"}.get(st["status"], f"%{st['percent'] or 0}")
+    body = nav() + f"""
+<main class='container mx-auto mt-28 px-4 flex-1'><div class='bg-white rounded-xl shadow p-6 max-w-md mx-auto'>
+ <p class='font-semibold'>{vid}.{fmt}</p>
+ <div class='h-2 bg-gray-200 rounded my-3'><div class='h-2 bg-indigo-600 rounded' style='width:{st["percent"] or 0}%'></div></div>
+ <p class='text-sm text-gray-500'>{msg}</p>
+</div></main>"""
+    return Response(page(body), status=202, headers={"Refresh": "2"})
+
+@app.route("/api/download/<vid>", methods=["POST"])
+def api_download(vid):
     fmt = request.args.get("fmt", "mp4")
-    if fmt not in ("mp4", "mp3"):
+    if fmt not in DL_QUALITY:
         abort(400)
-    fname = f"{vid}.{fmt}"
-    if not os.path.exists(fname):
-        opts = {"quiet": True, "outtmpl": fname,
-                "format": "bestvideo+bestaudio/best" if fmt == "mp4" else "bestaudio",
-                "merge_output_format": "mp4" if fmt == "mp4" else None,
-                "postprocessors": [{"key": "FFmpegExtractAudio", "preferredcodec": "mp3", "preferredquality": "192"}] if fmt == "mp3" else []}
-        YoutubeDL(opts).download([f"https://www.youtube.com/watch?v={vid}"])
-    return send_file(open(fname, "rb"), as_attachment=True,
-                     download_name=fname, mimetype="video/mp4" if fmt == "mp4" else "audio/mpeg")
+    job = DOWNLOADS.submit(vid, fmt)
+    return jsonify(job.view()), 202, {"Location": f"/api/jobs/{job.id}"}
+
+@app.route("/api/jobs/<job_id>")
+def api_job(job_id):
+    return jsonify(job_or_404(job_id).view())
+
+@app.route("/api/jobs/<job_id>/file")
+def api_job_file(job_id):
+    job = job_or_404(job_id)
+    if job.state["status"] == "error":
+        abort(500, f"İndirme hatası: {job.state['error']}")
+    if job.state["status"] != "done":
+        try:
+            fh = open(job.tmp, "rb") if job.tmp else None
+        except FileNotFoundError:  # stored meanwhile
+            fh = None
+        if fh is None:
+            if job.state["status"] != "done":
+                abort(409, "Download not finished")
+        else:
+            return Response(stream_with_context(job.tail(fh)), mimetype=DL_MIME[job.fmt],
+                            headers={"Content-Disposition": f"attachment; filename={job.vid}.{job.fmt}"})
+    if not (hit := STORE.get(job.key)):
+        abort(410, "Download expired, request it again")
+    return send_file(open(hit["path"], "rb"), as_attachment=True,
+                     download_name=f"{job.vid}.{job.fmt}", mimetype=DL_MIME[job.fmt])
+
+# ───────────── Async (ASGI) proxy engine ─────────────
+# /hlsseg/<vid>, /proxy/<vid> and the /hls/<vid> playlists on asyncio: a viewer costs a
+# coroutine instead of a WSGI thread. Bytes are forwarded as the client accepts
+# them (each `send` waits on the server's flow control), so a slow viewer only
+# slows its own upstream read. yt-dlp work stays on threads. Every other path
+# goes to the Flask app (needs `asgiref`). Run with `serve-async`.
+try:
+    import httpx
+except ImportError:
+    httpx = None
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+from http.cookies import SimpleCookie
+from werkzeug.exceptions import HTTPException
+
+_aclient = None
+_flask_asgi = WsgiToAsgi(app) if WsgiToAsgi else None
+
+def aclient() -> "httpx.AsyncClient":
+    """Shared async client; keep-alive pool sized like the sync one (httpx limits are per client, not per host)."""
+    global _aclient
+    if _aclient is None:
+        if httpx is None:
+            raise RuntimeError("the async proxy needs the 'httpx' package")
+        limits = httpx.Limits(max_connections=UP_HOSTS * UP_CONNS, max_keepalive_connections=UP_HOSTS * UP_CONNS)
+        _aclient = httpx.AsyncClient(timeout=15, transport=httpx.AsyncHTTPTransport(retries=UP_RETRIES, limits=limits))
+    return _aclient
+
+async def in_thread(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+async def a_iter(gen, depth: int = 4):
+    """Iterate a blocking generator on one executor thread; its items come over a
+    queue of `depth`, so the thread runs at most that far ahead of the consumer."""
+    loop, q, stop = asyncio.get_running_loop(), asyncio.Queue(depth), threading.Event()
+    def pump():
+        try:
+            for item in gen:
+                asyncio.run_coroutine_threadsafe(q.put(item), loop).result()
+                if stop.is_set():
+                    return
+            asyncio.run_coroutine_threadsafe(q.put(None), loop).result()
+        except Exception as e:
+            if not stop.is_set():
+                asyncio.run_coroutine_threadsafe(q.put(e), loop).result()
+        finally:
+            gen.close()
+    loop.run_in_executor(None, pump)
+    try:
+        while (item := await q.get()) is not None:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()  # the thread stops after its next put, which the drain lets through
+        while not q.empty():
+            q.get_nowait()
+
+async def a_reply(send, status: int, headers: Dict[str, str], body: bytes = b""):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]})
+    await send({"type": "http.response.body", "body": body})
+
+async def a_get(url: str, rng: Optional[str]) -> "httpx.Response":
+    hdr = {"Accept-Encoding": "identity"}
+    if rng:
+        hdr["Range"] = rng
+    return await aclient().send(aclient().build_request("GET", url, headers=hdr), stream=True)
+
+async def a_chunks(r: "httpx.Response", mode: str = RELAY_MODE):
+    """Async counterpart of relay(): fixed-size, or growing chunks coalesced from what
+    the network delivers (readinto has no async equivalent and behaves as adaptive)."""
+    if mode == "fixed":
+        async for data in r.aiter_raw(RELAY_CHUNK):
+            yield data
+        return
+    sizes, buf = chunk_sizes(), bytearray()
+    want = next(sizes)
+    async for part in r.aiter_raw():
+        buf += part
+        if len(buf) >= want:
+            yield bytes(buf)
+            buf.clear()
+            want = next(sizes)
+    if buf:
+        yield bytes(buf)
+
+async def a_relay(send, r: "httpx.Response", extra: Dict[str, str]):
+    try:
+        hdr = {h: r.headers[h] for h in RELAY_HEADERS if h in r.headers}
+        hdr.update(extra)
+        await send({"type": "http.response.start", "status": r.status_code,
+                    "headers": [(k.lower().encode(), v.encode()) for k, v in hdr.items()]})
+        async for chunk in a_chunks(r):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        await r.aclose()
+
+async def a_hlsseg(send, vid: str, tok: str, rng: Optional[str], viewer: str):
+    if (u := await in_thread(token_url, vid, tok)) is None:
+        return await a_reply(send, 404, {"Content-Type": "text/plain"}, b"Not Found")
+    if is_playlist(u) and (txt := await in_thread(media_text, vid, tok.replace(".", "-"), u)) is not None:
+        return await a_reply(send, 200, {"Content-Type": M3U8, "Cache-Control": "no-store"}, txt.encode())
+    prefetch_from(vid, tok, viewer)
+    if (hit := await in_thread(cached_segment, u)):
+        status, hdr, body = seg_response(*hit, rng)
+        try:
+            await send({"type": "http.response.start", "status": status,
+                        "headers": [(k.lower().encode(), v.encode()) for k, v in hdr.items()]})
+        except BaseException:
+            body.close()
+            raise
+        chunks = a_iter(body)  # closes `body` on its thread
+        try:
+            async for data in chunks:
+                await send({"type": "http.response.body", "body": data, "more_body": True})
+            return await send({"type": "http.response.body", "body": b""})
+        finally:
+            await chunks.aclose()
+    await a_relay(send, await a_get(u, rng), {"Cache-Control": "no-store"})
+
+async def a_proxy(send, vid: str, args: Dict, rng: Optional[str]):
+    fmt = args.get("f", ["best"])[0]
+    src = await in_thread(progressive_url, vid, fmt)
+    r = await a_get(src, rng)
+    if r.status_code in (403, 410):
+        await r.aclose()
+        r = await a_get(await in_thread(progressive_url, vid, fmt, src), rng)
+    await a_relay(send, r, {"Cache-Control": "no-store", "Content-Disposition": "inline"})
+
+async def a_hls_master(send, vid: str, viewer: Optional[str]):
+    try:
+        entry = await in_thread(master_playlist, vid)
+    except Exception as e:
+        logging.warning("Manifest fetch error %s, redirect MP4", e)
+        entry = None
+    if entry is None:
+        return await a_reply(send, 302, {"Location": f"/proxy/{vid}"})
+    hdr = {"Content-Type": M3U8}
+    if PREFETCH.ahead and not viewer:
+        hdr["Set-Cookie"] = f"{VIEWER_COOKIE}={uuid.uuid4().hex}; Path=/; HttpOnly; SameSite=Lax"
+    await a_reply(send, 200, hdr, entry["text"].encode())
+
+async def a_hls_media(send, vid: str, n: int):
+    if (txt := await in_thread(video_media, vid, n)) is None:
+        return await a_reply(send, 502, {"Content-Type": "text/plain"}, b"Bad Gateway")
+    await a_reply(send, 200, {"Content-Type": M3U8, "Cache-Control": "no-store"}, txt.encode())
+
+async def asgi_app(scope, receive, send):
+    """ASGI entry point: the streaming routes natively, everything else via Flask."""
+    if scope["type"] == "lifespan":
+        global _aclient
+        while (await receive())["type"] != "lifespan.shutdown":
+            await send({"type": "lifespan.startup.complete"})
+        if _aclient is not None:
+            await _aclient.aclose()
+            _aclient = None
+        return await send({"type": "lifespan.shutdown.complete"})
+    path = scope.get("path", "")
+    if scope["type"] == "http" and scope["method"] == "GET":
+        args = urllib.parse.parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        hdrs = {k: v.decode("latin-1") for k, v in scope.get("headers", [])}
+        rng = hdrs.get(b"range")
+        jar = SimpleCookie(hdrs.get(b"cookie", ""))
+        viewer = jar[VIEWER_COOKIE].value if VIEWER_COOKIE in jar else None
+        try:
+            if m := re.fullmatch(r"/hlsseg/([^/]+)/([^/]+)", path):
+                key = viewer_key(viewer, (scope.get("client") or ("",))[0], hdrs.get(b"user-agent"))
+                return await a_hlsseg(send, m.group(1), m.group(2), rng, key)
+            if m := re.fullmatch(r"/proxy/([^/]+)", path):
+                return await a_proxy(send, m.group(1), args, rng)
+            if m := re.fullmatch(r"/hls/([^/]+)/master\.m3u8", path):
+                return await a_hls_master(send, m.group(1), viewer)
+            if m := re.fullmatch(r"/hls/([^/]+)/media/(\d+)\.m3u8", path):
+                return await a_hls_media(send, m.group(1), int(m.group(2)))
+        except HTTPException as e:
+            return await a_reply(send, e.code or 500, {"Content-Type": "text/plain"}, (e.description or "").encode())
+        except EmptyPoolError as e:
+            return await a_reply(send, 503, {"Content-Type": "text/plain"}, str(e).encode())
+    if _flask_asgi is None:
+        return await a_reply(send, 404, {"Content-Type": "text/plain"}, b"Not Found (install asgiref to serve the Flask routes)")
+    await _flask_asgi(scope, receive, send)
 
 # ───────────── main ─────────────
 if __name__ == "__main__":
-    app.run(debug=True)
+    cli = argparse.ArgumentParser(description="YouTube Odak Modu")
+    cli.add_argument("command", nargs="?", default="serve", choices=["serve", "serve-async", "prewarm", "bench-relay", "bench-prefetch", "bench-download"])
+    cli.add_argument("--host", default="127.0.0.1")
+    cli.add_argument("--port", type=int, default=5000)
+    cli.add_argument("--mb", type=int, default=64, help="bench-relay/bench-download: body size in MiB")
+    cli.add_argument("--runs", type=int, default=3)
+    cli.add_argument("--ahead", type=int, default=3, help="bench-prefetch: segments to prefetch")
+    cli.add_argument("--latency", type=float, default=0.3, help="bench-prefetch: upstream latency in seconds")
+    cli.add_argument("--connections", type=int, default=max(DL_CONNS, 2), help="bench-download: range connections")
+    cli.add_argument("--throttle", type=float, default=8, help="bench-download: per-connection MiB/s")
+    args = cli.parse_args()
+    if args.command == "bench-prefetch":
+        print(f"{'prefetch':<10}{'startup ms':>12}{'stall ms':>10}{'stalls':>8}")
+        for name, r in bench_prefetch(latency=args.latency, ahead=args.ahead).items():
+            print(f"{name:<10}{r['startup_ms']:>12.0f}{r['stall_ms']:>10.0f}{r['stalls']:>8}")
+    elif args.command == "bench-download":
+        print(f"{'path':<14}{'seconds':>10}{'MiB/s':>10}")
+        for name, r in bench_download(args.mb, args.connections, args.throttle).items():
+            print(f"{name:<14}{r['seconds']:>10.2f}{r['mb_s']:>10.1f}")
+    elif args.command == "bench-relay":
+        print(f"{'mode':<20}{'MB/s':>10}{'CPU s':>9}{'chunks':>9}")
+        for name, r in bench_relay(args.mb, args.runs).items():
+            print(f"{name:<20}{r['mb_s']:>10.0f}{r['cpu_s']:>9.2f}{r['chunks']:>9}")
+    elif args.command == "prewarm":
+        c = resolve_chrome(refresh=True)
+        print(f"Chrome {c['version']} → {c['binary']}\nChromeDriver → {c['driver']}\nCache → {CHROME_CACHE}")
+    else:
+        try:
+            resolve_chrome()
+        except (StopIteration, subprocess.CalledProcessError) as e:
+            logging.warning("Chrome not available, search will fail: %r", e)
+        if args.command == "serve-async":
+            import uvicorn
+            uvicorn.run(asgi_app, host=args.host, port=args.port)
+        else:
+            app.run(debug=True, host=args.host, port=args.port)
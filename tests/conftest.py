@@ -0,0 +1,36 @@
+"""Load the app modules (two have hyphenated file names) with their caches in a temp dir."""
+import importlib.util
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE = tempfile.mkdtemp(prefix="youtube-focus-tests-")
+for var, sub in (("FOCUS_DOWNLOAD_DIR", "downloads"), ("FOCUS_SEGMENT_CACHE_DIR", "segments")):
+    os.environ.setdefault(var, os.path.join(CACHE, sub))
+
+
+def load(relpath: str, name: str):
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, relpath))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
+@pytest.fixture(scope="session")
+def backend():
+    return load("backend/app.py", "focus_backend")
+
+
+@pytest.fixture(scope="session")
+def youtube_tr():
+    return load("youtube-tr.py", "focus_youtube_tr")
+
+
+@pytest.fixture(scope="session")
+def proxy():
+    return load("segment_proxy_youtube-tr.py", "focus_proxy")
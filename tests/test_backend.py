@@ -0,0 +1,540 @@
+import os
+import threading
+import time
+
+import pytest
+
+DATA = bytes(range(256)) * 40  # 10240 bytes: three 4 KiB ranges, the last one short
+
+
+def ranged_source(data, fail=lambda start, calls: False):
+    """open_range over `data`; `fail(start, calls)` cuts a response short after half its bytes."""
+    calls = []
+    lock = threading.Lock()
+
+    def open_range(start, end):
+        with lock:
+            calls.append((start, end))
+            cut = fail(start, calls)
+        body = data[start:end + 1]
+        if cut:
+            body = body[:len(body) // 2]
+        return len(data), iter([body[i:i + 512] for i in range(0, len(body), 512)])
+
+    return open_range, calls
+
+
+@pytest.mark.parametrize("duration, seconds", [("4:05", 245), ("0:59", 59), ("12:34", 754), ("1:02:03", 3723), ("45", 45)])
+def test_duration_to_seconds(backend, youtube_tr, duration, seconds):
+    assert backend.duration_to_seconds(duration) == seconds
+    assert youtube_tr.duration_to_seconds(duration) == seconds
+
+
+def video(n, dur="3:00"):
+    return {"id": f"v{n}", "title": f"Video {n}", "dur": dur}
+
+
+class FakeEngine:
+    """search_engine stand-in that counts its calls; `incomplete` makes them raise SearchIncomplete."""
+
+    def __init__(self, backend, videos, incomplete=False):
+        self.backend, self.videos_, self.incomplete = backend, videos, incomplete
+        self.calls = []
+
+    def videos(self, query, filter_type, limit=8):
+        self.calls.append(("videos", query, filter_type))
+        results = [v for v in self.videos_ if self.backend.matches_duration_filter(
+            self.backend.duration_to_seconds(v["dur"]), filter_type)][:limit]
+        if self.incomplete:
+            raise self.backend.SearchIncomplete(results)
+        return results
+
+
+@pytest.fixture
+def search_cache(backend, monkeypatch):
+    cache = backend.MemoryResultCache(600, 16)
+    monkeypatch.setattr(backend, "search_cache", cache)
+    return cache
+
+
+@pytest.mark.parametrize("make_cache", [
+    lambda backend, tmp_path, ttl, size: backend.MemoryResultCache(ttl, size),
+    lambda backend, tmp_path, ttl, size: backend.SqliteResultCache(ttl, size, str(tmp_path / "cache.sqlite3")),
+])
+def test_result_cache_expires_and_evicts_the_least_recently_used(backend, tmp_path, make_cache):
+    cache = make_cache(backend, tmp_path, 600, 2)
+    cache.set("a", [1])
+    cache.set("b", [2])
+    time.sleep(0.01)
+    assert cache.get("a") == [1]  # b is now the least recently used
+    cache.set("c", [3])
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == ([1], None, [3])
+    cache.set("short", [], ttl=0.05)
+    assert cache.get("short") == []  # an empty list is a hit, not a miss
+    time.sleep(0.1)
+    assert cache.get("short") is None
+    assert cache.stats()["hits"] == 4 and cache.stats()["misses"] == 2
+
+
+def test_search_videos_is_cached_per_normalized_query(backend, monkeypatch, search_cache):
+    engine = FakeEngine(backend, [video(n) for n in range(10)])
+    monkeypatch.setattr(backend, "search_engine", engine)
+    first = backend.search_videos("Lo-fi  Beats", "all")
+    assert backend.search_videos(" lo-fi beats ", "all") == first == [video(n) for n in range(8)]
+    assert backend.search_videos("lo-fi beats", "short") == first  # filtered from the cached raw list
+    assert engine.calls == [("videos", "Lo-fi  Beats", "all")]
+
+
+def test_search_videos_keeps_empty_results_briefly(backend, monkeypatch, search_cache):
+    monkeypatch.setattr(backend, "search_engine", FakeEngine(backend, []))
+    monkeypatch.setattr(backend, "SEARCH_CACHE_EMPTY_TTL", 0.05)
+    assert backend.search_videos("nothing", "all") == []
+    assert backend.search_videos("nothing", "all") == []
+    assert len(backend.search_engine.calls) == 1
+    time.sleep(0.1)
+    backend.search_videos("nothing", "all")
+    assert len(backend.search_engine.calls) == 2
+
+
+def test_search_videos_does_not_cache_an_incomplete_page(backend, monkeypatch, search_cache):
+    engine = FakeEngine(backend, [video(1)], incomplete=True)
+    monkeypatch.setattr(backend, "search_engine", engine)
+    assert backend.search_videos("partial", "all") == [video(1)]
+    assert backend.search_videos("partial", "all") == [video(1)]
+    assert len(engine.calls) == 2
+
+
+def run_together(flight, key, fn, callers):
+    """Call flight.do(key, fn) from `callers` threads; returns [(result, error)] once all are done."""
+    out = []
+
+    def call():
+        try:
+            out.append((flight.do(key, fn), None))
+        except Exception as e:
+            out.append((None, e))
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return out
+
+
+def blocking(result=None, error=None):
+    """fn for a flight that waits for `release`, counting its calls."""
+    calls, release = [], threading.Event()
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        if error is not None:
+            raise error
+        return result
+
+    return fn, calls, release
+
+
+def release_when_shared(flight, release, shared):
+    def wait():
+        deadline = time.monotonic() + 5
+        while flight.stats()["shared"] < shared and time.monotonic() < deadline:
+            time.sleep(0.005)
+        release.set()
+    threading.Thread(target=wait).start()
+
+
+def test_single_flight_shares_one_result(app_module):
+    flight = app_module.SingleFlight()
+    result = ["shared"]
+    fn, calls, release = blocking(result)
+    release_when_shared(flight, release, 4)
+    out = run_together(flight, "k", fn, 5)
+    assert len(calls) == 1
+    assert all(res is result and err is None for res, err in out) and len(out) == 5
+    assert flight.stats() == {"executed": 1, "shared": 4, "in_flight": 0}
+    assert flight.do("k", lambda: "again") == "again"  # nothing is remembered after the call
+
+
+def test_single_flight_shares_the_error(app_module):
+    flight = app_module.SingleFlight()
+    error = app_module.SearchFailed("engine down")
+    fn, calls, release = blocking(error=error)
+    release_when_shared(flight, release, 2)
+    out = run_together(flight, "k", fn, 3)
+    assert len(calls) == 1
+    assert [err for _, err in out] == [error] * 3
+
+
+def test_concurrent_identical_searches_make_one_engine_call(backend, monkeypatch, search_cache):
+    engine = FakeEngine(backend, [video(1)])
+    fn, _, release = blocking()
+    videos = engine.videos
+
+    def slow_videos(*args, **kwargs):
+        fn()
+        return videos(*args, **kwargs)
+
+    monkeypatch.setattr(engine, "videos", slow_videos)
+    monkeypatch.setattr(backend, "search_engine", engine)
+    flights = backend.SingleFlight()
+    monkeypatch.setattr(backend, "search_flights", flights)
+    release_when_shared(flights, release, 3)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(backend.search_videos("q", "all"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert results == [[video(1)]] * 4
+    assert len(engine.calls) == 1
+
+
+def test_fetch_ranges_writes_every_range(backend, tmp_path):
+    open_range, calls = ranged_source(DATA)
+    progress = []
+    path = tmp_path / "out"
+    total = backend.fetch_ranges(open_range, str(path), 3, 4096, lambda *p: progress.append(p))
+    assert total == len(DATA)
+    assert path.read_bytes() == DATA
+    assert sorted(calls) == [(0, 4095), (4096, 8191), (8192, 10239)]
+    assert progress[-1] == (len(DATA), len(DATA), len(DATA))
+    assert [p[2] for p in progress] == sorted(p[2] for p in progress)  # the prefix never goes backwards
+
+
+def test_fetch_ranges_resumes_a_short_read(backend, monkeypatch, tmp_path):
+    monkeypatch.setattr(backend, "DOWNLOAD_RANGE_RETRIES", 2)
+    open_range, calls = ranged_source(DATA, lambda start, calls: start == 4096)
+    path = tmp_path / "out"
+    assert backend.fetch_ranges(open_range, str(path), 3, 4096) == len(DATA)
+    assert path.read_bytes() == DATA
+    assert (4096 + 2048, 8191) in calls  # retried from the first missing byte
+
+
+def test_fetch_ranges_gives_up_after_the_retries(backend, monkeypatch, tmp_path):
+    monkeypatch.setattr(backend, "DOWNLOAD_RANGE_RETRIES", 1)
+    open_range, calls = ranged_source(DATA, lambda start, calls: 4096 <= start < 8192)
+    with pytest.raises(IOError, match="range 4096-8191 ended at byte"):
+        backend.fetch_ranges(open_range, str(tmp_path / "out"), 3, 4096)
+    assert [c for c in calls if 4096 <= c[0] < 8192] == [(4096, 8191), (6144, 8191)]
+
+
+def test_fetch_ranges_propagates_a_failing_request(backend, monkeypatch, tmp_path):
+    monkeypatch.setattr(backend, "DOWNLOAD_RANGE_RETRIES", 1)
+    good, _ = ranged_source(DATA)
+
+    def open_range(start, end):
+        if start >= 8192:
+            raise ConnectionError("reset by peer")
+        return good(start, end)
+
+    with pytest.raises(ConnectionError):
+        backend.fetch_ranges(open_range, str(tmp_path / "out"), 3, 4096)
+
+
+def test_fetch_ranges_without_range_support(backend, tmp_path):
+    path = tmp_path / "out"
+    total = backend.fetch_ranges(lambda start, end: (None, iter([DATA[:5000], DATA[5000:]])), str(path), 3, 4096)
+    assert total == len(DATA)
+    assert path.read_bytes() == DATA
+
+
+class Body:
+    """A response body that records close()."""
+    def __init__(self, chunks, fail_after=None):
+        self.chunks, self.fail_after, self.closed = list(chunks), fail_after, False
+
+    def __iter__(self):
+        for n, chunk in enumerate(self.chunks):
+            if n == self.fail_after:
+                raise ConnectionError("reset by peer")
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(params=["backend", "youtube_tr"])
+def app_module(request):
+    return request.getfixturevalue(request.param)
+
+
+@pytest.mark.parametrize("total, body", [
+    (None, Body([DATA])),                    # no range support: the body is read through
+    (0, Body([])),                           # empty file: nothing reads the body
+    (None, Body([DATA, DATA], fail_after=1)),
+])
+def test_fetch_ranges_closes_the_first_response(app_module, monkeypatch, tmp_path, total, body):
+    monkeypatch.setattr(app_module, "DOWNLOAD_RANGE_RETRIES", 0)
+    try:
+        app_module.fetch_ranges(lambda start, end: (total, body), str(tmp_path / "out"), 3, 4096)
+    except ConnectionError:
+        assert body.fail_after is not None
+    assert body.closed
+
+
+def test_fetch_ranges_closes_every_range_response(app_module, tmp_path):
+    bodies = []
+
+    def open_range(start, end):
+        bodies.append(Body([DATA[start:end + 1] + b"extra"]))  # more than asked: the reader stops early
+        return len(DATA), bodies[-1]
+
+    assert app_module.fetch_ranges(open_range, str(tmp_path / "out"), 3, 4096) == len(DATA)
+    assert len(bodies) == 3 and all(b.closed for b in bodies)
+
+
+def test_response_chunks_close_an_unread_response(app_module):
+    class Response:
+        closed = False
+
+        def read(self, n):
+            return b""
+
+        def close(self):
+            self.closed = True
+
+    resp = Response()
+    app_module._ResponseChunks(resp).close()
+    assert resp.closed
+    resp = Response()
+    assert list(app_module._ResponseChunks(resp)) == [] and resp.closed
+
+
+def test_growing_file_waits_for_bytes_reported_before_they_are_readable(backend, tmp_path):
+    path = tmp_path / "part"
+    path.write_bytes(b"a" * 100)
+    stream = backend.GrowingFile()
+    stream.advance(str(path), 200, 200)  # 100 bytes still in the writer's buffer
+    received = []
+    reader = threading.Thread(target=lambda: received.extend(stream.chunks(64)))
+    reader.start()
+    reader.join(0.2)
+    assert reader.is_alive()  # a short read is not the end of the file
+    with open(path, "ab") as fh:
+        fh.write(b"b" * 100)
+    stream.finish(str(path))
+    reader.join(2)
+    assert b"".join(received) == b"a" * 100 + b"b" * 100
+
+
+def test_growing_file_reports_a_file_shorter_than_announced(backend, tmp_path):
+    path = tmp_path / "part"
+    path.write_bytes(b"a" * 100)
+    stream = backend.GrowingFile()
+    stream.advance(str(path), 200, 200)
+    stream.done = True
+    with pytest.raises(RuntimeError, match="ended at 100 of 200"):
+        list(stream.chunks(64))
+
+
+def test_ydl_download_keeps_yt_dlp_fixups_and_does_not_stream(backend, monkeypatch, tmp_path):
+    seen = {}
+
+    class FakeYoutubeDL:
+        def __init__(self, opts):
+            seen.update(opts)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def extract_info(self, url, download):
+            for hook in seen["progress_hooks"]:
+                hook({"status": "downloading", "tmpfilename": str(tmp_path / "v.mp4.part"), "downloaded_bytes": 10})
+            return {"title": "T", "ext": "mp4"}
+
+    monkeypatch.setattr(backend, "YoutubeDL", FakeYoutubeDL)
+    job = backend.DownloadJob("v", "mp4")
+    job.stream = backend.GrowingFile()
+    assert backend.ydl_download(job, str(tmp_path)) == ("T", str(tmp_path / "v.mp4"))
+    assert "fixup" not in seen
+    assert not job.stream.ready.is_set()
+
+
+@pytest.fixture
+def store(backend, monkeypatch, tmp_path):
+    artifacts = backend.ArtifactStore(str(tmp_path / "store"), 1 << 20)
+    monkeypatch.setattr(backend, "artifacts", artifacts)
+    return artifacts
+
+
+def put_artifact(store, key, data=b"x" * 100, title="T"):
+    src = os.path.join(store.tempdir(), key)
+    with open(src, "wb") as fh:
+        fh.write(data)
+    with store.lock(key):
+        return store.put(key, src, title)
+
+
+def test_artifact_store_reads_do_not_rewrite_a_fresh_manifest(store, monkeypatch):
+    put_artifact(store, "a-720.mp4")
+    before = os.stat(store.manifest_path).st_mtime_ns
+    time.sleep(0.01)
+    for _ in range(3):
+        assert store.get("a-720.mp4")["title"] == "T"
+    assert os.stat(store.manifest_path).st_mtime_ns == before
+    monkeypatch.setattr(store, "USE_RESOLUTION", 0.0)
+    used = store.get("a-720.mp4")["used"]
+    assert os.stat(store.manifest_path).st_mtime_ns != before
+    assert store.get("a-720.mp4")["used"] >= used
+    assert store.stats()["hits"] == 5
+
+
+def test_artifact_store_evicts_the_least_recently_used(store, monkeypatch):
+    monkeypatch.setattr(store, "quota_bytes", 250)
+    monkeypatch.setattr(store, "USE_RESOLUTION", 0.0)
+    put_artifact(store, "a-720.mp4")
+    put_artifact(store, "b-720.mp4")
+    store.get("a-720.mp4")  # b is now the least recently used
+    put_artifact(store, "c-720.mp4")
+    assert [store.get(k) is not None for k in ("a-720.mp4", "b-720.mp4", "c-720.mp4")] == [True, False, True]
+    assert not os.path.exists(os.path.join(store.root, "b-720.mp4"))
+    assert not os.path.exists(store._lock_path("b-720.mp4"))
+    assert store.stats()["evictions"] == 1 and store.stats()["bytes"] == 200
+
+
+def test_artifact_store_keeps_the_lock_file_of_an_artifact_being_produced(store, monkeypatch):
+    monkeypatch.setattr(store, "quota_bytes", 150)
+    put_artifact(store, "a-720.mp4")
+    with store.lock("a-720.mp4"):  # someone is producing "a" again
+        put_artifact(store, "b-720.mp4")
+        assert store.get("a-720.mp4") is None
+        assert os.path.exists(store._lock_path("a-720.mp4"))
+
+
+def test_artifact_store_drops_entries_whose_file_is_gone(store):
+    put_artifact(store, "a-720.mp4")
+    os.remove(os.path.join(store.root, "a-720.mp4"))
+    assert store.get("a-720.mp4") is None
+    assert store.stats()["entries"] == 0 and store.stats()["misses"] == 1
+
+
+def test_artifact_store_lock_excludes_other_threads(store):
+    order = []
+    held = threading.Event()
+
+    def producer():
+        with store.lock("a-720.mp4"):
+            held.set()
+            time.sleep(0.2)
+            order.append("first")
+
+    thread = threading.Thread(target=producer)
+    thread.start()
+    held.wait(2)
+    with store.lock("a-720.mp4"):
+        order.append("second")
+    thread.join()
+    assert order == ["first", "second"]
+
+
+def test_artifact_store_removes_stale_temp_dirs(backend, tmp_path):
+    root = tmp_path / "store"
+    stale, fresh = root / ".tmp" / "stale", root / ".tmp" / "fresh"
+    stale.mkdir(parents=True)
+    fresh.mkdir()
+    day_ago = time.time() - 2 * 86400
+    os.utime(stale, (day_ago, day_ago))
+    backend.ArtifactStore(str(root), 1 << 20)
+    assert not stale.exists() and fresh.exists()
+
+
+class BlockingDownloads:
+    """run_download stand-in: each job waits for `release`, then succeeds or fails."""
+
+    def __init__(self, store, fail=False):
+        self.store, self.fail = store, fail
+        self.release = threading.Event()
+        self.started = []
+
+    def __call__(self, job):
+        self.started.append((job.video_id, job.fmt))
+        self.release.wait(5)
+        if self.fail:
+            raise IOError("upstream refused")
+        stored = put_artifact(self.store, f"{job.video_id}.{job.fmt}")
+        return "T", stored["path"]
+
+
+def test_download_queue_joins_a_running_job(backend, monkeypatch, store):
+    downloads = BlockingDownloads(store)
+    monkeypatch.setattr(backend, "run_download", downloads)
+    queue = backend.DownloadQueue(2, 8, 60)
+    try:
+        job = queue.submit("vid", "mp3")
+        assert queue.submit("vid", "mp3") is job
+        other = queue.submit("vid", "m4a")
+        assert other is not job
+        downloads.release.set()
+        assert job.done.wait(5) and other.done.wait(5)
+        assert job.status == "done" and os.path.exists(job.filename)
+        assert queue.submit("vid", "mp3") is job  # finished jobs are joined too
+        assert queue.joined == 2
+        assert sorted(downloads.started) == [("vid", "m4a"), ("vid", "mp3")]
+    finally:
+        queue.close()
+
+
+def test_download_queue_retries_a_failed_job(backend, monkeypatch, store):
+    downloads = BlockingDownloads(store, fail=True)
+    downloads.release.set()
+    monkeypatch.setattr(backend, "run_download", downloads)
+    queue = backend.DownloadQueue(1, 8, 60)
+    try:
+        job = queue.submit("vid", "mp3")
+        assert job.done.wait(5)
+        assert job.status == "error" and job.error == "upstream refused"
+        assert queue.submit("vid", "mp3") is not job
+    finally:
+        queue.close()
+
+
+def test_download_queue_refuses_beyond_its_limit(backend, monkeypatch, store):
+    downloads = BlockingDownloads(store)
+    monkeypatch.setattr(backend, "run_download", downloads)
+    queue = backend.DownloadQueue(1, 1, 60)
+    try:
+        queue.submit("a", "mp3")
+        while not downloads.started:  # "a" is running
+            time.sleep(0.01)
+        queue.submit("b", "mp3")  # queued
+        with pytest.raises(backend.DownloadQueueFull):
+            queue.submit("c", "mp3")
+    finally:
+        downloads.release.set()
+        queue.close()
+
+
+def test_download_queue_answers_stored_artifacts_without_running(backend, monkeypatch, store):
+    monkeypatch.setattr(backend, "run_download", lambda job: pytest.fail("should not download"))
+    stored = put_artifact(store, backend.artifact_key("vid", "mp3"), title="Stored")
+    queue = backend.DownloadQueue(1, 0, 60)  # a full queue still serves the store
+    try:
+        job = queue.submit("vid", "mp3")
+        assert job.status == "done" and job.done.is_set()
+        assert (job.title, job.filename) == ("Stored", stored["path"])
+    finally:
+        queue.close()
+
+
+def test_download_link_answers_202_until_ready_then_redirects(backend, monkeypatch, store):
+    downloads = BlockingDownloads(store)
+    monkeypatch.setattr(backend, "run_download", downloads)
+    monkeypatch.setattr(backend, "download_queue", backend.DownloadQueue(1, 8, 60))
+    monkeypatch.setattr(backend, "DOWNLOAD_STREAM_WAIT", 0.05)
+    client = backend.app.test_client()
+    try:
+        pending = client.get("/api/download/vid?fmt=mp3")
+        assert pending.status_code == 202
+        assert pending.get_json()["status"] in ("queued", "downloading")
+        downloads.release.set()
+        assert backend.download_queue.get(pending.get_json()["id"]).done.wait(5)
+        ready = client.get("/api/download/vid?fmt=mp3")
+        assert ready.status_code == 302
+        assert ready.headers["Location"].endswith(f"/api/jobs/{pending.get_json()['id']}/file")
+    finally:
+        backend.download_queue.close()
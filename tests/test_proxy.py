@@ -0,0 +1,411 @@
+import pytest
+
+BASE = "https://edge.example/live/"
+
+
+def live_playlist(first, count, target=4):
+    lines = ["#EXTM3U", f"#EXT-X-TARGETDURATION:{target}", f"#EXT-X-MEDIA-SEQUENCE:{first}"]
+    for seq in range(first, first + count):
+        lines += ["#EXTINF:4.0,", f"seg{seq}.ts"]
+    return "\n".join(lines) + "\n"
+
+
+def segment_lines(text):
+    return [line for line in text.splitlines() if line.startswith("/hlsseg/")]
+
+
+def test_live_playlist_merge_slides_the_window(proxy):
+    pl = proxy.MediaPlaylist("vid", "0", BASE + "index.m3u8")
+    pl.update(proxy.parse_playlist(live_playlist(10, 3), BASE + "index.m3u8"))
+    pl.update(proxy.parse_playlist(live_playlist(12, 3), BASE + "index.m3u8"))
+    assert list(pl.segs) == [12, 13, 14]
+    assert segment_lines(pl.text()) == ["/hlsseg/vid/0.12", "/hlsseg/vid/0.13", "/hlsseg/vid/0.14"]
+    assert "0.10" not in pl.urls and "0.11" not in pl.urls
+    assert pl.urls["0.14"] == BASE + "seg14.ts"
+    assert "#EXT-X-ENDLIST" not in pl.text()
+
+
+def test_live_playlist_merge_after_sequence_rollover(proxy):
+    pl = proxy.MediaPlaylist("vid", "1", BASE + "index.m3u8")
+    pl.update(proxy.parse_playlist(live_playlist(4294967294, 2), BASE + "index.m3u8"))
+    pl.update(proxy.parse_playlist(live_playlist(0, 2), BASE + "index.m3u8"))  # the stream restarted
+    assert list(pl.segs) == [0, 1]
+    assert segment_lines(pl.text()) == ["/hlsseg/vid/1.0", "/hlsseg/vid/1.1"]
+    assert set(pl.urls) == {"1.0", "1.1"}
+
+
+def test_live_playlist_merge_keeps_segments_already_rendered(proxy):
+    pl = proxy.MediaPlaylist("vid", "2", BASE + "index.m3u8")
+    pl.update(proxy.parse_playlist(live_playlist(5, 2), BASE + "index.m3u8"))
+    before = pl.segs[6]
+    pl.update(proxy.parse_playlist(live_playlist(5, 3) + "#EXT-X-ENDLIST\n", BASE + "index.m3u8"))
+    assert pl.segs[6] is before
+    assert list(pl.segs) == [5, 6, 7]
+    assert pl.text().endswith("#EXT-X-ENDLIST\n")
+
+
+@pytest.fixture
+def http_server():
+    """A local HTTP/1.1 server; `routes` maps a path to (status, headers, body chunks, delay between chunks)."""
+    import threading
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    routes = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            status, headers, chunks, delay = routes[self.path]
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            try:
+                for chunk in chunks:
+                    self.wfile.write(chunk)
+                    self.wfile.flush()
+                    time.sleep(delay)
+            except OSError:
+                pass
+            self.close_connection = "Content-Length" not in headers or sum(map(len, chunks)) != int(headers["Content-Length"])
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.routes = routes
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    yield server
+    server.shutdown()
+
+
+def test_upstream_pool_waits_a_bounded_time_for_a_connection(proxy, monkeypatch, http_server):
+    import time
+    import requests
+    from urllib3.exceptions import EmptyPoolError
+
+    http_server.routes["/slow"] = (200, {"Content-Length": "4"}, [b"ab", b"cd"], 1.0)
+    monkeypatch.setattr(proxy, "UP_POOL_WAIT", 0.2)
+    session = requests.Session()
+    session.mount("http://", proxy.PoolAdapter(pool_connections=1, pool_maxsize=1, pool_block=True))
+    held = session.get(http_server.url + "/slow", stream=True, timeout=5)  # keeps the only connection
+    try:
+        t0 = time.monotonic()
+        with pytest.raises(EmptyPoolError):
+            session.get(http_server.url + "/slow", timeout=5)
+        assert time.monotonic() - t0 < 2
+    finally:
+        held.close()
+
+
+def test_full_upstream_pool_is_a_503(proxy, monkeypatch):
+    from urllib3.exceptions import EmptyPoolError
+
+    def full(*args, **kwargs):
+        raise EmptyPoolError(None, "Pool reached maximum size and no more connections are allowed.")
+
+    monkeypatch.setattr(proxy, "token_url", lambda vid, tok: "https://edge.example/videoplayback/id/x/seg.ts")
+    monkeypatch.setattr(proxy, "cached_segment", lambda u: None)
+    monkeypatch.setattr(proxy.PREFETCH, "on_request", lambda *args: None)
+    monkeypatch.setattr(proxy, "upstream", lambda: type("Session", (), {"get": staticmethod(full)})())
+    assert proxy.app.test_client().get("/hlsseg/vid/0.1").status_code == 503
+
+
+@pytest.fixture
+def fresh_tables(proxy, monkeypatch):
+    """Empty URL table and playlist cache, as a worker that issued none of the tokens sees them."""
+    def reset():
+        monkeypatch.setattr(proxy, "URL_TABLE", proxy.MemCache("url", 600, 1000))
+        monkeypatch.setattr(proxy, "PLAYLISTS", proxy.MemCache("playlist", 600, 100))
+    reset()
+    return reset
+
+
+def test_token_url_rebuilds_nested_playlists_in_a_fresh_worker(proxy, monkeypatch, http_server, fresh_tables):
+    for path, text in {
+        "/master.m3u8": "#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1\nmedia.m3u8\n",
+        "/media.m3u8": "#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1\nnested/inner.m3u8\n",
+        "/nested/inner.m3u8": "#EXTM3U\n#EXT-X-TARGETDURATION:4\n#EXT-X-MEDIA-SEQUENCE:7\n"
+                              "#EXTINF:4,\nseg7.ts\n#EXTINF:4,\nseg8.ts\n#EXT-X-ENDLIST\n",
+    }.items():
+        http_server.routes[path] = (200, {"Content-Length": str(len(text))}, [text.encode()], 0)
+    monkeypatch.setattr(proxy, "hls_master_url", lambda vid: http_server.url + "/master.m3u8")
+    nested = proxy.video_media("v", 0).strip().splitlines()[-1].rsplit("/", 1)[1]
+    assert proxy.TOKEN.fullmatch(nested) and "-" not in nested
+    inner = proxy.media_text("v", nested.replace(".", "-"), proxy.token_url("v", nested))
+    seg = [l for l in inner.splitlines() if l.startswith("/hlsseg/")][1].rsplit("/", 1)[1]
+    assert seg == nested.replace(".", "-") + ".8"
+    fresh_tables()
+    assert proxy.token_url("v", seg) == http_server.url + "/nested/seg8.ts"
+    assert proxy.URL_TABLE.get(f"v/{seg}") == http_server.url + "/nested/seg8.ts"
+
+
+@pytest.mark.parametrize("tok", [
+    "0" + "-1" * 1000 + ".1",      # nested far deeper than any playlist goes
+    "0-1-2-3-4-5.1",
+    "0-kzz.1",                     # not a hash
+    "x.1",
+    "0",
+    "0.",
+    "../0.1",
+])
+def test_token_url_refuses_malformed_tokens_before_any_lookup(proxy, monkeypatch, fresh_tables, tok):
+    lookups = []
+    monkeypatch.setattr(proxy.URL_TABLE, "get", lambda k: lookups.append(k))
+    assert proxy.token_url("v", tok) is None
+    assert lookups == []
+    assert proxy.app.test_client().get(f"/hlsseg/v/{tok}").status_code == 404
+
+
+def test_token_url_of_an_unknown_playlist_is_none(proxy, monkeypatch, fresh_tables):
+    monkeypatch.setattr(proxy, "hls_master_url", lambda vid: None)
+    assert proxy.token_url("v", "m.3") is None
+    assert proxy.token_url("v", "m-k03c07c6a9f.7") is None
+
+
+class QueuedPool:
+    """Prefetcher pool that keeps submitted jobs until the test runs them."""
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, *args):
+        self.jobs.append((fn, args))
+
+    def run(self):
+        jobs, self.jobs = self.jobs, []
+        for fn, args in jobs:
+            fn(*args)
+
+    def shutdown(self, wait=True):
+        pass
+
+
+@pytest.fixture
+def segments(proxy, http_server, tmp_path):
+    """A segment cache and ten 1000-byte segments served by `http_server`, seg<i>.ts for i in 0..9."""
+    for i in range(10):
+        http_server.routes[f"/seg{i}.ts"] = (200, {"Content-Length": "1000"}, [bytes([i]) * 1000], 0)
+    cache = proxy.SegmentCache(str(tmp_path / "segments"), 1 << 20, 1 << 16)
+    cache.urls = [f"{http_server.url}/seg{i}.ts" for i in range(10)]
+    return cache
+
+
+def prefetcher(proxy, cache, ahead=3, workers=4, per_session=8, idle=60):
+    pf = proxy.Prefetcher(cache, ahead, workers, per_session, idle)
+    pf.register("v.0", 0, cache.urls)
+    return pf
+
+
+def test_prefetcher_warms_the_segments_after_the_playhead(proxy, segments):
+    pf = prefetcher(proxy, segments)
+    pf.on_request("viewer", "v.0", 2)
+    pf.close()
+    cached = [i for i, u in enumerate(segments.urls) if segments.get(proxy.seg_key(u), count=False)]
+    assert cached == [3, 4, 5]
+    assert pf.stats()["scheduled"] == pf.stats()["fetched"] == 3
+
+
+def test_prefetcher_skips_cached_segments_and_caps_each_viewer(proxy, segments):
+    segments.fill(proxy.seg_key(segments.urls[1]), segments.urls[1])
+    pf = prefetcher(proxy, segments, per_session=2)
+    pf._pool = QueuedPool()
+    pf.on_request("viewer", "v.0", 0)
+    assert [args[2] for _, args in pf._pool.jobs] == [2, 3]  # 1 is cached, 4 is over the viewer's cap
+    pf.on_request("other", "v.0", 0)
+    assert len(pf._pool.jobs) == 4
+    pf._pool.run()
+    assert pf.stats()["fetched"] == 4
+
+
+def test_prefetcher_drops_jobs_behind_a_seek(proxy, segments):
+    pf = prefetcher(proxy, segments, workers=6)
+    pf._pool = QueuedPool()
+    pf.on_request("viewer", "v.0", 0)  # queues 1, 2, 3
+    pf.on_request("viewer", "v.0", 6)  # queues 7, 8, 9
+    pf._pool.run()
+    stats = pf.stats()
+    assert (stats["scheduled"], stats["cancelled"], stats["fetched"]) == (6, 3, 3)
+    assert [i for i, u in enumerate(segments.urls) if segments.get(proxy.seg_key(u), count=False)] == [7, 8, 9]
+
+
+def test_prefetcher_counts_busy_when_every_worker_is_taken(proxy, segments):
+    pf = prefetcher(proxy, segments, workers=1)
+    pf._pool = QueuedPool()
+    pf.on_request("viewer", "v.0", 0)
+    assert pf.stats()["scheduled"] == 1 and pf.stats()["busy"] == 1
+    pf._pool.run()
+    pf.on_request("viewer", "v.0", 0)  # the slot is free again
+    assert pf.stats()["scheduled"] == 2
+
+
+def test_prefetcher_counters_are_exact_under_concurrency(proxy, segments):
+    import threading
+
+    pf = prefetcher(proxy, segments)
+    threads = [threading.Thread(target=lambda: [pf.record(150.0, False) for _ in range(2000)]) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    pf.close()
+    waits = pf.stats()["waits"]
+    assert (waits["requests"], waits["over_100ms"], waits["ready"]) == (16000, 16000, 0)
+    assert waits["total_ms"] == 16000 * 150.0
+
+
+class Body:
+    """A response body that records close()."""
+    def __init__(self, chunks, fail_after=None):
+        self.chunks, self.fail_after, self.closed = list(chunks), fail_after, False
+
+    def __iter__(self):
+        for n, chunk in enumerate(self.chunks):
+            if n == self.fail_after:
+                raise ConnectionError("reset by peer")
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize("total, body", [
+    (None, Body([b"x" * 5000])),
+    (0, Body([])),
+    (None, Body([b"x", b"y"], fail_after=1)),
+    (5000, Body([b"x" * 5000 + b"extra"])),  # longer than the range: the reader stops early
+])
+def test_fetch_ranges_closes_the_first_response(proxy, monkeypatch, tmp_path, total, body):
+    monkeypatch.setattr(proxy, "DL_RANGE_RETRIES", 0)
+    try:
+        proxy.fetch_ranges(lambda a, b: (total, body), str(tmp_path / "out"), 3, 8192)
+    except ConnectionError:
+        assert body.fail_after is not None
+    assert body.closed
+
+
+def test_unread_range_response_goes_back_to_the_pool(proxy, monkeypatch, http_server):
+    import requests
+
+    http_server.routes["/file"] = (206, {"Content-Length": "4", "Content-Range": "bytes 0-3/8"}, [b"abcd"], 0)
+    session = requests.Session()
+    session.mount("http://", proxy.PoolAdapter(pool_connections=1, pool_maxsize=1, pool_block=True))
+    monkeypatch.setattr(proxy, "upstream", lambda: session)
+    monkeypatch.setattr(proxy, "UP_POOL_WAIT", 0.5)
+    open_range = proxy.up_range(http_server.url + "/file")
+    total, chunks = open_range(0, 3)
+    assert total == 8
+    proxy.close_chunks(chunks)  # never read
+    total, chunks = open_range(0, 3)  # the only connection is free again
+    assert b"".join(chunks) == b"abcd"
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, (200, 0, 999)),
+    ("bytes=0-99", (206, 0, 99)),
+    ("bytes=900-5000", (206, 900, 999)),   # end clamped to the body
+    ("bytes=500-", (206, 500, 999)),       # open-ended
+    ("bytes=-100", (206, 900, 999)),       # suffix
+    ("bytes=-5000", (206, 0, 999)),        # suffix longer than the body
+    ("bytes=1000-", (416, 0, -1)),         # starts past the end
+    ("bytes=20-10", (416, 0, -1)),         # inverted
+    ("bytes=-", (200, 0, 999)),            # malformed: whole body
+    ("bytes=0-1,5-6", (200, 0, 999)),      # multiple ranges are not supported
+    ("items=0-1", (200, 0, 999)),
+])
+def test_range_of(proxy, header, expected):
+    assert proxy.range_of(header, 1000) == expected
+
+
+def test_segment_cache_readers_follow_a_fill_in_progress(proxy, http_server, tmp_path):
+    half = 1 << 16
+    http_server.routes["/slow.ts"] = (200, {"Content-Length": str(2 * half)}, [b"a" * half, b"b" * half], 0.5)
+    cache = proxy.SegmentCache(str(tmp_path), 1 << 20, 1 << 18)
+    u = http_server.url + "/slow.ts"
+    key = proxy.seg_key(u)
+    fl = cache.start(key, u)
+    assert cache.start(key, u) is fl  # a second viewer joins the fill
+    reader = fl.open()
+    first = reader.read(2 * half)
+    assert first and set(first) == {ord("a")} and not fl.done  # read before the second half is sent
+    rest = b"".join(iter(lambda: reader.read(2 * half), b""))
+    reader.close()
+    assert first + rest == b"a" * half + b"b" * half
+    assert fl.wait().size == 2 * half
+    assert cache.get(key) == fl.seg and open(fl.seg.path, "rb").read() == first + rest
+    assert cache.start(key, u).done
+
+
+def test_segment_cache_fill_of_a_truncated_segment_fails(proxy, http_server, tmp_path):
+    import time
+
+    http_server.routes["/short.ts"] = (200, {"Content-Length": "1000"}, [b"a" * 500], 0)
+    cache = proxy.SegmentCache(str(tmp_path), 1 << 20, 1 << 16)
+    u = http_server.url + "/short.ts"
+    fl = cache.start(proxy.seg_key(u), u)
+    with pytest.raises(Exception, match="IncompleteRead"):
+        reader = fl.open()  # raises too if the fill already failed
+        while reader.read(1000):
+            pass
+    with pytest.raises(Exception, match="IncompleteRead"):
+        fl.wait()
+    assert cache.get(proxy.seg_key(u)) is None
+    deadline = time.monotonic() + 2
+    while cache._filling and time.monotonic() < deadline:  # the fill thread cleans up after failing
+        time.sleep(0.01)
+    assert not list(tmp_path.rglob("*.tmp"))
+
+
+@pytest.mark.parametrize("status, headers", [
+    (404, {"Content-Length": "0"}),
+    (200, {"Content-Length": "2000"}),                             # larger than an item may be
+    (200, {"Content-Length": "10", "Content-Encoding": "gzip"}),
+])
+def test_segment_cache_refuses_uncacheable_answers(proxy, http_server, tmp_path, status, headers):
+    http_server.routes["/seg.ts"] = (status, headers, [b"x" * int(headers["Content-Length"])], 0)
+    cache = proxy.SegmentCache(str(tmp_path), 1 << 20, 1000)
+    assert cache.fill(proxy.seg_key(http_server.url + "/seg.ts"), http_server.url + "/seg.ts") is None
+
+
+def test_segment_cache_evicts_the_least_recently_used(proxy, http_server, tmp_path):
+    cache = proxy.SegmentCache(str(tmp_path), 2500, 1000)
+    urls = []
+    for i in range(3):
+        http_server.routes[f"/s{i}.ts"] = (200, {"Content-Length": "1000"}, [b"x" * 1000], 0)
+        urls.append(http_server.url + f"/s{i}.ts")
+    keys = [proxy.seg_key(u) for u in urls]
+    cache.fill(keys[0], urls[0])
+    cache.fill(keys[1], urls[1])
+    cache.get(keys[0])  # 1 is now the oldest
+    cache.fill(keys[2], urls[2])
+    assert [bool(cache.get(k, count=False)) for k in keys] == [True, False, True]
+    assert cache.stats()["evictions"] == 1 and cache.bytes == 2000
+    reloaded = proxy.SegmentCache(str(tmp_path), 2500, 1000)  # a restart indexes what is on disk
+    assert {k for k in keys if reloaded.get(k, count=False)} == {keys[0], keys[2]}
+
+
+def test_flight_shares_one_execution(proxy):
+    import threading
+    import time
+
+    flight, release, calls, out = proxy.Flight(), threading.Event(), [], []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return calls
+
+    threads = [threading.Thread(target=lambda: out.append(flight.do("k", fn))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while flight.stats()["shared"] < 3 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1 and all(res is calls for res in out) and len(out) == 4
+    assert flight.stats() == {"executed": 1, "shared": 3, "in_flight": 0}